@@ -20,6 +20,10 @@ def create_app(config_name=None):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     
+    # JSON responses are encoded with orjson, including numpy and pandas values
+    from app.json_provider import OrjsonProvider
+    app.json = OrjsonProvider(app)
+    
     # Initialize extensions
     db.init_app(app)
     login_manager.init_app(app)
@@ -89,6 +93,13 @@ def create_app(config_name=None):
     from app import cli
     cli.init_app(app)
     
+    # Configure the parsed sheet, aggregation and chat prompt caches
+    from app.main import excel_cache, excel_pivot
+    from app.api import chat_service
+    excel_cache.init_app(app)
+    excel_pivot.init_app(app)
+    chat_service.init_app(app)
+    
     @app.route('/set-language/<language>')
     def set_language(language=None):
         """Set the user's language preference"""
@@ -342,7 +342,18 @@ def system():
         'openai_configured': bool(current_app.config.get('OPENAI_API_KEY'))
     }
     
-    return render_template('admin/system.html', title=_('System Settings'), system_info=system_info)
+    # Hit/miss counters and memory use of the in-process caches
+    from app.main.excel_cache import cache_stats
+    from app.main.excel_pivot import pivot_cache_stats
+    from app.api.chat_service import prompt_cache_stats
+    cache_info = [
+        (_('Parsed sheets'), cache_stats()),
+        (_('Pivot results'), pivot_cache_stats()),
+        (_('Chat prompt contexts'), prompt_cache_stats())
+    ]
+    
+    return render_template('admin/system.html', title=_('System Settings'), system_info=system_info,
+                           cache_info=cache_info)
 
 @bp.route('/file/<int:file_id>/toggle-status', methods=['GET', 'POST'])
 @login_required
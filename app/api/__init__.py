@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('api', __name__)
 
-from app.api import routes, excel_api, ai_actions, voice_api
+from app.api import routes, excel_api, ai_actions, voice_api, upload_api, http_cache
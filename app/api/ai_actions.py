@@ -3,7 +3,8 @@ from flask_login import login_required, current_user
 import re
 
 from app.models import ExcelFile, ChatSession, ChatMessage, MessageType
-from app.main.excel_service import modify_excel_data, add_excel_row, delete_excel_row, can_perform_action
+from app.main.excel_service import modify_excel_data, add_excel_row, delete_excel_row, can_perform_action, update_sheet_metadata
+from app.main.storage import ensure_private_file
 from app import db
 
 bp = Blueprint('ai_actions', __name__, url_prefix='/ai-actions')
@@ -85,7 +86,9 @@ def process_message():
                 'error': 'Для обновления ячейки необходимы параметры: row_index, column, value'
             }), 400
         
-        result, error = modify_excel_data(excel_file.file_path, sheet_name, int(row_index), column, value)
+        result, error = modify_excel_data(ensure_private_file(excel_file), sheet_name, int(row_index), column, value)
+        if result:
+            update_sheet_metadata(excel_file, sheet_name, 'update_cell', int(row_index))
         
     elif action_type == 'add_row':
         if not can_perform_action(excel_file, 'write'):
@@ -103,7 +106,9 @@ def process_message():
                 'error': 'Для добавления строки необходим параметр row_data'
             }), 400
         
-        result, error = add_excel_row(excel_file.file_path, sheet_name, row_data)
+        result, error = add_excel_row(ensure_private_file(excel_file), sheet_name, row_data)
+        if result:
+            update_sheet_metadata(excel_file, sheet_name, 'add_row', row_data=row_data)
         
     elif action_type == 'delete_row':
         if not can_perform_action(excel_file, 'delete'):
@@ -121,7 +126,9 @@ def process_message():
                 'error': 'Для удаления строки необходим параметр row_index'
             }), 400
         
-        result, error = delete_excel_row(excel_file.file_path, sheet_name, int(row_index))
+        result, error = delete_excel_row(ensure_private_file(excel_file), sheet_name, int(row_index))
+        if result:
+            update_sheet_metadata(excel_file, sheet_name, 'delete_row', int(row_index))
         
     else:
         return jsonify({
@@ -220,9 +227,10 @@ def parse_ai_message():
             
             # Выполняем обновление
             sheet_name = None  # В будущем можно добавить извлечение имени листа из текста
-            result, error = modify_excel_data(excel_file.file_path, sheet_name, row_index, column, value)
+            result, error = modify_excel_data(ensure_private_file(excel_file), sheet_name, row_index, column, value)
             
             if result:
+                update_sheet_metadata(excel_file, sheet_name, 'update_cell', row_index)
                 actions_performed.append(f"Updated row {row_index+1}, column '{column}' to '{value}'")
             else:
                 errors.append(f"Failed to update cell: {error}")
@@ -245,9 +253,10 @@ def parse_ai_message():
             
             if row_data:
                 sheet_name = None
-                result, error = add_excel_row(excel_file.file_path, sheet_name, row_data)
+                result, error = add_excel_row(ensure_private_file(excel_file), sheet_name, row_data)
                 
                 if result:
+                    update_sheet_metadata(excel_file, sheet_name, 'add_row', row_data=row_data)
                     actions_performed.append(f"Added new row with data: {row_data}")
                 else:
                     errors.append(f"Failed to add row: {error}")
@@ -259,9 +268,10 @@ def parse_ai_message():
             row_index = int(match.group(1)) - 1  # Преобразуем из 1-индексации в 0-индексацию
             
             sheet_name = None
-            result, error = delete_excel_row(excel_file.file_path, sheet_name, row_index)
+            result, error = delete_excel_row(ensure_private_file(excel_file), sheet_name, row_index)
             
             if result:
+                update_sheet_metadata(excel_file, sheet_name, 'delete_row', row_index)
                 actions_performed.append(f"Deleted row {row_index+1}")
             else:
                 errors.append(f"Failed to delete row: {error}")
@@ -0,0 +1,156 @@
+"""
+Token-budgeted conversation history for chat requests
+
+The most recent turns of a session are sent verbatim as long as they fit
+in CHAT_HISTORY_MAX_TOKENS; the turns before them are replaced by a
+rolling summary. The summary is stored in the extra_data of the last
+message it covers, so each turn is summarized once: when more turns fall
+out of the window, they are folded into the latest stored summary.
+
+Tokens are counted with tiktoken when it is installed and its encoding
+can be loaded, otherwise estimated as one token per four characters.
+"""
+import math
+
+import openai
+from flask import current_app
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken is optional, the estimate is the fallback
+    tiktoken = None
+
+DEFAULT_MODEL = 'gpt-3.5-turbo'
+MESSAGE_OVERHEAD = 4  # role and separators of every chat message
+SUMMARY_KEY = 'history_summary'
+
+_encodings = {}
+
+
+def _encoding(model):
+    """The tokenizer of a model, or None to use the estimate"""
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            # The BPE files are downloaded on first use; offline the estimate is used from now on
+            current_app.logger.warning(f"Tokenizer for {model} unavailable, estimating tokens: {str(e)}")
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text, max_tokens, model=DEFAULT_MODEL):
+    """The end of a text that fits in max_tokens"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[-max_tokens * 4:] if max_tokens > 0 else ''
+    tokens = encoding.encode(text)
+    return encoding.decode(tokens[-max_tokens:]) if max_tokens > 0 else ''
+
+
+def message_tokens(message, model=DEFAULT_MODEL):
+    return count_tokens(message.content, model) + MESSAGE_OVERHEAD
+
+
+def _chat_message(message):
+    return {"role": "user" if message.is_user_message else "assistant", "content": message.content}
+
+
+def _transcript(messages):
+    return '\n'.join(f"{'User' if m.is_user_message else 'Assistant'}: {m.content}" for m in messages)
+
+
+def _extractive_summary(previous, messages, max_tokens, model):
+    """Summary without a model call: the previous summary and the new turns, shortened"""
+    lines = [previous] if previous else []
+    for message in messages:
+        content = ' '.join(message.content.split())
+        if len(content) > 300:
+            content = content[:297] + '...'
+        lines.append(f"{'User' if message.is_user_message else 'Assistant'}: {content}")
+    return truncate_tokens('\n'.join(lines), max_tokens, model)
+
+
+def summarize_turns(previous, messages, max_tokens, model=DEFAULT_MODEL):
+    """Fold turns into the running summary of a conversation"""
+    if current_app.config.get('BYPASS_OPENAI', False) or not current_app.config.get('OPENAI_API_KEY'):
+        return _extractive_summary(previous, messages, max_tokens, model)
+
+    try:
+        openai.api_key = current_app.config['OPENAI_API_KEY']
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "You maintain the running summary of a conversation between a user "
+                                              "and an assistant analysing an Excel file. Keep the facts, numbers, "
+                                              "changes made to the data, decisions and open questions. Reply with "
+                                              "the updated summary only, in the language of the conversation."},
+                {"role": "user", "content": f"Current summary:\n{previous or '(none)'}\n\n"
+                                            f"New turns:\n{_transcript(messages)}"}
+            ],
+            max_tokens=max_tokens,
+            temperature=0.2,
+            stream=False
+        )
+        return truncate_tokens(response.choices[0].message.content.strip(), max_tokens, model)
+    except Exception as e:
+        current_app.logger.warning(f"History summary failed, using an extract: {str(e)}")
+        return _extractive_summary(previous, messages, max_tokens, model)
+
+
+def build_history(messages, max_tokens=None, summary_tokens=None, model=DEFAULT_MODEL):
+    """
+    Chat messages for the history of a session, oldest first.
+
+    messages are the stored messages before the current question. Returns
+    the recent turns that fit in the budget, preceded by a system message
+    with the summary of the older ones. A new summary is stored on the
+    last message it covers; the caller commits.
+    """
+    if max_tokens is None:
+        max_tokens = current_app.config.get('CHAT_HISTORY_MAX_TOKENS', 3000)
+    if summary_tokens is None:
+        summary_tokens = current_app.config.get('CHAT_SUMMARY_MAX_TOKENS', 400)
+
+    # Newest turns first, until the budget is used up
+    used = 0
+    split = len(messages)
+    while split > 0:
+        cost = message_tokens(messages[split - 1], model)
+        reserve = summary_tokens + MESSAGE_OVERHEAD if split > 1 else 0
+        if used + cost + reserve > max_tokens:
+            break
+        used += cost
+        split -= 1
+
+    recent = [_chat_message(message) for message in messages[split:]]
+    older = messages[:split]
+    if not older:
+        return recent
+
+    # Latest stored summary among the older turns, and the turns after it
+    summary, covered = None, 0
+    for position in range(len(older) - 1, -1, -1):
+        summary = older[position].get_extra_data().get(SUMMARY_KEY)
+        if summary is not None:
+            covered = position + 1
+            break
+
+    pending = older[covered:]
+    if pending:
+        summary = summarize_turns(summary, pending, summary_tokens, model)
+        older[-1].set_extra_data(**{SUMMARY_KEY: summary})
+
+    return [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}] + recent
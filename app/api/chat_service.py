@@ -1,9 +1,23 @@
 import openai
 import os
+import re
 import json
 from flask import current_app
 from flask_babel import gettext as _
-from app.main.utils import get_excel_summary, load_excel_data
+from app.api.chat_history import build_history
+from app.main.excel_cache import MemoryLRUCache
+from app.main.utils import get_file_summary, get_sheet_profile, load_excel_data
+
+# System prompt and file context of a chat turn, keyed by the file data version
+# (edits bump it), ingestion state, language, permission mode and sheet
+PROMPT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+_prompt_cache = MemoryLRUCache(PROMPT_CACHE_MAX_BYTES)
+
+def init_app(app):
+    _prompt_cache.max_bytes = app.config.get('PROMPT_CACHE_MAX_BYTES', PROMPT_CACHE_MAX_BYTES)
+
+def prompt_cache_stats():
+    return _prompt_cache.stats()
 
 def get_system_prompt(language='en', excel_file=None):
     """Get system prompt for chat assistant in specified language"""
@@ -97,53 +111,152 @@ Konzentrieren Sie sich bei der Datenanalyse auf praktische Einblicke und umsetzb
     
     return prompts.get(language, prompts['en'])
 
-def format_excel_data_for_prompt(excel_file, sheet_name=None, max_rows=100):
-    """Format Excel data for inclusion in chat prompt"""
-    try:
-        # Get file summary
-        summary, error = get_excel_summary(excel_file.file_path)
+def format_column_stats(profile, indent='  '):
+    """Format stored column statistics as compact prompt lines"""
+    if not profile:
+        return ''
+    lines = []
+    for name, column in profile['columns'].items():
+        line = f"{indent}{name} ({column['dtype']}): {column['count']} values, {column['null_count']} empty, ~{column['distinct']} distinct"
+        if 'min' in column:
+            line += f", min {column['min']}, max {column['max']}"
+        if 'mean' in column:
+            line += f", mean {column['mean']:.4g}"
+        if column.get('quantiles'):
+            line += ", quartiles " + '/'.join(f"{value:.4g}" for value in column['quantiles'].values())
+        if column.get('top') and column['distinct'] < column['count']:
+            line += ", top: " + ', '.join(f"{value} ({count})" for value, count in column['top'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+def _format_excel_data(excel_file, sheet_name=None, max_rows=100):
+    """Format Excel data for inclusion in chat prompt; raises ValueError if the file cannot be read"""
+    # Get file summary from stored sheet metadata
+    summary, error = get_file_summary(excel_file)
+    if error:
+        raise ValueError(f"Error loading file data: {error}")
+    
+    # Get specific sheet data if requested
+    if sheet_name:
+        data, error = load_excel_data(excel_file.file_path, sheet_name, max_rows)
         if error:
-            return f"Error loading file data: {error}"
+            raise ValueError(f"Error loading sheet data: {error}")
         
-        # Get specific sheet data if requested
-        if sheet_name:
-            data, error = load_excel_data(excel_file.file_path, sheet_name, max_rows)
-            if error:
-                return f"Error loading sheet data: {error}"
-            
-            formatted_data = f"""
+        formatted_data = f"""
 File: {excel_file.original_filename}
 Sheet: {sheet_name}
-Columns: {', '.join(data['columns'])}
+Columns: {', '.join(map(str, data['columns']))}
 Total Rows: {data['total_rows']}
 Data Types: {json.dumps(data['dtypes'], indent=2)}
+Column Statistics:
+{format_column_stats(get_sheet_profile(excel_file, sheet_name))}
 
 Sample Data (first {min(len(data['data']), max_rows)} rows):
 {json.dumps(data['data'][:max_rows], indent=2)}
 """
-        else:
-            # Provide general file summary
-            formatted_data = f"""
+    else:
+        # Provide general file summary
+        formatted_data = f"""
 File: {excel_file.original_filename}
 Sheets: {', '.join(summary['file_info']['sheet_names'])}
 Total Sheets: {summary['file_info']['sheet_count']}
 
 Sheet Summaries:
 """
-            for sheet_name, sheet_info in summary['sheets'].items():
-                formatted_data += f"""
+        for sheet_name, sheet_info in summary['sheets'].items():
+            formatted_data += f"""
 - {sheet_name}: {sheet_info['row_count']} rows, {sheet_info['column_count']} columns
-  Columns: {', '.join(sheet_info['columns'])}
+  Columns: {', '.join(map(str, sheet_info['columns']))}
+  Column Statistics:
+{format_column_stats(get_sheet_profile(excel_file, sheet_name), indent='    ')}
 """
-        
-        return formatted_data.strip()
-        
+    
+    return formatted_data.strip()
+
+def format_excel_data_for_prompt(excel_file, sheet_name=None, max_rows=100):
+    """Format Excel data for inclusion in chat prompt"""
+    try:
+        return _format_excel_data(excel_file, sheet_name, max_rows)
+    except ValueError as e:
+        return str(e)
     except Exception as e:
         current_app.logger.error(f"Error formatting Excel data: {str(e)}")
         return f"Error formatting file data: {str(e)}"
 
+def get_prompt_context(excel_file, language='en', sheet_name=None):
+    """
+    System messages of a chat turn: the assistant prompt and the file context.
+
+    Cached until the file data changes, so follow-up questions do not read
+    the workbook; a context that failed to load is not cached.
+    """
+    key = ('prompt', excel_file.id, excel_file.version, excel_file.ingest_status.name,
+           language, excel_file.permission_mode.value, sheet_name)
+    cached = _prompt_cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        excel_context = _format_excel_data(excel_file, sheet_name)
+        cacheable = True
+    except Exception:
+        # The error is sent to the model as it is, but not cached
+        excel_context = format_excel_data_for_prompt(excel_file, sheet_name)
+        cacheable = False
+
+    prompt_messages = [
+        {"role": "system", "content": get_system_prompt(language, excel_file)},
+        {"role": "system", "content": f"Here is the Excel file data you're working with:\n\n{excel_context}"}
+    ]
+    if cacheable:
+        _prompt_cache.put(key, prompt_messages, sum(len(m['content'].encode('utf-8')) for m in prompt_messages))
+    return prompt_messages
+
+def _mock_response(excel_file, language, user_question):
+    mock_responses = {
+        'en': f"This is a mock response for development mode. Your question was: '{user_question}'. In a real implementation, this would analyze your Excel file '{excel_file.original_filename if excel_file else 'unknown'}' and provide insights.",
+        'de': f"Dies ist eine Mock-Antwort für den Entwicklungsmodus. Ihre Frage war: '{user_question}'. In einer echten Implementierung würde Ihre Excel-Datei '{excel_file.original_filename if excel_file else 'unbekannt'}' analysiert und Einblicke bereitgestellt.",
+        'ru': f"Это тестовый ответ для режима разработки. Ваш вопрос был: '{user_question}'. В реальной реализации это проанализировало бы ваш Excel-файл '{excel_file.original_filename if excel_file else 'неизвестно'}' и предоставило бы понимание."
+    }
+    return mock_responses.get(language, mock_responses['en'])
+
+def build_conversation(messages, excel_file, language='en', user_question=None):
+    """Messages of a chat completion request"""
+    # System prompt and Excel file context, cached per file version
+    conversation_messages = list(get_prompt_context(excel_file, language))
+    
+    # Add conversation history: recent turns within the token budget, older ones summarized
+    conversation_messages.extend(build_history(messages or []))
+    
+    # Add current user question if provided
+    if user_question:
+        conversation_messages.append({
+            "role": "user",
+            "content": user_question
+        })
+    return conversation_messages
+
+def _error_message(e):
+    """User-facing message for an error of a chat completion"""
+    if isinstance(e, openai.error.AuthenticationError):
+        return _("OpenAI API authentication failed")
+    if isinstance(e, openai.error.RateLimitError):
+        return _("OpenAI API rate limit exceeded. Please try again later.")
+    if isinstance(e, openai.error.APIError):
+        current_app.logger.error(f"OpenAI API error: {str(e)}")
+        return _("OpenAI API error. Please try again later.")
+    current_app.logger.error(f"Chat response error: {str(e)}")
+    return _("Error generating response. Please try again.")
+
+class ChatError(Exception):
+    """A chat response failed; the message can be shown to the user"""
+
 def get_chat_response(messages, excel_file, language='en', user_question=None):
-    """Get response from OpenAI chat completion"""
+    """
+    Get response from OpenAI chat completion
+    
+    messages are the stored messages of the session before user_question.
+    """
     try:
         current_app.logger.info(f"Chat request received: language={language}, user_question={user_question}")
         current_app.logger.debug(f"Excel file: {excel_file.filename if excel_file else 'None'}")
@@ -155,12 +268,7 @@ def get_chat_response(messages, excel_file, language='en', user_question=None):
         
         if bypass_mode:
             current_app.logger.info("Using mock response for development mode")
-            mock_responses = {
-                'en': f"This is a mock response for development mode. Your question was: '{user_question}'. In a real implementation, this would analyze your Excel file '{excel_file.original_filename if excel_file else 'unknown'}' and provide insights.",
-                'de': f"Dies ist eine Mock-Antwort für den Entwicklungsmodus. Ihre Frage war: '{user_question}'. In einer echten Implementierung würde Ihre Excel-Datei '{excel_file.original_filename if excel_file else 'unbekannt'}' analysiert und Einblicke bereitgestellt.",
-                'ru': f"Это тестовый ответ для режима разработки. Ваш вопрос был: '{user_question}'. В реальной реализации это проанализировало бы ваш Excel-файл '{excel_file.original_filename if excel_file else 'неизвестно'}' и предоставило бы понимание."
-            }
-            response = mock_responses.get(language, mock_responses['en'])
+            response = _mock_response(excel_file, language, user_question)
             current_app.logger.info(f"Mock response generated: {response[:50]}...")
             return response, None
         
@@ -169,37 +277,10 @@ def get_chat_response(messages, excel_file, language='en', user_question=None):
         if not openai.api_key:
             return None, _("OpenAI API key not configured")
         
-        # Build conversation messages
-        conversation_messages = [
-            {"role": "system", "content": get_system_prompt(language, excel_file)}
-        ]
-        
-        # Add Excel file context
-        excel_context = format_excel_data_for_prompt(excel_file)
-        conversation_messages.append({
-            "role": "system", 
-            "content": f"Here is the Excel file data you're working with:\n\n{excel_context}"
-        })
-        
-        # Add conversation history
-        for msg in messages:
-            role = "user" if msg.is_user_message else "assistant"
-            conversation_messages.append({
-                "role": role,
-                "content": msg.content
-            })
-        
-        # Add current user question if provided
-        if user_question:
-            conversation_messages.append({
-                "role": "user",
-                "content": user_question
-            })
-        
         # Get response from OpenAI
         response = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
-            messages=conversation_messages,
+            messages=build_conversation(messages, excel_file, language, user_question),
             max_tokens=1000,
             temperature=0.7,
             stream=False
@@ -208,16 +289,46 @@ def get_chat_response(messages, excel_file, language='en', user_question=None):
         assistant_response = response.choices[0].message.content.strip()
         return assistant_response, None
         
-    except openai.error.AuthenticationError:
-        return None, _("OpenAI API authentication failed")
-    except openai.error.RateLimitError:
-        return None, _("OpenAI API rate limit exceeded. Please try again later.")
-    except openai.error.APIError as e:
-        current_app.logger.error(f"OpenAI API error: {str(e)}")
-        return None, _("OpenAI API error. Please try again later.")
     except Exception as e:
-        current_app.logger.error(f"Chat response error: {str(e)}")
-        return None, _("Error generating response. Please try again.")
+        return None, _error_message(e)
+
+def stream_chat_response(messages, excel_file, language='en', user_question=None):
+    """
+    Generate the assistant response piece by piece as OpenAI sends it.
+    
+    Raises ChatError. Closing the generator early (the client went away)
+    closes the upstream stream, which drops the connection to OpenAI and
+    with it the generation.
+    """
+    if current_app.config.get('BYPASS_OPENAI', False):
+        for word in re.findall(r'\S+\s*', _mock_response(excel_file, language, user_question)):
+            yield word
+        return
+    
+    openai.api_key = current_app.config['OPENAI_API_KEY']
+    if not openai.api_key:
+        raise ChatError(_("OpenAI API key not configured"))
+    
+    try:
+        upstream = openai.ChatCompletion.create(
+            model="gpt-3.5-turbo",
+            messages=build_conversation(messages, excel_file, language, user_question),
+            max_tokens=1000,
+            temperature=0.7,
+            stream=True
+        )
+    except Exception as e:
+        raise ChatError(_error_message(e)) from e
+    
+    try:
+        for chunk in upstream:
+            content = chunk.choices[0].delta.get('content') if chunk.choices else None
+            if content:
+                yield content
+    except Exception as e:
+        raise ChatError(_error_message(e)) from e
+    finally:
+        upstream.close()
 
 def transcribe_audio(audio_file_path, language='en'):
     """Transcribe audio using OpenAI Whisper"""
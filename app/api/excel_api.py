@@ -1,10 +1,22 @@
-from flask import Blueprint, jsonify, request, current_app
+import os
+from flask import jsonify, request, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 
+from app.api import bp
 from app.models import ExcelFile
-from app.main.excel_service import modify_excel_data, add_excel_row, delete_excel_row, can_perform_action
+from app.main.excel_service import (modify_excel_data, add_excel_row, delete_excel_row, can_perform_action,
+                                    update_sheet_metadata, apply_excel_operations, update_sheet_metadata_batch,
+                                    BATCH_ACTIONS)
+from app.main.excel_export import export_sheet, EXPORT_FORMATS
+from app.main.excel_query import query_sheet
+from app.main.column_profile import public_profile
+from app.main.excel_pivot import pivot_sheet
+from app.main.storage import ensure_private_file
+from app.api.http_cache import data_etag, not_modified, with_etag, data_response
+from app.main.wire_format import requested_format
 
-bp = Blueprint('api', __name__, url_prefix='/api')
+# Максимальное количество операций в одном пакетном запросе
+MAX_BATCH_OPERATIONS = 1000
 
 @bp.route('/excel/<int:file_id>/data', methods=['GET'])
 @login_required
@@ -14,6 +26,7 @@ def get_excel_data(file_id):
     
     GET параметры:
     - sheet: имя листа (опционально)
+    - format: 'records', 'columnar' или 'arrow' (также через заголовок Accept)
     """
     excel_file = ExcelFile.query.filter_by(id=file_id, user_id=current_user.id, is_active=True).first_or_404()
     
@@ -24,22 +37,221 @@ def get_excel_data(file_id):
             'error': 'У вас нет прав на чтение данного файла'
         }), 403
     
+    try:
+        fmt = requested_format(request)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    # Ответ не изменился с момента последнего запроса: файл не читается
+    etag = data_etag(excel_file, fmt)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
     sheet_name = request.args.get('sheet')
     
-    from app.main.utils import load_excel_data
-    data, error = load_excel_data(excel_file.file_path, sheet_name)
+    from app.main.utils import load_excel_data, load_excel_arrow_window
+    if fmt == 'arrow':
+        data, error = load_excel_arrow_window(excel_file.file_path, sheet_name, 0, 1000)
+    else:
+        data, error = load_excel_data(excel_file.file_path, sheet_name, fmt=fmt)
     
     if error:
         return jsonify({
             'success': False,
             'error': error
         }), 400
-        
+    
+    if fmt == 'arrow':
+        return with_etag(data_response(data, fmt), etag)
+    return with_etag(data_response({
+        'success': True,
+        'data': data
+    }, fmt), etag)
+
+@bp.route('/excel/<int:file_id>/export', methods=['GET'])
+@login_required
+def export_excel_data(file_id):
+    """
+    API для потоковой выгрузки всех строк листа
+    
+    GET параметры:
+    - format: 'csv' или 'ndjson' (по умолчанию 'csv')
+    - sheet: имя листа (опционально)
+    """
+    excel_file = ExcelFile.query.filter_by(id=file_id, user_id=current_user.id, is_active=True).first_or_404()
+    
+    # Проверяем права доступа
+    if not can_perform_action(excel_file, 'read'):
+        return jsonify({
+            'success': False,
+            'error': 'У вас нет прав на чтение данного файла'
+        }), 403
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f'Неподдерживаемый формат: {export_format}'
+        }), 400
+    
+    sheet_name = request.args.get('sheet')
+    # Ширина листа берется из сохраненных метаданных, без лишнего прохода по файлу
+    sheet = excel_file.get_sheet(sheet_name)
+    width = sheet.column_count if sheet is not None else None
+    try:
+        chunks = export_sheet(excel_file.file_path, sheet_name, export_format, width)
+    except LookupError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    # Строки читаются и отправляются по частям, лист целиком в памяти не собирается
+    download_name = f"{os.path.splitext(excel_file.original_filename)[0]}.{export_format}"
+    return Response(stream_with_context(chunks),
+                    mimetype=EXPORT_FORMATS[export_format],
+                    headers={'Content-Disposition': f'attachment; filename="{download_name}"'})
+
+@bp.route('/excel/<int:file_id>/query', methods=['POST'])
+@login_required
+def query_excel_data(file_id):
+    """
+    API для выборки строк листа с фильтрацией, сортировкой и выбором колонок
+    
+    JSON параметры:
+    - sheet: имя листа (опционально)
+    - columns: список возвращаемых колонок (опционально)
+    - filters: список условий {column, op: eq|ne|gt|gte|lt|lte|range|contains|in, value|values|min|max}
+    - sort: список {column, direction: asc|desc}
+    - limit, offset: окно результата
+    """
+    excel_file = ExcelFile.query.filter_by(id=file_id, user_id=current_user.id, is_active=True).first_or_404()
+    
+    # Проверяем права доступа
+    if not can_perform_action(excel_file, 'read'):
+        return jsonify({
+            'success': False,
+            'error': 'У вас нет прав на чтение данного файла'
+        }), 403
+    
+    query = request.get_json(silent=True)
+    if not isinstance(query, dict):
+        return jsonify({
+            'success': False,
+            'error': 'Отсутствуют данные в запросе'
+        }), 400
+    
+    try:
+        data = query_sheet(excel_file.file_path, query.get('sheet'), query)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        current_app.logger.error(f"Excel query error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Не удалось выполнить запрос: {str(e)}'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'data': data
+    })
+
+@bp.route('/excel/<int:file_id>/pivot', methods=['POST'])
+@login_required
+def pivot_excel_data(file_id):
+    """
+    API для группировки строк листа с агрегатными функциями
+    
+    JSON параметры:
+    - sheet: имя листа (опционально)
+    - group_by: список колонок группировки (пустой - итог по всему листу)
+    - values: список агрегируемых колонок
+    - aggregates: список функций sum|mean|count|min|max|nunique (по умолчанию sum)
+    - sort_by, direction: сортировка по колонке результата, например 'Sales_sum'
+    - limit: максимальное количество групп в ответе
+    """
+    excel_file = ExcelFile.query.filter_by(id=file_id, user_id=current_user.id, is_active=True).first_or_404()
+    
+    # Проверяем права доступа
+    if not can_perform_action(excel_file, 'read'):
+        return jsonify({
+            'success': False,
+            'error': 'У вас нет прав на чтение данного файла'
+        }), 403
+    
+    spec = request.get_json(silent=True)
+    if not isinstance(spec, dict):
+        return jsonify({
+            'success': False,
+            'error': 'Отсутствуют данные в запросе'
+        }), 400
+    
+    try:
+        data = pivot_sheet(excel_file, spec.get('sheet'), spec)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        current_app.logger.error(f"Excel pivot error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Не удалось выполнить группировку: {str(e)}'
+        }), 500
+    
     return jsonify({
         'success': True,
         'data': data
     })
 
+@bp.route('/excel/<int:file_id>/profile', methods=['GET'])
+@login_required
+def get_excel_profile(file_id):
+    """
+    API для получения статистики по колонкам листа
+    
+    GET параметры:
+    - sheet: имя листа (опционально)
+    """
+    excel_file = ExcelFile.query.filter_by(id=file_id, user_id=current_user.id, is_active=True).first_or_404()
+    
+    # Проверяем права доступа
+    if not can_perform_action(excel_file, 'read'):
+        return jsonify({
+            'success': False,
+            'error': 'У вас нет прав на чтение данного файла'
+        }), 403
+    
+    from app.main.utils import get_sheet_profile
+    try:
+        profile = get_sheet_profile(excel_file, request.args.get('sheet'))
+    except Exception as e:
+        current_app.logger.error(f"Excel profile error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Не удалось получить статистику: {str(e)}'
+        }), 500
+    
+    if profile is None:
+        return jsonify({
+            'success': False,
+            'error': 'Лист не найден'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'profile': public_profile(profile)
+    })
+
 @bp.route('/excel/<int:file_id>/cell', methods=['PUT'])
 @login_required
 def update_excel_cell(file_id):
@@ -74,13 +286,15 @@ def update_excel_cell(file_id):
     column = data['column']
     value = data['value']
     
-    success, error = modify_excel_data(excel_file.file_path, sheet_name, row_index, column, value)
+    success, error = modify_excel_data(ensure_private_file(excel_file), sheet_name, row_index, column, value)
     
     if not success:
         return jsonify({
             'success': False,
             'error': error
         }), 400
+    
+    update_sheet_metadata(excel_file, sheet_name, 'update_cell', row_index)
         
     return jsonify({
         'success': True,
@@ -117,13 +331,19 @@ def add_row(file_id):
     sheet_name = data.get('sheet')
     row_data = data['data']
     
-    success, error = add_excel_row(excel_file.file_path, sheet_name, row_data)
+    # Новые значения проверяются по сохраненному заголовку листа
+    sheet_meta = excel_file.get_sheet(sheet_name)
+    header = sheet_meta.get_columns() if sheet_meta else None
+    
+    success, error = add_excel_row(ensure_private_file(excel_file), sheet_name, row_data, header)
     
     if not success:
         return jsonify({
             'success': False,
             'error': error
         }), 400
+    
+    update_sheet_metadata(excel_file, sheet_name, 'add_row', row_data=row_data)
         
     return jsonify({
         'success': True,
@@ -153,15 +373,80 @@ def delete_row(file_id, row_index):
     
     sheet_name = request.args.get('sheet')
     
-    success, error = delete_excel_row(excel_file.file_path, sheet_name, row_index)
+    success, error = delete_excel_row(ensure_private_file(excel_file), sheet_name, row_index)
     
     if not success:
         return jsonify({
             'success': False,
             'error': error
         }), 400
+    
+    update_sheet_metadata(excel_file, sheet_name, 'delete_row', row_index)
         
     return jsonify({
         'success': True,
         'message': 'Строка успешно удалена'
     })
+
+@bp.route('/excel/<int:file_id>/batch', methods=['POST'])
+@login_required
+def batch_update(file_id):
+    """
+    API для пакетного изменения данных за одну загрузку и одно сохранение файла
+    
+    JSON параметры:
+    - sheet: имя листа (опционально)
+    - operations: список операций, выполняемых по порядку:
+        {"action": "update_cell", "row": 0, "column": "A", "value": 1}
+        {"action": "add_row", "data": {column: value, ...}}
+        {"action": "delete_row", "row": 0}
+      Каждая операция может указать свой "sheet".
+    
+    Если хотя бы одна операция не выполнена, файл не изменяется.
+    """
+    excel_file = ExcelFile.query.filter_by(id=file_id, user_id=current_user.id, is_active=True).first_or_404()
+    
+    data = request.json
+    
+    if not data or not isinstance(data.get('operations'), list) or not data['operations']:
+        return jsonify({
+            'success': False,
+            'error': 'Отсутствует список операций operations'
+        }), 400
+    
+    operations = data['operations']
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({
+            'success': False,
+            'error': f'Слишком много операций (максимум {MAX_BATCH_OPERATIONS})'
+        }), 400
+    
+    # Проверяем права доступа для всех операций до выполнения
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('action') not in BATCH_ACTIONS:
+            return jsonify({
+                'success': False,
+                'error': f'Неизвестный тип операции: {operation.get("action") if isinstance(operation, dict) else operation}'
+            }), 400
+        if not can_perform_action(excel_file, BATCH_ACTIONS[operation['action']]):
+            return jsonify({
+                'success': False,
+                'error': 'У вас нет прав на выполнение этих изменений'
+            }), 403
+    
+    results, error = apply_excel_operations(ensure_private_file(excel_file), data.get('sheet'), operations)
+    
+    if error:
+        return jsonify({
+            'success': False,
+            'error': error,
+            'results': results
+        }), 400
+    
+    update_sheet_metadata_batch(excel_file, results, operations)
+    
+    return jsonify({
+        'success': True,
+        'message': f'Выполнено операций: {len(results)}',
+        'results': results
+    })
@@ -0,0 +1,111 @@
+"""
+Conditional GET and compression for API responses
+
+Sheet data responses carry a strong ETag derived from the file version and
+the query parameters, so a revalidation with If-None-Match is answered with
+304 before the file is read. Large JSON responses are compressed with
+brotli (if installed) or gzip; a compressed response gets its own ETag, as
+a strong validator must differ between content codings.
+"""
+import gzip
+import hashlib
+import json
+
+from flask import current_app, jsonify, request
+
+from app.api import bp
+from app.main.wire_format import ARROW_MIMETYPE, COLUMNAR_MIMETYPE
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional, gzip is always available
+    brotli = None
+
+CACHE_CONTROL = 'private, no-cache'
+COMPRESSIBLE_TYPES = {'application/json', COLUMNAR_MIMETYPE, ARROW_MIMETYPE}
+
+
+def _encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def data_etag(excel_file, *extra):
+    """ETag of a data response: file, data version, ingestion state and query parameters"""
+    key = json.dumps([
+        excel_file.id,
+        excel_file.version,
+        excel_file.ingest_status.name,
+        sorted(request.args.items(multi=True)),
+        extra
+    ], default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def matching_etag(etag):
+    """The tag from If-None-Match that matches a response, including its compressed variants"""
+    for candidate in [etag] + [f"{etag}-{encoding}" for encoding in _encodings()]:
+        if request.if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def not_modified(etag):
+    """Return a 304 response if the client already has this version, else None"""
+    matched = matching_etag(etag)
+    if matched is None:
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(matched)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    # The representation depends on the Accept header (see app.main.wire_format)
+    response.vary.add('Accept')
+    return response
+
+
+def data_response(payload, fmt):
+    """Response for sheet data in a wire format: a JSON payload, or {'body', 'total_rows'} for arrow"""
+    if fmt == 'arrow':
+        response = current_app.response_class(payload['body'], mimetype=ARROW_MIMETYPE)
+        response.headers['X-Total-Rows'] = str(payload['total_rows'])
+        return response
+    response = jsonify(payload)
+    if fmt == 'columnar':
+        response.mimetype = COLUMNAR_MIMETYPE
+    return response
+
+
+def _compress(data, encoding):
+    level = current_app.config.get('COMPRESS_LEVEL', 6)
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level)
+
+
+@bp.after_request
+def compress_response(response):
+    """Compress large JSON responses for clients that accept it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    data = response.get_data()
+    if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(_encodings())
+    if encoding is None:
+        return response
+
+    response.set_data(_compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
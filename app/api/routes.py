@@ -1,4 +1,4 @@
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, stream_with_context
 from flask_login import login_required, current_user
 from flask_babel import gettext as _, get_locale
 import os
@@ -8,7 +8,9 @@ from datetime import datetime
 from werkzeug.utils import secure_filename
 
 from app.api import bp
-from app.api.chat_service import get_chat_response, transcribe_audio
+from app.api.chat_service import ChatError, get_chat_response, stream_chat_response, transcribe_audio
+from app.api.http_cache import data_etag, not_modified, with_etag, data_response
+from app.main.wire_format import requested_format
 from app.models import ChatSession, ChatMessage, ExcelFile, Subscription, MessageType, SubscriptionStatus
 from app import db
 
@@ -59,6 +61,9 @@ def send_message():
         return jsonify({'error': _('No permission to access this file')}), 403
     
     try:
+        # Previous messages for context, without the question itself (it is passed separately)
+        previous_messages = chat_session.messages.order_by(ChatMessage.timestamp.asc()).all()
+        
         # Save user message
         user_message = ChatMessage(
             session_id=session_id,
@@ -69,9 +74,6 @@ def send_message():
         )
         db.session.add(user_message)
         
-        # Get previous messages for context
-        previous_messages = chat_session.messages.order_by(ChatMessage.timestamp.asc()).all()
-        
         # Get assistant response
         assistant_response, error = get_chat_response(
             previous_messages,
@@ -118,6 +120,116 @@ def send_message():
         current_app.logger.error(f"Chat send error: {str(e)}")
         return jsonify({'error': _('Error processing message')}), 500
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@bp.route('/chat/stream', methods=['POST'])
+@login_required
+def stream_message():
+    """
+    Send a text message to chat assistant and stream the answer as Server-Sent Events
+    
+    Events: start (the saved user message), token ({'token': text}) for every
+    piece of the answer, then done (the saved assistant message) or error.
+    """
+    if not current_user.can_access_system():
+        return jsonify({'error': _('Access denied')}), 403
+    
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id')
+    message_content = (data.get('message') or '').strip()
+    
+    if not session_id or not message_content:
+        return jsonify({'error': _('Invalid request data')}), 400
+    
+    chat_session = ChatSession.query.filter_by(
+        id=session_id,
+        user_id=current_user.id,
+        is_active=True
+    ).first()
+    
+    if not chat_session:
+        return jsonify({'error': _('Chat session not found')}), 404
+    
+    if not chat_session.excel_file.can_read():
+        return jsonify({'error': _('No permission to access this file')}), 403
+    
+    language = str(get_locale())
+    try:
+        # Previous messages for context, without the question itself (it is passed separately)
+        previous_messages = chat_session.messages.order_by(ChatMessage.timestamp.asc()).all()
+        
+        # The question is saved before the answer starts
+        user_message = ChatMessage(
+            session_id=chat_session.id,
+            message_type=MessageType.TEXT,
+            content=message_content,
+            language=language,
+            is_user_message=True
+        )
+        db.session.add(user_message)
+        chat_session.last_activity = datetime.utcnow()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Chat stream error: {str(e)}")
+        return jsonify({'error': _('Error processing message')}), 500
+    
+    def generate():
+        yield _sse('start', {
+            'id': user_message.id,
+            'content': user_message.content,
+            'timestamp': user_message.timestamp.isoformat(),
+            'is_user': True
+        })
+        
+        pieces = []
+        upstream = stream_chat_response(previous_messages, chat_session.excel_file, language, message_content)
+        try:
+            for piece in upstream:
+                pieces.append(piece)
+                yield _sse('token', {'token': piece})
+        except ChatError as e:
+            yield _sse('error', {'error': str(e)})
+            return
+        except Exception as e:
+            current_app.logger.error(f"Chat stream error: {str(e)}")
+            yield _sse('error', {'error': _('Error generating response. Please try again.')})
+            return
+        finally:
+            # Also runs when the client disconnects: stops the generation upstream
+            upstream.close()
+        
+        try:
+            assistant_message = ChatMessage(
+                session_id=chat_session.id,
+                message_type=MessageType.TEXT,
+                content=''.join(pieces).strip(),
+                language=language,
+                is_user_message=False
+            )
+            db.session.add(assistant_message)
+            chat_session.last_activity = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Chat stream error: {str(e)}")
+            yield _sse('error', {'error': _('Error saving assistant response')})
+            return
+        
+        yield _sse('done', {
+            'id': assistant_message.id,
+            'content': assistant_message.content,
+            'timestamp': assistant_message.timestamp.isoformat(),
+            'is_user': False
+        })
+    
+    return current_app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @bp.route('/chat/voice', methods=['POST'])
 @login_required
 def send_voice_message():
@@ -169,6 +281,9 @@ def send_voice_message():
         if not transcription.strip():
             return jsonify({'error': _('No speech detected in audio')}), 400
         
+        # Previous messages for context, without the question itself (it is passed separately)
+        previous_messages = chat_session.messages.order_by(ChatMessage.timestamp.asc()).all()
+        
         # Save user voice message
         user_message = ChatMessage(
             session_id=session_id,
@@ -181,9 +296,6 @@ def send_voice_message():
         )
         db.session.add(user_message)
         
-        # Get previous messages for context
-        previous_messages = chat_session.messages.order_by(ChatMessage.timestamp.asc()).all()
-        
         # Get assistant response
         assistant_response, error = get_chat_response(
             previous_messages,
@@ -288,36 +400,172 @@ def get_file_data(file_id):
     if not excel_file.can_read():
         return jsonify({'error': _('No permission to access this file')}), 403
     
+    try:
+        fmt = requested_format(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Unchanged since the client's copy: answered without reading the file
+    etag = data_etag(excel_file, fmt)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
     try:
         sheet_name = request.args.get('sheet')
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 100, type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
         
         # Calculate offset
         offset = (page - 1) * per_page
         
-        from app.main.utils import load_excel_data
-        data, error = load_excel_data(excel_file.file_path, sheet_name, offset + per_page)
+        # Only the requested page is read and converted
+        from app.main.utils import load_excel_window, load_excel_arrow_window
+        if fmt == 'arrow':
+            data, error = load_excel_arrow_window(excel_file.file_path, sheet_name, offset, per_page)
+        else:
+            data, error = load_excel_window(excel_file.file_path, sheet_name, offset, per_page, fmt)
         
         if error:
             return jsonify({'error': error}), 500
         
-        # Paginate data
-        paginated_data = data['data'][offset:offset + per_page]
+        if fmt == 'arrow':
+            return with_etag(data_response(data, fmt), etag)
         
-        return jsonify({
-            'data': paginated_data,
+        # Exact row count from stored sheet metadata
+        sheet_meta = excel_file.get_sheet(sheet_name)
+        total_rows = sheet_meta.row_count if sheet_meta else data['total_rows']
+        
+        return with_etag(data_response({
+            'data': data['data'],
             'columns': data['columns'],
-            'total_rows': data['total_rows'],
+            'total_rows': total_rows,
             'page': page,
             'per_page': per_page,
-            'has_more': offset + per_page < data['total_rows']
-        })
+            'has_more': offset + per_page < total_rows
+        }, fmt), etag)
         
     except Exception as e:
         current_app.logger.error(f"File data API error: {str(e)}")
         return jsonify({'error': _('Error loading file data')}), 500
 
+@bp.route('/files/<int:file_id>/rows')
+@login_required
+def get_file_rows(file_id):
+    """
+    Get a window of rows for the virtual-scrolling grid
+    
+    GET parameters: sheet, start (first row index), count (at most 1000),
+    format ('records', 'columnar' or 'arrow', also selectable with Accept)
+    """
+    if not current_user.can_access_system():
+        return jsonify({'error': _('Access denied')}), 403
+    
+    excel_file = ExcelFile.query.filter_by(
+        id=file_id,
+        user_id=current_user.id,
+        is_active=True
+    ).first()
+    
+    if not excel_file:
+        return jsonify({'error': _('File not found')}), 404
+    
+    if not excel_file.can_read():
+        return jsonify({'error': _('No permission to access this file')}), 403
+    
+    try:
+        fmt = requested_format(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    etag = data_etag(excel_file, fmt)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    start = max(request.args.get('start', 0, type=int), 0)
+    count = min(max(request.args.get('count', 100, type=int), 0), 1000)
+    
+    from app.main.utils import load_excel_window, load_excel_arrow_window
+    if fmt == 'arrow':
+        data, error = load_excel_arrow_window(excel_file.file_path, request.args.get('sheet'), start, count)
+    else:
+        data, error = load_excel_window(excel_file.file_path, request.args.get('sheet'), start, count, fmt)
+    if error:
+        return jsonify({'error': error}), 500
+    
+    if fmt == 'arrow':
+        return with_etag(data_response(data, fmt), etag)
+    return with_etag(data_response({
+        'columns': data['columns'],
+        'data': data['data'],
+        'start': start,
+        'total_rows': data['total_rows'],
+        'version': excel_file.version
+    }, fmt), etag)
+
+@bp.route('/files/<int:file_id>/ingest-status')
+@login_required
+def get_ingest_status(file_id):
+    """Report background ingestion progress, with a preview of the first rows until it is done"""
+    excel_file = ExcelFile.query.filter_by(
+        id=file_id,
+        user_id=current_user.id,
+        is_active=True
+    ).first()
+    
+    if not excel_file:
+        return jsonify({'error': _('File not found')}), 404
+    
+    if not excel_file.can_read():
+        return jsonify({'error': _('No permission to access this file')}), 403
+    
+    # Ingestion interrupted by a restart is queued again
+    from app.main.ingest import resume_ingestion
+    resume_ingestion(excel_file)
+    
+    result = {
+        'status': excel_file.ingest_status.value,
+        'progress': excel_file.ingest_progress,
+        'error': excel_file.ingest_error
+    }
+    
+    if not excel_file.is_ingested() or request.args.get('preview', type=int):
+        try:
+            # Only the first rows are streamed from the workbook
+            from app.main.excel_scanner import read_preview
+            result['preview'] = read_preview(excel_file.file_path, request.args.get('sheet'))
+        except Exception as e:
+            current_app.logger.warning(f"Preview error for file {file_id}: {str(e)}")
+            result['preview'] = None
+    
+    return jsonify(result)
+
+@bp.route('/files/<int:file_id>/ingest-retry', methods=['POST'])
+@login_required
+def retry_file_ingestion(file_id):
+    """Run the ingestion of a file whose ingestion failed again"""
+    excel_file = ExcelFile.query.filter_by(
+        id=file_id,
+        user_id=current_user.id,
+        is_active=True
+    ).first()
+    
+    if not excel_file:
+        return jsonify({'error': _('File not found')}), 404
+    
+    if not excel_file.can_read():
+        return jsonify({'error': _('No permission to access this file')}), 403
+    
+    from app.main.ingest import retry_ingestion
+    if not retry_ingestion(excel_file):
+        return jsonify({'error': _('Only files whose processing failed can be retried')}), 400
+    
+    return jsonify({
+        'status': excel_file.ingest_status.value,
+        'progress': excel_file.ingest_progress
+    }), 202
+
 @bp.route('/stripe/webhook', methods=['POST'])
 def stripe_webhook():
     """Handle Stripe webhooks"""
@@ -0,0 +1,123 @@
+from flask import request, jsonify, current_app
+from flask_login import login_required, current_user
+from flask_babel import gettext as _
+
+from app.api import bp
+from app.models import UploadSession, PermissionMode
+from app.main.ingest import submit_ingestion
+from app.main.uploads import (create_upload, write_chunk, finalize_upload, cancel_upload,
+                              UploadConflict)
+
+
+def _get_upload(upload_id):
+    return UploadSession.query.filter_by(id=upload_id, user_id=current_user.id).first()
+
+
+@bp.route('/uploads', methods=['POST'])
+@login_required
+def init_upload():
+    """
+    Start a resumable upload
+
+    JSON parameters:
+    - filename: original file name
+    - size: file size in bytes
+    - permission_mode: 'read', 'read_write' or 'read_write_delete'
+    """
+    if not current_user.can_access_system():
+        return jsonify({'error': _('Access denied')}), 403
+
+    can_upload, _remaining = current_user.can_upload_files()
+    if not can_upload:
+        return jsonify({'error': _('You have reached your file upload limit for your subscription plan.')}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        permission_mode = PermissionMode(data.get('permission_mode', PermissionMode.READ.value))
+        upload = create_upload(current_user.id, data.get('filename'), data.get('size'), permission_mode)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    result = upload.to_dict()
+    result['chunk_size'] = current_app.config['UPLOAD_CHUNK_SIZE']
+    return jsonify(result), 201
+
+
+@bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def get_upload_status(upload_id):
+    """Report how many bytes were received, to resume an interrupted upload"""
+    upload = _get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': _('Upload not found')}), 404
+    return jsonify(upload.to_dict())
+
+
+@bp.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """
+    Store a chunk of the file
+
+    The raw request body is written at the offset given by the 'offset'
+    query parameter or the Upload-Offset header. Chunks are limited by
+    MAX_CONTENT_LENGTH; send them in UPLOAD_CHUNK_SIZE pieces.
+    """
+    upload = _get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': _('Upload not found')}), 404
+
+    offset = request.args.get('offset', request.headers.get('Upload-Offset'))
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        return jsonify({'error': _('Chunk offset is required')}), 400
+
+    try:
+        new_offset = write_chunk(upload, offset, request.stream, request.content_length)
+    except UploadConflict as e:
+        return jsonify(dict(upload.to_dict(), error=str(e))), 409
+    except ValueError as e:
+        return jsonify(dict(upload.to_dict(), error=str(e))), 400
+
+    return jsonify(dict(upload.to_dict(), offset=new_offset))
+
+
+@bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload_route(upload_id):
+    """Turn a completely received upload into a file and start its ingestion"""
+    upload = _get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': _('Upload not found')}), 404
+
+    can_upload, _remaining = current_user.can_upload_files()
+    if not can_upload:
+        return jsonify({'error': _('You have reached your file upload limit for your subscription plan.')}), 403
+
+    try:
+        excel_file = finalize_upload(upload)
+    except UploadConflict as e:
+        return jsonify(dict(upload.to_dict(), error=str(e))), 409
+    except Exception as e:
+        current_app.logger.error(f"Upload finalization error: {str(e)}")
+        return jsonify({'error': _('File upload failed.')}), 500
+
+    # Metadata, sidecars and profiles are built in the background
+    submit_ingestion(excel_file)
+
+    return jsonify(dict(upload.to_dict(), sha256=upload.sha256))
+
+
+@bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload_route(upload_id):
+    """Abort an upload and delete the bytes received so far"""
+    upload = _get_upload(upload_id)
+    if not upload:
+        return jsonify({'error': _('Upload not found')}), 404
+    if upload.completed_at is not None:
+        return jsonify({'error': _('Upload is already finalized')}), 409
+
+    cancel_upload(upload)
+    return jsonify({'success': True})
@@ -46,5 +46,74 @@ def create_admin(email, password, first_name, last_name):
     click.echo(f"👤 Name: {first_name} {last_name}")
     click.echo(f"🔐 Role: Administrator")
 
+@click.command('benchmark-readers')
+@click.argument('files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--repeat', default=3, show_default=True, help='Runs per engine, the best one counts')
+@with_appcontext
+def benchmark_readers(files, repeat):
+    """Measure the spreadsheet reader engines on sample files."""
+    from app.main.readers import benchmark, file_format
+    
+    totals = {}
+    for file_path in files:
+        timings = benchmark(file_path, repeat)
+        if not timings:
+            click.echo(f"{file_path}: no reader installed for this format")
+            continue
+        click.echo(file_path)
+        fastest = min(timings.values())
+        for engine, seconds in sorted(timings.items(), key=lambda item: item[1]):
+            click.echo(f"  {engine:<10} {seconds * 1000:10.1f} ms  x{seconds / fastest:.2f}")
+            format_totals = totals.setdefault(file_format(file_path), {})
+            format_totals[engine] = format_totals.get(engine, 0) + seconds
+    
+    for fmt, timings in totals.items():
+        order = ','.join(sorted(timings, key=timings.get))
+        click.echo(f"Fastest order for .{fmt}: EXCEL_READERS_{fmt.upper()}={order}")
+
+@click.command('benchmark-json')
+@click.argument('file_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--sheet', default=None, help='Sheet name, the first sheet by default')
+@click.option('--rows', default=1000, show_default=True, help='Rows per response, like per_page')
+@click.option('--repeat', default=20, show_default=True, help='Runs per encoder, the best one counts')
+@with_appcontext
+def benchmark_json(file_path, sheet, rows, repeat):
+    """Compare the JSON encoders on /api/files/<id>/data responses."""
+    import time
+    from flask import current_app
+    from flask.json.provider import DefaultJSONProvider
+    from app.json_provider import default
+    from app.main.excel_cache import get_sheet_window
+    from app.main.wire_format import frame_records, frame_to_columnar
+    
+    df, total_rows = get_sheet_window(file_path, sheet, 0, rows)
+    
+    def payload(data):
+        return {'data': data, 'columns': df.columns.tolist(), 'total_rows': total_rows,
+                'page': 1, 'per_page': rows, 'has_more': rows < total_rows}
+    
+    # The standard library encoder, with the conversions of the app provider for numpy values
+    default_provider = DefaultJSONProvider(current_app._get_current_object())
+    default_provider.default = default
+    paths = {
+        'records, to_dict + json': lambda: default_provider.response(
+            payload(df.astype(object).where(df.notna(), '').to_dict('records'))),
+        'records, orjson': lambda: current_app.json.response(payload(frame_records(df, na_value=''))),
+        'columnar, json': lambda: default_provider.response(payload(frame_to_columnar(df))),
+        'columnar, orjson': lambda: current_app.json.response(payload(frame_to_columnar(df))),
+    }
+    
+    click.echo(f"{file_path}: {len(df)} rows x {len(df.columns)} columns")
+    for name, encode in paths.items():
+        best, size = None, 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            size = len(encode().get_data())
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        click.echo(f"  {name:<26} {best * 1000:10.2f} ms {size / 1024:10.1f} KiB")
+
 def init_app(app):
     app.cli.add_command(create_admin)
+    app.cli.add_command(benchmark_readers)
+    app.cli.add_command(benchmark_json)
@@ -0,0 +1,101 @@
+"""
+Application JSON provider
+
+Responses are encoded with orjson, which writes UTF-8 bytes straight from
+C and serializes numpy arrays and scalars natively. The types the default
+provider handles are encoded the same way: dates as HTTP dates, decimals
+and UUIDs as strings, dataclasses as dicts. Pandas values are handled as
+well: NaN, NaT and NA become null, Series become lists and DataFrames a
+list of {column: value} records built column by column (see
+app.main.wire_format.frame_records).
+
+Without orjson the provider falls back to the standard library encoder
+with the same conversions.
+"""
+import dataclasses
+import decimal
+import uuid
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional, the stdlib encoder is the fallback
+    orjson = None
+
+
+def _is_missing(o):
+    return o is pd.NaT or o is pd.NA or (isinstance(o, float) and o != o)
+
+
+def default(o):
+    """Convert a value that JSON has no type for"""
+    from app.main.wire_format import frame_records
+
+    if _is_missing(o):
+        return None
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, pd.DataFrame):
+        return frame_records(o)
+    if isinstance(o, (pd.Series, pd.Index)):
+        return [None if _is_missing(value) else value for value in o.tolist()]
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        value = o.item()
+        return None if _is_missing(value) else value
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider encoding with orjson, registered in create_app"""
+
+    default = staticmethod(default)
+
+    def _options(self, indent=False):
+        # Datetimes go through default() so that they keep the HTTP date format
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _encode(self, obj, indent=False):
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options(indent))
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits or numpy arrays orjson does not support
+            return self._fallback_dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+    def _fallback_dumps(self, obj, **kwargs):
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        return super().dumps(obj, **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {'indent', 'separators'}:
+            return self._fallback_dumps(obj, **kwargs)
+        return self._encode(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self._encode(obj, indent) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,39 @@
+"""
+Cell values and column names shared by the sheet modules
+
+Every module that reads, edits or exports sheets treats empty cells, the
+JSON conversion of cell values and column names given by clients the
+same way; the helpers live here so that they cannot drift apart.
+"""
+import pandas as pd
+
+
+def is_empty(value):
+    """An empty cell as written by a client or read by openpyxl"""
+    return value is None or value == ''
+
+
+def json_value(value):
+    """Convert a cell value to a JSON-compatible value; missing values become None"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        # numpy scalars
+        return value.item()
+    return value
+
+
+def find_column(columns, name):
+    """
+    The column label matching a name given by a client. Names from JSON
+    are strings, so labels are also compared as strings (numeric headers).
+    Raises ValueError for an unknown column.
+    """
+    if name in columns:
+        return name
+    for column in columns:
+        if str(column) == str(name):
+            return column
+    raise ValueError(f"Unknown column: {name}")
@@ -0,0 +1,327 @@
+"""
+Write-behind buffer for workbook edits
+
+Edits are applied to an in-memory image of the sheet and acknowledged
+immediately. The queued operations are written to the workbook in one
+openpyxl load/save by a debounce timer, before downloads and at shutdown.
+Reads through the sheet cache see the buffered image.
+
+A flush that fails to save is retried with a backoff. When the queued
+operations no longer apply to the file (or the retries are used up) they
+are dropped and the stored metadata is rescanned from the file.
+
+The buffer lives in the memory of one process: enable it only when all
+requests for a file are served by the same process.
+"""
+import atexit
+import os
+from contextlib import contextmanager
+import threading
+import time
+
+import pandas as pd
+from pandas.api.types import is_integer_dtype, is_numeric_dtype
+from flask import current_app
+
+from app.main.cells import find_column, is_empty
+from app.main.excel_cache import get_disk_frame, resolve_sheet_name
+from app.main.frame_compact import expand_frame
+
+DEFAULT_DELAY = 2.0
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_MAX_RETRIES = 3
+
+
+class FileEditBuffer:
+    """Pending operations and sheet images of one workbook"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.operations = []
+        self.sheets = {}
+        self.first_pending_at = None
+        self.failures = 0
+        self.timer = None
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+_app = None
+
+
+def write_behind_enabled():
+    return current_app.config.get('EXCEL_WRITE_BEHIND', False)
+
+
+def _buffer_key(file_path):
+    return os.path.abspath(file_path)
+
+
+def get_buffered_frame(file_path, sheet_name):
+    """Return the buffered image of a sheet, or None if it has no pending edits"""
+    buffer = _buffers.get(_buffer_key(file_path))
+    if buffer is None:
+        return None
+    with buffer.lock:
+        return buffer.sheets.get(sheet_name)
+
+
+def has_pending_edits(file_path):
+    buffer = _buffers.get(_buffer_key(file_path))
+    return buffer is not None and bool(buffer.operations)
+
+
+def _prepare_column(df, column, value):
+    """Widen the column dtype so that the value can be stored without loss"""
+    dtype = df[column].dtype
+    if dtype == object:
+        return
+    is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if is_empty(value):
+        if is_integer_dtype(dtype):
+            df[column] = df[column].astype('float64')
+    elif not is_number or not is_numeric_dtype(dtype):
+        df[column] = df[column].astype(object)
+    elif is_integer_dtype(dtype) and isinstance(value, float):
+        df[column] = df[column].astype('float64')
+
+
+def _apply_to_image(df, operation):
+    """Apply one operation to a sheet image, returns (new image, affected row)"""
+    action = operation.get('action')
+    if action == 'update_cell':
+        if 'row' not in operation or 'column' not in operation or 'value' not in operation:
+            raise LookupError("Для update_cell необходимы параметры: row, column, value")
+        row_index = int(operation['row'])
+        if row_index < 0 or row_index >= len(df):
+            raise LookupError("Указанная ячейка не существует")
+        try:
+            column = find_column(df.columns, operation['column'])
+        except ValueError:
+            raise LookupError("Указанная ячейка не существует")
+        value = operation['value']
+        _prepare_column(df, column, value)
+        df.at[row_index, column] = None if is_empty(value) else value
+        return df, row_index
+    if action == 'add_row':
+        if not isinstance(operation.get('data'), dict):
+            raise LookupError("Для add_row необходим параметр data")
+        row_data = {}
+        for col_name, value in operation['data'].items():
+            try:
+                column = find_column(df.columns, col_name)
+            except ValueError:
+                raise LookupError(f"Колонка {col_name} не существует в таблице")
+            if not is_empty(value):
+                row_data[column] = value
+        new_row = pd.DataFrame([row_data], columns=df.columns)
+        for column, value in row_data.items():
+            _prepare_column(df, column, value)
+        df = pd.concat([df, new_row], ignore_index=True) if len(df) else new_row
+        return df, len(df) - 1
+    if action == 'delete_row':
+        if 'row' not in operation:
+            raise LookupError("Для delete_row необходим параметр row")
+        row_index = int(operation['row'])
+        if row_index < 0 or row_index >= len(df):
+            raise LookupError("Строка с указанным индексом не существует")
+        return df.drop(index=row_index).reset_index(drop=True), row_index
+    raise LookupError(f"Неизвестный тип операции: {action}")
+
+
+@contextmanager
+def _locked_buffer(key):
+    """
+    The buffer of a file, holding its lock. A flush may remove the buffer
+    between the lookup and taking the lock; the lookup is then repeated so
+    that new operations never go to a removed buffer.
+    """
+    while True:
+        with _buffers_lock:
+            buffer = _buffers.setdefault(key, FileEditBuffer(key))
+        buffer.lock.acquire()
+        if _buffers.get(key) is buffer:
+            break
+        buffer.lock.release()
+    try:
+        yield buffer
+    finally:
+        buffer.lock.release()
+
+
+def submit_operations(file_path, sheet_name, operations):
+    """
+    Apply operations to the buffered images and queue them for writing.
+
+    Has the same all-or-nothing semantics and return value as
+    apply_excel_operations: (results, error).
+    """
+    key = _buffer_key(file_path)
+    results = []
+    with _locked_buffer(key) as buffer:
+        # Work on copies so that a failing operation leaves the images untouched
+        images = {}
+        queued = []
+        for index, operation in enumerate(operations):
+            result = {'index': index, 'action': operation.get('action'), 'success': False}
+            try:
+                op_sheet = resolve_sheet_name(key, operation.get('sheet') or sheet_name)
+                if op_sheet not in images:
+                    image = buffer.sheets.get(op_sheet)
+                    # Edited images use the default dtypes, a compacted column could not take every value
+                    images[op_sheet] = expand_frame(image if image is not None else get_disk_frame(key, op_sheet))
+                images[op_sheet], row = _apply_to_image(images[op_sheet], operation)
+                result.update({'sheet': op_sheet, 'row': row, 'success': True})
+                queued.append(dict(operation, sheet=op_sheet))
+            except (LookupError, ValueError, TypeError) as e:
+                result['error'] = str(e)
+                results.append(result)
+                return results, "Изменения не сохранены: одна из операций не выполнена"
+            results.append(result)
+
+        buffer.sheets.update(images)
+        buffer.operations.extend(queued)
+        if buffer.first_pending_at is None:
+            buffer.first_pending_at = time.monotonic()
+        _schedule_flush(buffer)
+
+    return results, None
+
+
+def _schedule_flush(buffer, delay=None):
+    """(Re)start the debounce timer, never postponing a flush beyond the max delay"""
+    global _app
+    _app = current_app._get_current_object()
+
+    if delay is None:
+        delay = current_app.config.get('EXCEL_WRITE_BEHIND_DELAY', DEFAULT_DELAY)
+        max_delay = current_app.config.get('EXCEL_WRITE_BEHIND_MAX_DELAY', DEFAULT_MAX_DELAY)
+        remaining = max_delay - (time.monotonic() - buffer.first_pending_at)
+        delay = max(min(delay, remaining), 0)
+
+    if buffer.timer is not None:
+        buffer.timer.cancel()
+    buffer.timer = threading.Timer(delay, _flush_in_app_context, args=(_app, buffer.file_path))
+    buffer.timer.daemon = True
+    buffer.timer.start()
+
+
+def _flush_in_app_context(app, file_path):
+    with app.app_context():
+        flush_file(file_path)
+
+
+def flush_file(file_path):
+    """
+    Write all pending operations of a file in one load/save cycle.
+
+    Returns (success, error); a file without pending edits is a no-op.
+    """
+    from app.main.excel_service import apply_excel_operations
+
+    key = _buffer_key(file_path)
+    buffer = _buffers.get(key)
+    if buffer is None:
+        return True, None
+
+    with buffer.flush_lock:
+        with buffer.lock:
+            if buffer.timer is not None:
+                buffer.timer.cancel()
+                buffer.timer = None
+            operations = list(buffer.operations)
+        if not operations:
+            return True, None
+
+        results, error = apply_excel_operations(key, None, operations, buffered=False)
+
+        dropped = False
+        with buffer.lock:
+            if not error:
+                buffer.failures = 0
+                del buffer.operations[:len(operations)]
+            elif _is_retryable(results) and buffer.failures < _max_retries():
+                # The operations applied cleanly, the save itself failed: keep them and try again
+                buffer.failures += 1
+                current_app.logger.warning(f"Write-behind flush failed for {key}, retry {buffer.failures}: {error}")
+                _schedule_flush(buffer, delay=_retry_delay(buffer.failures))
+                return False, error
+            else:
+                # The images can no longer be written, drop them rather than serving data that is not on disk
+                current_app.logger.error(f"Write-behind flush failed for {key}: {error} {results}")
+                buffer.operations = []
+                dropped = True
+            if not buffer.operations:
+                buffer.sheets.clear()
+                buffer.first_pending_at = None
+                with _buffers_lock:
+                    _buffers.pop(key, None)
+            else:
+                _schedule_flush(buffer)
+
+    if dropped:
+        _resync_metadata(key)
+    return error is None, error
+
+
+def _is_retryable(results):
+    """A flush failed on I/O rather than because an operation no longer applies to the file"""
+    return all(result['success'] for result in results)
+
+
+def _max_retries():
+    return current_app.config.get('EXCEL_WRITE_BEHIND_MAX_RETRIES', DEFAULT_MAX_RETRIES)
+
+
+def _retry_delay(failures):
+    delay = current_app.config.get('EXCEL_WRITE_BEHIND_DELAY', DEFAULT_DELAY)
+    return delay * 2 ** (failures - 1)
+
+
+def _resync_metadata(file_path):
+    """
+    Rescan the files stored at file_path after buffered edits were dropped.
+
+    The edits were acknowledged and counted in the stored metadata and the
+    version; the rescan and a new version make readers and caches follow
+    the data that is actually on disk.
+    """
+    from app import db
+    from app.models import ExcelFile
+    from app.main.excel_scanner import scan_workbook
+    from app.main.utils import store_sheet_metadata
+
+    try:
+        excel_files = ExcelFile.query.filter_by(file_path=file_path).all()
+        if not excel_files or not os.path.exists(file_path):
+            return
+        sheets = scan_workbook(file_path)
+        for excel_file in excel_files:
+            store_sheet_metadata(excel_file, sheets)
+            excel_file.bump_version()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Metadata rescan after a failed flush of {file_path} failed: {str(e)}")
+
+
+def discard_file(file_path):
+    """Forget pending edits, e.g. when the file is deleted"""
+    with _buffers_lock:
+        buffer = _buffers.pop(_buffer_key(file_path), None)
+    if buffer is not None and buffer.timer is not None:
+        buffer.timer.cancel()
+
+
+def flush_all():
+    for file_path in list(_buffers):
+        flush_file(file_path)
+
+
+@atexit.register
+def _flush_on_shutdown():
+    if _app is not None and _buffers:
+        with _app.app_context():
+            flush_all()
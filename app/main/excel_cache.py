@@ -0,0 +1,225 @@
+"""
+In-process cache of parsed Excel sheets shared by all read paths
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+from app.main.frame_compact import CATEGORY_MAX_RATIO, compact_frame, frame_bytes
+from app.main.readers import read_frame, read_sheet_names
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class MemoryLRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store a value; values larger than the whole budget are not cached"""
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+        return True
+
+    def discard(self, predicate):
+        """Remove every entry whose key matches the predicate"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                _, size = self._entries.pop(key)
+                self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+_sheet_cache = MemoryLRUCache()
+
+# Compaction of frames before they are cached, see app.main.frame_compact
+_compaction = {'enabled': True, 'category_max_ratio': CATEGORY_MAX_RATIO, 'arrow_strings': False,
+               'sheets': 0, 'bytes_saved': 0}
+_compaction_lock = threading.Lock()
+
+
+def init_app(app):
+    """Apply the memory budget and frame compaction settings from the application config"""
+    _sheet_cache.max_bytes = app.config.get('EXCEL_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    _compaction.update(
+        enabled=app.config.get('EXCEL_COMPACT_FRAMES', True),
+        category_max_ratio=app.config.get('EXCEL_CATEGORY_MAX_RATIO', CATEGORY_MAX_RATIO),
+        arrow_strings=app.config.get('EXCEL_ARROW_STRINGS', False)
+    )
+
+
+def file_fingerprint(file_path):
+    """Version of a file on disk: modification time and size"""
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _cache_path(file_path):
+    return os.path.abspath(file_path)
+
+
+def get_sheet_names(file_path):
+    """Return the sheet names of a workbook, parsing it only on a cache miss"""
+    path = _cache_path(file_path)
+    key = ('sheet_names', path, file_fingerprint(path))
+    sheet_names = _sheet_cache.get(key)
+    if sheet_names is None:
+        sheet_names = read_sheet_names(path)
+        _sheet_cache.put(key, sheet_names, sum(len(name) for name in sheet_names) + 64)
+    return sheet_names
+
+
+def resolve_sheet_name(file_path, sheet_name=None):
+    """Map an empty sheet name to the first sheet of the workbook"""
+    if sheet_name:
+        return sheet_name
+    sheet_names = get_sheet_names(file_path)
+    if not sheet_names:
+        raise ValueError("Workbook has no sheets")
+    return sheet_names[0]
+
+
+def _buffered_frame(path, sheet_name):
+    from app.main.edit_buffer import get_buffered_frame
+
+    return get_buffered_frame(path, sheet_name)
+
+
+def get_sheet_frame(file_path, sheet_name=None):
+    """
+    Return the parsed DataFrame of a sheet, including edits that are still
+    waiting in the write-behind buffer.
+
+    The frame is shared between callers and must be treated as read-only;
+    take a copy before modifying it.
+    """
+    path = _cache_path(file_path)
+    sheet_name = resolve_sheet_name(path, sheet_name)
+    df = _buffered_frame(path, sheet_name)
+    if df is not None:
+        return df
+    return get_disk_frame(path, sheet_name)
+
+
+def get_disk_frame(file_path, sheet_name):
+    """Return the DataFrame of a sheet as it is stored on disk"""
+    path = _cache_path(file_path)
+    fingerprint = file_fingerprint(path)
+    key = ('sheet', path, fingerprint, sheet_name)
+    df = _sheet_cache.get(key)
+    if df is None:
+        df = _compact(_load_frame(path, sheet_name, fingerprint), path, sheet_name)
+        _sheet_cache.put(key, df, frame_bytes(df))
+    return df
+
+
+def _compact(df, path, sheet_name):
+    if not _compaction['enabled']:
+        return df
+    df, saved = compact_frame(df, _compaction['category_max_ratio'], _compaction['arrow_strings'])
+    with _compaction_lock:
+        _compaction['sheets'] += 1
+        _compaction['bytes_saved'] += saved
+    if has_app_context():
+        current_app.logger.info(f"Compacted sheet {sheet_name} of {os.path.basename(path)}: "
+                                f"{frame_bytes(df)} bytes, {saved} bytes saved")
+    return df
+
+
+def _load_frame(path, sheet_name, fingerprint):
+    """Read a sheet from its columnar sidecar, or parse the workbook and build one"""
+    from app.main.excel_sidecar import read_sidecar, write_sidecar
+
+    df = read_sidecar(path, sheet_name)
+    if df is None:
+        df = read_frame(path, sheet_name)
+        write_sidecar(path, sheet_name, df, fingerprint)
+    return df
+
+
+def get_loaded_frame(file_path, sheet_name):
+    """Return the frame of a sheet if it is already in memory (buffered or cached), else None"""
+    path = _cache_path(file_path)
+    df = _buffered_frame(path, sheet_name)
+    if df is None:
+        df = _sheet_cache.get(('sheet', path, file_fingerprint(path), sheet_name))
+    return df
+
+
+def get_sheet_window(file_path, sheet_name=None, offset=0, limit=100):
+    """
+    Return (frame, total_rows) for a window of rows of a sheet.
+
+    Costs O(limit) when the sheet is buffered, cached or has a columnar
+    sidecar: the in-memory frame is sliced, or only the requested rows of the
+    memory-mapped sidecar are converted. Otherwise the sheet is parsed
+    once and cached.
+    """
+    from app.main.excel_sidecar import open_sidecar, sidecar_to_frame
+
+    path = _cache_path(file_path)
+    sheet_name = resolve_sheet_name(path, sheet_name)
+    offset = max(int(offset), 0)
+    limit = max(int(limit), 0)
+
+    df = get_loaded_frame(path, sheet_name)
+    if df is None:
+        table = open_sidecar(path, sheet_name)
+        if table is not None:
+            return sidecar_to_frame(table.slice(offset, limit)), table.num_rows
+        df = get_disk_frame(path, sheet_name)
+    return df.iloc[offset:offset + limit], len(df)
+
+
+def invalidate_file(file_path):
+    """Drop every cached entry of a file, e.g. after it was rewritten"""
+    path = _cache_path(file_path)
+    _sheet_cache.discard(lambda key: key[1] == path)
+
+
+def cache_stats():
+    stats = _sheet_cache.stats()
+    stats.update(compacted_sheets=_compaction['sheets'], compaction_bytes_saved=_compaction['bytes_saved'])
+    return stats
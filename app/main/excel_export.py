@@ -0,0 +1,118 @@
+"""
+Streaming export of a sheet as CSV or NDJSON
+
+Rows are produced one at a time, either from a frame that is already in
+memory or straight from openpyxl's read-only iterator, and serialized in
+small chunks, so memory use does not grow with the size of the sheet.
+"""
+import csv
+import io
+import json
+import os
+
+import openpyxl
+
+from app.main.cells import is_empty, json_value
+from app.main.excel_cache import get_loaded_frame, get_sheet_frame, get_sheet_names, resolve_sheet_name
+from app.main.excel_scanner import filled_width, normalize_headers
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+# Rows serialized into one chunk of the response
+CHUNK_ROWS = 500
+
+
+def _iter_frame_rows(df):
+    yield df.columns.tolist()
+    yield from df.itertuples(index=False, name=None)
+
+
+def _iter_worksheet_rows(file_path, sheet_name, width=None):
+    """
+    Yield the header and then the data rows of a sheet, padded or cut to
+    width columns. Trailing empty rows are dropped, like pandas does.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet_name]
+        rows = worksheet.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        if width is None:
+            width = filled_width(header)
+        header = header[:width]
+        yield normalize_headers(header + [None] * (width - len(header)))
+
+        empty_rows = 0
+        for row in rows:
+            values = list(row[:width]) + [None] * (width - len(row))
+            if all(is_empty(value) for value in values):
+                # Emitted only if a filled row follows
+                empty_rows += 1
+                continue
+            for _ in range(empty_rows):
+                yield (None,) * width
+            empty_rows = 0
+            yield tuple(values)
+    finally:
+        workbook.close()
+
+
+def iter_sheet_rows(file_path, sheet_name=None, width=None):
+    """
+    Yield the column names of a sheet followed by its rows as tuples.
+
+    A frame that is already in memory (cached or with buffered edits) is
+    iterated directly; otherwise .xlsx files are streamed with openpyxl.
+    Rows may be wider than the header: a streamed sheet is as wide as the
+    stored column count given as width, or as its header without one.
+    """
+    sheet_name = resolve_sheet_name(file_path, sheet_name)
+    if sheet_name not in get_sheet_names(file_path):
+        # Checked before streaming starts, a generator would only fail mid-response
+        raise LookupError(f"Sheet {sheet_name} not found")
+
+    df = get_loaded_frame(file_path, sheet_name)
+    if df is None and os.path.splitext(file_path)[1].lower() != '.xlsx':
+        df = get_sheet_frame(file_path, sheet_name)
+    if df is not None:
+        return _iter_frame_rows(df)
+    return _iter_worksheet_rows(file_path, sheet_name, width)
+
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([str(col) for col in next(rows)])
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(['' if value is None else value for value in map(json_value, row)])
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(rows):
+    columns = [str(col) for col in next(rows)]
+    lines = []
+    for row in rows:
+        record = dict(zip(columns, map(json_value, row)))
+        lines.append(json.dumps(record, ensure_ascii=False, default=str))
+        if len(lines) == CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def export_sheet(file_path, sheet_name=None, export_format='csv', width=None):
+    """Return a generator of text chunks with the sheet in the requested format"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    rows = iter_sheet_rows(file_path, sheet_name, width)
+    if export_format == 'csv':
+        return _csv_chunks(rows)
+    return _ndjson_chunks(rows)
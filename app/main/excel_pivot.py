@@ -0,0 +1,149 @@
+"""
+Group-by aggregation of sheet rows with cached results
+
+A pivot spec is a JSON document:
+
+    {
+        "group_by": ["Region"],
+        "values": ["Sales", "Qty"],
+        "aggregates": ["sum", "mean"],
+        "sort_by": "Sales_sum",
+        "direction": "desc",
+        "limit": 100
+    }
+
+Aggregation runs as one pandas groupby over the cached frame of the sheet.
+Results are cached by file id, file data version and the normalized spec,
+so repeated summaries of an unchanged file are not recomputed; any edit
+bumps the version and with it the key. Specs are validated against the
+stored sheet columns, so a cache hit does not load the sheet.
+"""
+import json
+
+from app.main.cells import find_column
+from app.main.excel_cache import MemoryLRUCache, get_sheet_frame, resolve_sheet_name
+from app.main.frame_compact import expand_frame
+from app.main.wire_format import frame_records
+
+AGGREGATES = ('sum', 'mean', 'count', 'min', 'max', 'nunique')
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+_pivot_cache = MemoryLRUCache(DEFAULT_MAX_BYTES)
+
+
+def init_app(app):
+    _pivot_cache.max_bytes = app.config.get('PIVOT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+
+def _as_list(value, field):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list):
+        raise ValueError(f"{field} must be a list")
+    return value
+
+
+def normalize_pivot_spec(columns, spec):
+    """Validate a spec against the sheet columns and bring it to a canonical form"""
+    if not isinstance(spec, dict):
+        raise ValueError("Pivot spec must be an object")
+
+    group_by = [str(find_column(columns, name)) for name in _as_list(spec.get('group_by'), 'group_by')]
+    values = [str(find_column(columns, name)) for name in _as_list(spec.get('values'), 'values')]
+    if not values:
+        raise ValueError("At least one value column is required")
+
+    aggregates = _as_list(spec.get('aggregates') or ['sum'], 'aggregates')
+    for aggregate in aggregates:
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate: {aggregate}")
+
+    direction = str(spec.get('direction', 'asc')).lower()
+    if direction not in ('asc', 'desc'):
+        raise ValueError(f"Unknown sort direction: {direction}")
+    try:
+        limit = min(max(int(spec.get('limit', DEFAULT_LIMIT)), 0), MAX_LIMIT)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+
+    return {
+        'group_by': group_by,
+        'values': list(dict.fromkeys(values)),
+        'aggregates': sorted(set(aggregates), key=AGGREGATES.index),
+        'sort_by': str(spec['sort_by']) if spec.get('sort_by') is not None else None,
+        'direction': direction,
+        'limit': limit
+    }
+
+
+def compute_pivot(df, spec):
+    """Aggregate a frame according to a normalized spec, returns a flat frame"""
+    group_by = [find_column(df.columns, name) for name in spec['group_by']]
+    values = [find_column(df.columns, name) for name in spec['values']]
+
+    # min/max of unordered categoricals are undefined, aggregate the values they hold
+    df = expand_frame(df[list(dict.fromkeys(group_by + values))], values)
+    try:
+        if group_by:
+            grouped = df.groupby(group_by, observed=True, dropna=False, sort=True)[values]
+            result = grouped.agg(spec['aggregates']).reset_index()
+        else:
+            result = df[values].agg(spec['aggregates']).unstack().to_frame().T
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Cannot aggregate the selected columns: {str(e)}")
+
+    result.columns = [
+        '_'.join(str(part) for part in column if part != '') if isinstance(column, tuple) else str(column)
+        for column in result.columns
+    ]
+
+    if spec['sort_by']:
+        if spec['sort_by'] not in result.columns:
+            raise ValueError(f"Unknown sort column: {spec['sort_by']}")
+        result = result.sort_values(spec['sort_by'], ascending=spec['direction'] == 'asc',
+                                    kind='mergesort', na_position='last')
+    return result
+
+
+def pivot_sheet(excel_file, sheet_name, spec):
+    """
+    Return the aggregation of a sheet of an ExcelFile, from cache when the
+    file has not changed since the same spec was computed.
+    """
+    sheet_name = resolve_sheet_name(excel_file.file_path, sheet_name)
+    # The stored columns are enough to build the key, the frame is loaded on a miss only
+    sheet = excel_file.get_sheet(sheet_name)
+    df = None
+    if sheet is not None:
+        columns = sheet.get_columns()
+    else:
+        df = get_sheet_frame(excel_file.file_path, sheet_name)
+        columns = df.columns
+    spec = normalize_pivot_spec(columns, spec)
+    key = ('pivot', excel_file.id, excel_file.version, sheet_name, json.dumps(spec, sort_keys=True))
+
+    cached = _pivot_cache.get(key)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    if df is None:
+        df = get_sheet_frame(excel_file.file_path, sheet_name)
+    result = compute_pivot(df, spec)
+    page = result.head(spec['limit'])
+    payload = {
+        'columns': page.columns.tolist(),
+        'data': frame_records(page),
+        'total_groups': len(result),
+        'truncated': len(result) > len(page)
+    }
+    _pivot_cache.put(key, payload, int(page.memory_usage(deep=True).sum()) + 1024)
+    return dict(payload, cached=False)
+
+
+def pivot_cache_stats():
+    return _pivot_cache.stats()
@@ -0,0 +1,165 @@
+"""
+Server-side filtering, sorting and projection of sheet rows
+
+A query is a JSON document:
+
+    {
+        "columns": ["Name", "Price"],
+        "filters": [
+            {"column": "Price", "op": "range", "min": 1, "max": 5},
+            {"column": "Name", "op": "contains", "value": "an"},
+            {"column": "Qty", "op": "in", "values": [10, 20]}
+        ],
+        "sort": [{"column": "Price", "direction": "desc"}],
+        "limit": 100,
+        "offset": 0
+    }
+
+Predicates are evaluated as vectorized masks over the cached frame of the
+sheet; only the requested page of the result is converted to records.
+Invalid queries raise ValueError.
+"""
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+
+from app.main.cells import find_column
+from app.main.excel_cache import get_sheet_frame
+from app.main.frame_compact import expand_series
+from app.main.wire_format import frame_records
+
+FILTER_OPS = ('eq', 'ne', 'gt', 'gte', 'lt', 'lte', 'range', 'contains', 'in')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def _coerce(series, value):
+    """Convert a JSON value to the type of the column it is compared with"""
+    try:
+        if is_bool_dtype(series.dtype):
+            return bool(value)
+        if is_numeric_dtype(series.dtype):
+            return float(value)
+        if is_datetime64_any_dtype(series.dtype):
+            return pd.Timestamp(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Value {value!r} does not match the type of column {series.name}")
+    return value
+
+
+def _filter_mask(df, condition):
+    if not isinstance(condition, dict):
+        raise ValueError("Each filter must be an object")
+    op = condition.get('op', 'eq')
+    if op not in FILTER_OPS:
+        raise ValueError(f"Unknown filter operator: {op}")
+    # Categorical columns compare as the values they hold
+    series = expand_series(df[find_column(df.columns, condition.get('column'))])
+
+    if op == 'contains':
+        text = series if series.dtype == object else series.astype(str)
+        return text.str.contains(str(condition.get('value', '')), case=False, regex=False, na=False)
+    if op == 'in':
+        values = condition.get('values')
+        if not isinstance(values, list):
+            raise ValueError("Filter 'in' requires a list of values")
+        return series.isin([_coerce(series, value) for value in values])
+    if op == 'range':
+        mask = pd.Series(True, index=series.index)
+        if condition.get('min') is not None:
+            mask &= series >= _coerce(series, condition['min'])
+        if condition.get('max') is not None:
+            mask &= series <= _coerce(series, condition['max'])
+        return mask
+
+    value = _coerce(series, condition.get('value'))
+    try:
+        if op == 'eq':
+            return series == value
+        if op == 'ne':
+            return series != value
+        if op == 'gt':
+            return series > value
+        if op == 'gte':
+            return series >= value
+        if op == 'lt':
+            return series < value
+        return series <= value
+    except TypeError:
+        raise ValueError(f"Column {series.name} cannot be compared with {value!r}")
+
+
+def _sort_spec(df, sort):
+    if isinstance(sort, (str, dict)):
+        sort = [sort]
+    by, ascending = [], []
+    for item in sort or []:
+        if isinstance(item, str):
+            item = {'column': item}
+        direction = str(item.get('direction', 'asc')).lower()
+        if direction not in ('asc', 'desc'):
+            raise ValueError(f"Unknown sort direction: {direction}")
+        by.append(find_column(df.columns, item.get('column')))
+        ascending.append(direction == 'asc')
+    return by, ascending
+
+
+def _page_bounds(query):
+    try:
+        limit = int(query.get('limit', DEFAULT_LIMIT))
+        offset = int(query.get('offset', 0))
+    except (TypeError, ValueError):
+        raise ValueError("limit and offset must be integers")
+    return min(max(limit, 0), MAX_LIMIT), max(offset, 0)
+
+
+def run_query(df, query):
+    """
+    Apply a query to a frame.
+
+    Returns (page, total) where page is the projected window of the result
+    and total is the number of matching rows.
+    """
+    if not isinstance(query, dict):
+        raise ValueError("Query must be an object")
+    limit, offset = _page_bounds(query)
+
+    filters = query.get('filters') or []
+    if not isinstance(filters, list):
+        raise ValueError("filters must be a list")
+    result = df
+    if filters:
+        mask = pd.Series(True, index=df.index)
+        for condition in filters:
+            mask &= _filter_mask(df, condition)
+        result = df[mask]
+
+    by, ascending = _sort_spec(df, query.get('sort'))
+    if by:
+        try:
+            # Stable sort so that equal keys keep their sheet order
+            result = result.sort_values(by=by, ascending=ascending, kind='mergesort', na_position='last')
+        except TypeError:
+            raise ValueError("Sort columns contain values that cannot be compared")
+
+    columns = query.get('columns')
+    if columns:
+        if not isinstance(columns, list):
+            raise ValueError("columns must be a list")
+        result = result[[find_column(df.columns, column) for column in columns]]
+
+    return result.iloc[offset:offset + limit], len(result)
+
+
+def query_sheet(file_path, sheet_name, query):
+    """Run a query against a sheet and return the page in the format of load_excel_window"""
+    page, total = run_query(get_sheet_frame(file_path, sheet_name), query)
+    limit, offset = _page_bounds(query)
+    return {
+        'columns': page.columns.tolist(),
+        'data': frame_records(page, na_value=''),
+        'row_indexes': page.index.tolist(),
+        'total_rows': total,
+        'offset': offset,
+        'limit': limit
+    }
@@ -0,0 +1,207 @@
+"""
+Single-pass streaming metadata scanner for Excel workbooks
+"""
+import os
+from itertools import islice
+from datetime import date, datetime, time
+
+import openpyxl
+
+from app.main.excel_cache import get_sheet_frame, get_sheet_names
+from app.main.edit_buffer import has_pending_edits
+from app.main.frame_compact import logical_dtype
+
+SAMPLE_ROWS = 5
+PREVIEW_ROWS = 20
+
+
+def normalize_headers(values):
+    """Build column names the same way pandas does for a header row"""
+    headers = []
+    seen = {}
+    for index, value in enumerate(values):
+        if value is None or value == '':
+            name = f"Unnamed: {index}"
+        elif isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            name = value
+        else:
+            name = str(value)
+
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        seen.setdefault(name, 0)
+        headers.append(name)
+    return headers
+
+
+def infer_dtype(kinds, has_nulls):
+    """Map the Python value types seen in a column to a pandas dtype name"""
+    if not kinds:
+        return 'float64'
+    if kinds == {'bool'}:
+        return 'object' if has_nulls else 'bool'
+    if kinds == {'int'}:
+        return 'float64' if has_nulls else 'int64'
+    if kinds <= {'int', 'float'}:
+        return 'float64'
+    if kinds == {'datetime'}:
+        return 'datetime64[ns]'
+    return 'object'
+
+
+def _value_kind(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, (datetime, date)):
+        return 'datetime'
+    if isinstance(value, time):
+        return 'time'
+    return 'str'
+
+
+def _sample_value(value):
+    """Make a cell value safe for JSON storage"""
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return value
+
+
+def filled_width(row):
+    """Number of cells of a row up to its last filled one"""
+    for index in range(len(row) - 1, -1, -1):
+        if row[index] is not None and row[index] != '':
+            return index + 1
+    return 0
+
+
+def scan_sheet(rows, sample_rows=SAMPLE_ROWS):
+    """
+    Collect dimensions, headers, sample rows and inferred types of a sheet
+    in one pass over its rows. The first row is the header.
+    """
+    header = None
+    width = 0
+    row_count = 0
+    last_filled_row = 0
+    samples = []
+    kinds = {}
+    filled_counts = {}
+
+    for row in rows:
+        filled = filled_width(row)
+        if header is None:
+            header = list(row[:filled])
+            width = filled
+            continue
+
+        row_count += 1
+        if len(samples) < sample_rows:
+            samples.append(row[:filled])
+        if filled == 0:
+            continue
+
+        last_filled_row = row_count
+        width = max(width, filled)
+        for index in range(filled):
+            value = row[index]
+            if value is not None and value != '':
+                kinds.setdefault(index, set()).add(_value_kind(value))
+                filled_counts[index] = filled_counts.get(index, 0) + 1
+
+    if header is None:
+        return {'columns': [], 'row_count': 0, 'column_count': 0, 'sample_data': [], 'dtypes': {}}
+
+    # Trailing empty rows are not counted, like pandas does
+    row_count = last_filled_row
+    columns = normalize_headers(header + [None] * (width - len(header)))
+
+    sample_data = []
+    for values in samples[:row_count]:
+        padded = list(values) + [None] * (width - len(values))
+        sample_data.append({str(col): _sample_value(value) for col, value in zip(columns, padded)})
+
+    dtypes = {}
+    for index, col in enumerate(columns):
+        has_nulls = filled_counts.get(index, 0) < row_count
+        dtypes[str(col)] = infer_dtype(kinds.get(index, set()), has_nulls)
+
+    return {
+        'columns': columns,
+        'row_count': row_count,
+        'column_count': len(columns),
+        'sample_data': sample_data,
+        'dtypes': dtypes
+    }
+
+
+def _scan_frame(df, sample_rows=SAMPLE_ROWS):
+    """Build the same metadata from an already parsed DataFrame"""
+    sample = df.head(sample_rows).astype(object).where(df.head(sample_rows).notna(), '')
+    return {
+        'columns': df.columns.tolist(),
+        'row_count': len(df),
+        'column_count': len(df.columns),
+        'sample_data': [
+            {str(col): _sample_value(value) for col, value in row.items()}
+            for row in sample.to_dict('records')
+        ],
+        'dtypes': {str(col): logical_dtype(dtype) for col, dtype in df.dtypes.items()}
+    }
+
+
+def scan_workbook(file_path, sample_rows=SAMPLE_ROWS):
+    """
+    Scan every sheet of a workbook once and return a list of per-sheet
+    metadata dictionaries in workbook order.
+    """
+    if os.path.splitext(file_path)[1].lower() != '.xlsx':
+        # openpyxl cannot stream legacy .xls files, fall back to pandas
+        return [
+            dict(name=name, position=position, **_scan_frame(get_sheet_frame(file_path, name), sample_rows))
+            for position, name in enumerate(get_sheet_names(file_path))
+        ]
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheets = []
+        for position, worksheet in enumerate(workbook.worksheets):
+            info = scan_sheet(worksheet.iter_rows(values_only=True), sample_rows)
+            sheets.append(dict(name=worksheet.title, position=position, **info))
+        return sheets
+    finally:
+        workbook.close()
+
+
+def read_preview(file_path, sheet_name=None, rows=PREVIEW_ROWS):
+    """Return {'columns', 'data'} for the first rows of a sheet without parsing the rest"""
+    if os.path.splitext(file_path)[1].lower() != '.xlsx':
+        info = _scan_frame(get_sheet_frame(file_path, sheet_name), rows)
+    else:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            worksheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+            info = scan_sheet(islice(worksheet.iter_rows(values_only=True), rows + 1), rows)
+        finally:
+            workbook.close()
+    return {'columns': info['columns'], 'data': info['sample_data']}
+
+
+def read_sample_rows(file_path, sheet_name=None, sample_rows=SAMPLE_ROWS):
+    """Read only the first rows of a sheet, e.g. to refresh stored samples after an edit"""
+    if has_pending_edits(file_path) or os.path.splitext(file_path)[1].lower() != '.xlsx':
+        return _scan_frame(get_sheet_frame(file_path, sheet_name), sample_rows)['sample_data']
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = islice(worksheet.iter_rows(values_only=True), sample_rows + 1)
+        return scan_sheet(rows, sample_rows)['sample_data']
+    finally:
+        workbook.close()
@@ -1,10 +1,98 @@
 import os
-import pandas as pd
 import json
 from flask import current_app
 from werkzeug.utils import secure_filename
 from datetime import datetime
+from app import db
 from app.models import ExcelFile, PermissionMode
+from app.main.cells import is_empty
+from app.main.excel_cache import invalidate_file
+from app.main.excel_scanner import SAMPLE_ROWS, read_sample_rows, normalize_headers
+from app.main.edit_buffer import write_behind_enabled, submit_operations
+from app.main.file_locks import write_lock, atomic_replace
+from app.main.formula_values import remember_results, mark_changed, prepare_save, restore_results
+from app.main.column_profile import add_rows_to_profile, mark_stale
+import openpyxl
+
+# Строка заголовков листа (нумерация openpyxl начинается с 1)
+HEADER_ROW = 1
+
+def _open_worksheet(file_path, sheet_name):
+    """
+    Открывает книгу целиком через openpyxl, сохраняя форматирование и формулы.
+    
+    Returns:
+        tuple: (workbook, worksheet)
+    """
+    if os.path.splitext(file_path)[1].lower() != '.xlsx':
+        raise ValueError("Изменение поддерживается только для файлов .xlsx")
+    
+    workbook = openpyxl.load_workbook(file_path)
+    # openpyxl не сохраняет вычисленные значения формул, запоминаем их
+    remember_results(workbook, file_path)
+    if sheet_name:
+        if sheet_name not in workbook.sheetnames:
+            raise LookupError(f"Лист {sheet_name} не найден")
+        return workbook, workbook[sheet_name]
+    return workbook, workbook.worksheets[0]
+
+def _header_columns(worksheet):
+    """
+    Возвращает словарь {имя колонки: номер колонки} по строке заголовков.
+    
+    Имена строятся так же, как их строит pandas, поэтому совпадают с
+    колонками, которые видит пользователь.
+    """
+    values = [cell.value for cell in worksheet[HEADER_ROW]]
+    while values and is_empty(values[-1]):
+        values.pop()
+    columns = {}
+    for index, name in enumerate(normalize_headers(values), start=1):
+        columns[name] = index
+        columns.setdefault(str(name), index)
+    return columns
+
+def _last_data_row(worksheet):
+    """Номер последней непустой строки листа (HEADER_ROW, если данных нет)"""
+    for row in range(worksheet.max_row, HEADER_ROW, -1):
+        if any(not is_empty(cell.value) for cell in worksheet[row]):
+            return row
+    return HEADER_ROW
+
+def _save_workbook(workbook, file_path):
+    """
+    Сохраняет книгу во временный файл и атомарно заменяет им исходный.
+    
+    Вычисленные значения формул записываются обратно в файл, иначе все
+    чтения увидели бы колонки с формулами пустыми.
+    """
+    results = prepare_save(workbook)
+    with atomic_replace(file_path) as tmp_path:
+        workbook.save(tmp_path)
+        restore_results(tmp_path, results)
+    invalidate_file(file_path)
+
+def _submit_buffered(file_path, sheet_name, operation):
+    """
+    Выполняет операцию над образом листа в памяти; запись в файл выполнит
+    буфер отложенной записи.
+    
+    Returns:
+        tuple: (success, error)
+    """
+    results, error = submit_operations(file_path, sheet_name, [operation])
+    if error:
+        return False, results[-1].get('error', error) if results else error
+    return True, None
+
+def _set_cell(worksheet, columns, row_index, col_name, new_value):
+    """Записывает значение в ячейку по имени колонки и индексу строки данных"""
+    column = columns.get(col_name, columns.get(str(col_name)))
+    row = HEADER_ROW + 1 + row_index
+    if column is None or row_index < 0 or row > _last_data_row(worksheet):
+        raise LookupError("Указанная ячейка не существует")
+    worksheet.cell(row=row, column=column).value = new_value
+    mark_changed(worksheet, row, row, column, column)
 
 def modify_excel_data(file_path, sheet_name, row_index, col_name, new_value):
     """
@@ -24,38 +112,65 @@ def modify_excel_data(file_path, sheet_name, row_index, col_name, new_value):
         # Проверяем существование файла
         if not os.path.exists(file_path):
             return False, "Файл не найден"
-            
-        # Загружаем данные
-        if sheet_name:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-        else:
-            # Если имя листа не указано, используем первый лист
-            df = pd.read_excel(file_path)
         
-        # Проверяем, что индекс строки и имя колонки существуют
-        if row_index >= len(df) or col_name not in df.columns:
-            return False, "Указанная ячейка не существует"
+        if write_behind_enabled():
+            return _submit_buffered(file_path, sheet_name, {
+                'action': 'update_cell', 'row': row_index, 'column': col_name, 'value': new_value
+            })
         
-        # Изменяем значение
-        df.at[row_index, col_name] = new_value
-        
-        # Сохраняем файл
-        with pd.ExcelWriter(file_path, mode='a', if_sheet_exists='replace') as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+        # Изменяем только одну ячейку, форматирование и формулы листа сохраняются
+        with write_lock(file_path):
+            workbook, worksheet = _open_worksheet(file_path, sheet_name)
+            _set_cell(worksheet, _header_columns(worksheet), row_index, col_name, new_value)
+            _save_workbook(workbook, file_path)
             
         return True, None
+    except LookupError as e:
+        return False, str(e)
     except Exception as e:
         current_app.logger.error(f"Error modifying Excel data: {str(e)}")
         return False, f"Failed to modify Excel data: {str(e)}"
 
-def add_excel_row(file_path, sheet_name, new_row_data):
+def _columns_from_header(header):
+    """Словарь {имя колонки: номер колонки} по сохраненному списку заголовков"""
+    columns = {}
+    for index, name in enumerate(header, start=1):
+        columns[name] = index
+        columns.setdefault(str(name), index)
+    return columns
+
+def _append_row(worksheet, columns, new_row_data):
+    """
+    Записывает новую строку сразу после последней заполненной строки листа.
+    
+    Returns:
+        int: Индекс добавленной строки данных (начиная с 0)
+    """
+    # Проверяем, что все колонки в new_row_data существуют в таблице
+    for col in new_row_data.keys():
+        if col not in columns:
+            raise LookupError(f"Колонка {col} не существует в таблице")
+    
+    row = _last_data_row(worksheet) + 1
+    for col, value in new_row_data.items():
+        if not is_empty(value):
+            worksheet.cell(row=row, column=columns[col]).value = value
+    mark_changed(worksheet, row, row)
+    return row - HEADER_ROW - 1
+
+def add_excel_row(file_path, sheet_name, new_row_data, header=None):
     """
     Добавляет новую строку в Excel-файл.
     
+    Существующие строки не загружаются в pandas: строка дописывается после
+    последней заполненной строки листа.
+    
     Args:
         file_path: Путь к Excel-файлу
         sheet_name: Имя листа
         new_row_data: Словарь с данными новой строки {column_name: value}
+        header: Сохраненный список колонок листа (если не указан, читается
+            строка заголовков)
     
     Returns:
         tuple: (success, error)
@@ -64,35 +179,32 @@ def add_excel_row(file_path, sheet_name, new_row_data):
         # Проверяем существование файла
         if not os.path.exists(file_path):
             return False, "Файл не найден"
-            
-        # Загружаем данные
-        if sheet_name:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-        else:
-            df = pd.read_excel(file_path)
         
-        # Проверяем, что все колонки в new_row_data существуют в DataFrame
-        for col in new_row_data.keys():
-            if col not in df.columns:
-                return False, f"Колонка {col} не существует в таблице"
+        if write_behind_enabled():
+            return _submit_buffered(file_path, sheet_name, {'action': 'add_row', 'data': new_row_data})
         
-        # Создаем новую строку с правильными колонками
-        new_row = {}
-        for col in df.columns:
-            new_row[col] = new_row_data.get(col, None)
-        
-        # Добавляем строку
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        
-        # Сохраняем файл
-        with pd.ExcelWriter(file_path, mode='a', if_sheet_exists='replace') as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+        with write_lock(file_path):
+            workbook, worksheet = _open_worksheet(file_path, sheet_name)
+            columns = _columns_from_header(header) if header else _header_columns(worksheet)
+            _append_row(worksheet, columns, new_row_data)
+            _save_workbook(workbook, file_path)
             
         return True, None
+    except LookupError as e:
+        return False, str(e)
     except Exception as e:
         current_app.logger.error(f"Error adding Excel row: {str(e)}")
         return False, f"Failed to add Excel row: {str(e)}"
 
+def _delete_row(worksheet, row_index):
+    """Удаляет строку данных листа, строки ниже сдвигаются вверх"""
+    row = HEADER_ROW + 1 + row_index
+    if row_index < 0 or row > _last_data_row(worksheet):
+        raise LookupError("Строка с указанным индексом не существует")
+    worksheet.delete_rows(row)
+    # Все строки ниже сдвинулись, формулы их не учитывают
+    mark_changed(worksheet, row)
+
 def delete_excel_row(file_path, sheet_name, row_index):
     """
     Удаляет строку из Excel-файла.
@@ -109,29 +221,201 @@ def delete_excel_row(file_path, sheet_name, row_index):
         # Проверяем существование файла
         if not os.path.exists(file_path):
             return False, "Файл не найден"
-            
-        # Загружаем данные
-        if sheet_name:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-        else:
-            df = pd.read_excel(file_path)
-        
-        # Проверяем, что индекс строки существует
-        if row_index >= len(df):
-            return False, "Строка с указанным индексом не существует"
         
-        # Удаляем строку
-        df = df.drop(row_index).reset_index(drop=True)
+        if write_behind_enabled():
+            return _submit_buffered(file_path, sheet_name, {'action': 'delete_row', 'row': row_index})
         
-        # Сохраняем файл
-        with pd.ExcelWriter(file_path, mode='a', if_sheet_exists='replace') as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+        with write_lock(file_path):
+            workbook, worksheet = _open_worksheet(file_path, sheet_name)
+            _delete_row(worksheet, row_index)
+            _save_workbook(workbook, file_path)
             
         return True, None
+    except LookupError as e:
+        return False, str(e)
     except Exception as e:
         current_app.logger.error(f"Error deleting Excel row: {str(e)}")
         return False, f"Failed to delete Excel row: {str(e)}"
 
+# Типы операций пакетного изменения и необходимые для них права
+BATCH_ACTIONS = {
+    'update_cell': 'write',
+    'add_row': 'write',
+    'delete_row': 'delete'
+}
+
+def _apply_operation(worksheet, columns, operation):
+    """Выполняет одну операцию над открытым листом и возвращает индекс затронутой строки"""
+    action = operation.get('action')
+    if action == 'update_cell':
+        if 'row' not in operation or 'column' not in operation or 'value' not in operation:
+            raise LookupError("Для update_cell необходимы параметры: row, column, value")
+        row_index = int(operation['row'])
+        _set_cell(worksheet, columns, row_index, operation['column'], operation['value'])
+        return row_index
+    if action == 'add_row':
+        if not isinstance(operation.get('data'), dict):
+            raise LookupError("Для add_row необходим параметр data")
+        return _append_row(worksheet, columns, operation['data'])
+    if action == 'delete_row':
+        if 'row' not in operation:
+            raise LookupError("Для delete_row необходим параметр row")
+        row_index = int(operation['row'])
+        _delete_row(worksheet, row_index)
+        return row_index
+    raise LookupError(f"Неизвестный тип операции: {action}")
+
+def apply_excel_operations(file_path, sheet_name, operations, buffered=True):
+    """
+    Выполняет список операций за одну загрузку и одно сохранение книги.
+    
+    Операции выполняются по порядку по принципу "все или ничего": если хотя
+    бы одна операция не выполнена, файл не сохраняется.
+    
+    Args:
+        file_path: Путь к Excel-файлу
+        sheet_name: Имя листа по умолчанию (операция может указать свой 'sheet')
+        operations: Список словарей {'action': 'update_cell'|'add_row'|'delete_row', ...}
+        buffered: Использовать буфер отложенной записи, если он включен
+    
+    Returns:
+        tuple: (results, error) - результаты по каждой операции и общая ошибка
+    """
+    results = []
+    try:
+        # Проверяем существование файла
+        if not os.path.exists(file_path):
+            return results, "Файл не найден"
+        
+        if buffered and write_behind_enabled():
+            return submit_operations(file_path, sheet_name, operations)
+        
+        with write_lock(file_path):
+            workbook, default_worksheet = _open_worksheet(file_path, sheet_name)
+            headers = {}
+            failed = False
+            
+            for index, operation in enumerate(operations):
+                result = {'index': index, 'action': operation.get('action'), 'success': False}
+                try:
+                    op_sheet = operation.get('sheet') or sheet_name
+                    if op_sheet and op_sheet not in workbook.sheetnames:
+                        raise LookupError(f"Лист {op_sheet} не найден")
+                    worksheet = workbook[op_sheet] if op_sheet else default_worksheet
+                    if worksheet.title not in headers:
+                        headers[worksheet.title] = _header_columns(worksheet)
+                
+                    result['sheet'] = worksheet.title
+                    result['row'] = _apply_operation(worksheet, headers[worksheet.title], operation)
+                    result['success'] = True
+                except (LookupError, ValueError, TypeError) as e:
+                    result['error'] = str(e)
+                    failed = True
+                results.append(result)
+                if failed:
+                    break
+            
+            if failed:
+                return results, "Изменения не сохранены: одна из операций не выполнена"
+            
+            _save_workbook(workbook, file_path)
+            return results, None
+    except Exception as e:
+        current_app.logger.error(f"Error applying Excel operations: {str(e)}")
+        return results, f"Failed to apply Excel operations: {str(e)}"
+
+def _update_sheet_counts(excel_file, sheet_name, row_delta, first_changed_row, added_rows=None):
+    """
+    Args:
+        added_rows: Данные добавленных строк, если изменение состояло только
+            из добавлений (None - профиль колонок нужно пересчитать)
+    """
+    sheet = excel_file.get_sheet(sheet_name)
+    if sheet is None:
+        # Метаданные будут построены при следующем обращении к сводке файла
+        return
+    
+    sheet.row_count = max(sheet.row_count + row_delta, 0)
+    
+    # Образцы данных обновляем, только если изменение их затронуло
+    if first_changed_row is not None and first_changed_row < SAMPLE_ROWS:
+        sheet.sample_data = json.dumps(read_sample_rows(excel_file.file_path, sheet.name), default=str)
+    
+    # Добавленные строки учитываем в профиле сразу, иначе он пересчитается при чтении
+    profile = sheet.get_profile()
+    if profile is not None and not profile.get('stale'):
+        if added_rows is None:
+            mark_stale(profile)
+        else:
+            add_rows_to_profile(profile, added_rows)
+        sheet.set_profile(profile)
+    
+    if sheet.position == 0:
+        excel_file.row_count = sheet.row_count
+
+def update_sheet_metadata(excel_file, sheet_name, action_type, row_index=None, row_data=None):
+    """
+    Обновляет сохраненные метаданные листа после успешного изменения данных,
+    не сканируя файл целиком.
+    
+    Args:
+        excel_file: Объект ExcelFile
+        sheet_name: Имя листа (None - первый лист)
+        action_type: Тип изменения ('update_cell', 'add_row', 'delete_row')
+        row_index: Индекс измененной строки (начиная с 0)
+        row_data: Данные добавленной строки (для 'add_row')
+    """
+    try:
+        row_delta = 0
+        added_rows = None
+        if action_type == 'add_row':
+            row_delta = 1
+            sheet = excel_file.get_sheet(sheet_name)
+            row_index = sheet.row_count if sheet else None
+            added_rows = [row_data] if row_data is not None else None
+        elif action_type == 'delete_row':
+            row_delta = -1
+        
+        _update_sheet_counts(excel_file, sheet_name, row_delta, row_index, added_rows)
+        excel_file.bump_version()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error updating sheet metadata: {str(e)}")
+
+def update_sheet_metadata_batch(excel_file, results, operations=None):
+    """
+    Обновляет метаданные листов по результатам apply_excel_operations
+    
+    Args:
+        operations: Исходный список операций (нужен, чтобы учесть добавленные
+            строки в профиле колонок)
+    """
+    try:
+        changes = {}
+        for result in results:
+            row_delta, first_row, added_rows = changes.get(result['sheet'], (0, None, []))
+            if result['action'] == 'add_row':
+                row_delta += 1
+                if added_rows is not None and operations is not None:
+                    added_rows.append(operations[result['index']]['data'])
+                else:
+                    added_rows = None
+            else:
+                if result['action'] == 'delete_row':
+                    row_delta -= 1
+                added_rows = None
+            first_row = result['row'] if first_row is None else min(first_row, result['row'])
+            changes[result['sheet']] = (row_delta, first_row, added_rows)
+        
+        for sheet_name, (row_delta, first_row, added_rows) in changes.items():
+            _update_sheet_counts(excel_file, sheet_name, row_delta, first_row, added_rows)
+        excel_file.bump_version()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error updating sheet metadata: {str(e)}")
+
 def can_perform_action(excel_file, action_type):
     """
     Проверяет, можно ли выполнить действие с файлом, в зависимости от уровня доступа.
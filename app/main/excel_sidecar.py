@@ -0,0 +1,152 @@
+"""
+Columnar Arrow IPC sidecars for uploaded workbooks
+
+Every sheet of a workbook can be stored next to it as an uncompressed Arrow
+IPC file. Reading a sidecar is a memory map instead of XML parsing, and the
+mapped pages are shared between worker processes. Each sidecar records the
+fingerprint of the workbook it was built from, so a sidecar of a file that
+was modified afterwards is ignored and rebuilt on the next parse.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from flask import current_app
+
+from app.main.excel_cache import file_fingerprint, get_disk_frame, get_sheet_names
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - sidecars are an optional speed-up
+    pa = None
+
+SIDECAR_SUFFIX = '.columnar'
+
+
+def sidecars_enabled():
+    return pa is not None and current_app.config.get('EXCEL_SIDECARS_ENABLED', True)
+
+
+def get_sidecar_dir(file_path):
+    return os.path.abspath(file_path) + SIDECAR_SUFFIX
+
+
+def get_sidecar_path(file_path, sheet_name):
+    digest = hashlib.sha1(str(sheet_name).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(get_sidecar_dir(file_path), f"{digest}.arrow")
+
+
+def _source_metadata(fingerprint, sheet_name, columns):
+    mtime_ns, size = fingerprint
+    return {
+        b'source_mtime_ns': str(mtime_ns).encode(),
+        b'source_size': str(size).encode(),
+        b'sheet_name': str(sheet_name).encode('utf-8'),
+        b'columns': json.dumps(columns, default=str).encode('utf-8')
+    }
+
+
+def write_sidecar(file_path, sheet_name, df, fingerprint=None):
+    """
+    Store a parsed sheet as an Arrow IPC file.
+    
+    fingerprint is the version of the workbook the frame was parsed from;
+    returns False if the frame cannot be converted.
+    """
+    if not sidecars_enabled():
+        return False
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        # Columns with mixed value types have no Arrow representation
+        current_app.logger.info(f"No sidecar for sheet {sheet_name}: {str(e)}")
+        return False
+
+    metadata = dict(table.schema.metadata or {})
+    metadata.update(_source_metadata(fingerprint or file_fingerprint(file_path), sheet_name, df.columns.tolist()))
+    table = table.replace_schema_metadata(metadata)
+
+    sidecar_path = get_sidecar_path(file_path, sheet_name)
+    os.makedirs(os.path.dirname(sidecar_path), exist_ok=True)
+    # A unique temporary file: an ingest worker and a request thread may write the same sidecar
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(sidecar_path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(sidecar_path))
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, sidecar_path)
+    except OSError as e:
+        # The sidecar is only a cache: a failed write must not fail the read that triggered it
+        current_app.logger.warning(f"Sidecar for sheet {sheet_name} not written: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+def open_sidecar(file_path, sheet_name):
+    """
+    Memory-map the sidecar of a sheet and return it as an Arrow table.
+
+    Returns None if there is no sidecar or it was built from an older
+    version of the workbook.
+    """
+    if not sidecars_enabled():
+        return None
+
+    sidecar_path = get_sidecar_path(file_path, sheet_name)
+    if not os.path.exists(sidecar_path):
+        return None
+
+    try:
+        table = pa.ipc.open_file(pa.memory_map(sidecar_path, 'r')).read_all()
+    except (OSError, pa.ArrowInvalid) as e:
+        current_app.logger.warning(f"Unreadable sidecar {sidecar_path}: {str(e)}")
+        return None
+
+    metadata = table.schema.metadata or {}
+    mtime_ns, size = file_fingerprint(file_path)
+    if (metadata.get(b'source_mtime_ns') != str(mtime_ns).encode()
+            or metadata.get(b'source_size') != str(size).encode()):
+        return None
+    return table
+
+
+def sidecar_to_frame(table):
+    """Convert a (sliced) sidecar table to a DataFrame with the original column names"""
+    df = table.to_pandas()
+    columns = (table.schema.metadata or {}).get(b'columns')
+    if columns:
+        df.columns = json.loads(columns)
+    return df
+
+
+def read_sidecar(file_path, sheet_name):
+    """Read a whole sheet from its sidecar, or None if it is missing or stale"""
+    table = open_sidecar(file_path, sheet_name)
+    if table is None:
+        return None
+    return sidecar_to_frame(table)
+
+
+def build_sidecars(file_path, sheet_names=None):
+    """Build sidecars for all sheets of a workbook (used at ingestion)"""
+    if not sidecars_enabled():
+        return 0
+
+    built = 0
+    for sheet_name in sheet_names or get_sheet_names(file_path):
+        # Parsing a sheet on a cache miss already writes its sidecar
+        df = get_disk_frame(file_path, sheet_name)
+        if open_sidecar(file_path, sheet_name) is not None or write_sidecar(file_path, sheet_name, df):
+            built += 1
+    return built
+
+
+def remove_sidecars(file_path):
+    shutil.rmtree(get_sidecar_dir(file_path), ignore_errors=True)
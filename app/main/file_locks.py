@@ -0,0 +1,93 @@
+"""
+Cross-process write locks and atomic replacement of workbook files
+
+Writers serialize their read-modify-write cycles on an advisory lock file
+next to the workbook and publish the result with an atomic rename. Readers
+take no lock: a reader that already opened the file keeps reading the old
+snapshot, everyone else sees the new one, nobody sees a half-written zip.
+"""
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: locks only cover this process
+    fcntl = None
+
+LOCK_SUFFIX = '.lock'
+
+# path -> [lock, number of threads holding or waiting for it]
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def get_lock_path(file_path):
+    return os.path.abspath(file_path) + LOCK_SUFFIX
+
+
+@contextmanager
+def _thread_lock(path):
+    # flock does not exclude threads that share an open file description,
+    # so threads of one process also queue on a regular lock. The lock is
+    # dropped when its last user leaves, so the table only holds files
+    # that are being written.
+    with _thread_locks_guard:
+        entry = _thread_locks.setdefault(path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _thread_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _thread_locks[path]
+
+
+@contextmanager
+def write_lock(file_path):
+    """Hold the exclusive write lock of a file for the duration of the block"""
+    path = os.path.abspath(file_path)
+    with _thread_lock(path):
+        if fcntl is None:
+            yield
+            return
+        with open(get_lock_path(path), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def atomic_replace(file_path):
+    """
+    Yield a temporary path in the directory of file_path; when the block
+    succeeds the temporary file replaces file_path in one rename.
+    """
+    directory, name = os.path.split(os.path.abspath(file_path))
+    base, ext = os.path.splitext(name)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{base}.", suffix=ext, dir=directory)
+    os.close(fd)
+    try:
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, tmp_path)
+        yield tmp_path
+        with open(tmp_path, 'rb') as tmp_file:
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove_lock_file(file_path):
+    try:
+        os.remove(get_lock_path(file_path))
+    except FileNotFoundError:
+        pass
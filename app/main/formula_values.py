@@ -0,0 +1,216 @@
+"""
+Cached formula results across openpyxl saves
+
+A workbook loaded by openpyxl keeps the formulas but not their last
+computed results, and saves the formula cells without a value. Every
+reader of the app (pandas, calamine, the scanner, sidecars) uses those
+cached results, so after an edit all formula columns would read as empty.
+
+remember_results records the results of the formula cells when a
+workbook is opened for editing; restore_results writes them back into the
+saved file. Cells are tracked by identity, so a formula moved up by a
+deleted row keeps its result if it reads no shifted cell. Edits are recorded with mark_changed; a
+formula that reads an edited cell, directly or through other formulas, is
+saved without a result, as are formulas whose inputs cannot be told
+(defined names, tables, INDIRECT). Excel recalculates all formulas when
+the file is opened.
+"""
+import os
+import tempfile
+import weakref
+import xml.etree.ElementTree as ET
+import zipfile
+from datetime import date, datetime, time, timedelta
+from io import BytesIO
+
+import openpyxl
+from openpyxl.formula.tokenizer import Token, Tokenizer, TokenizerError
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.utils.datetime import to_excel
+
+SHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+# Workbook -> {id(cell): (cell, result, data type of the result)}
+_results = weakref.WeakKeyDictionary()
+
+# Workbook -> [(sheet title, (min_col, min_row, max_col, max_row))] of edited cells,
+# None bounds reach the edge of the sheet
+_changes = weakref.WeakKeyDictionary()
+
+# Functions whose inputs are not visible in the formula text
+_HIDDEN_INPUTS = {'INDIRECT', 'OFFSET'}
+
+
+def _formula_cells(workbook):
+    # _cells holds the existing cells only, iterating rows would create empty ones
+    for worksheet in workbook.worksheets:
+        for cell in list(worksheet._cells.values()):
+            if cell.data_type == 'f':
+                yield worksheet, cell
+
+
+def remember_results(workbook, file_path):
+    """Record the cached results of the formulas of a workbook opened from file_path"""
+    cells = list(_formula_cells(workbook))
+    if not cells:
+        return
+    values = openpyxl.load_workbook(file_path, data_only=True)
+    try:
+        results = {}
+        for worksheet, cell in cells:
+            cached = values[worksheet.title]._cells.get((cell.row, cell.column))
+            if cached is not None and cached.value is not None:
+                results[id(cell)] = (cell, cached.value, cached.data_type)
+        _results[workbook] = results
+    finally:
+        values.close()
+
+
+def mark_changed(worksheet, min_row, max_row=None, min_col=None, max_col=None):
+    """
+    Record edited cells of a worksheet, in the coordinates of the saved
+    file; open bounds (None) reach the end of the sheet.
+    """
+    _changes.setdefault(worksheet.parent, []).append(
+        (worksheet.title.lower(), (min_col, min_row, max_col, max_row)))
+
+
+def _references(cell):
+    """[(sheet title, bounds)] of the cells a formula reads, or None if they cannot be told"""
+    formula = getattr(cell.value, 'text', cell.value)
+    if not isinstance(formula, str):
+        return None
+    try:
+        tokens = Tokenizer(formula).items
+    except TokenizerError:
+        return None
+    references = []
+    for token in tokens:
+        if token.type == Token.FUNC and token.subtype == Token.OPEN:
+            if token.value.rstrip('(').upper().split('.')[-1] in _HIDDEN_INPUTS:
+                return None
+        if token.type != Token.OPERAND or token.subtype != Token.RANGE:
+            continue
+        sheet, _, reference = token.value.rpartition('!')
+        if sheet.startswith('['):
+            # Another workbook, not changed by our edits
+            continue
+        if ':' in sheet:
+            return None
+        sheet = sheet[1:-1].replace("''", "'") if sheet.startswith("'") else sheet
+        try:
+            bounds = range_boundaries(reference.replace('$', ''))
+        except ValueError:
+            return None
+        references.append(((sheet or cell.parent.title).lower(), bounds))
+    return references
+
+
+def _overlaps(first, second):
+    for low, high, other_low, other_high in ((first[0], first[2], second[0], second[2]),
+                                             (first[1], first[3], second[1], second[3])):
+        if high is not None and other_low is not None and high < other_low:
+            return False
+        if other_high is not None and low is not None and other_high < low:
+            return False
+    return True
+
+
+def _reads_changes(references, changes):
+    if references is None:
+        return True
+    return any(sheet == changed_sheet and _overlaps(bounds, changed)
+               for sheet, bounds in references for changed_sheet, changed in changes)
+
+
+def _fresh_results(workbook, results):
+    """Results of the formulas that read no edited cell, directly or through other formulas"""
+    changes = list(_changes.get(workbook, ()))
+    pending = [(cell, value, data_type, _references(cell)) for cell, value, data_type in results]
+    outdated = True
+    while changes and outdated:
+        outdated = False
+        fresh = []
+        for entry in pending:
+            cell = entry[0]
+            if _reads_changes(entry[3], changes):
+                changes.append((cell.parent.title.lower(), (cell.column, cell.row, cell.column, cell.row)))
+                outdated = True
+            else:
+                fresh.append(entry)
+        pending = fresh
+    return [entry[:3] for entry in pending]
+
+
+def _value_element(value, data_type, epoch):
+    """(text of <v>, t attribute) of a cached result"""
+    if data_type == 'b' or isinstance(value, bool):
+        return ('1' if value else '0'), 'b'
+    if data_type == 'e':
+        return str(value), 'e'
+    if isinstance(value, (datetime, date, time, timedelta)):
+        return repr(to_excel(value, epoch)), None
+    if isinstance(value, (int, float)):
+        return repr(value), None
+    return str(value), 'str'
+
+
+def _sheet_with_results(xml, values):
+    namespaces = [ns for _, ns in ET.iterparse(BytesIO(xml), events=['start-ns'])]
+    for prefix, uri in namespaces:
+        ET.register_namespace(prefix, uri)
+    root = ET.fromstring(xml)
+    for c in root.iter(f'{{{SHEET_NS}}}c'):
+        result = values.get(c.get('r'))
+        if result is None or c.find(f'{{{SHEET_NS}}}f') is None:
+            continue
+        text, data_type = result
+        v = c.find(f'{{{SHEET_NS}}}v')
+        if v is None:
+            v = ET.SubElement(c, f'{{{SHEET_NS}}}v')
+        v.text = text
+        if data_type:
+            c.set('t', data_type)
+    return ET.tostring(root, encoding='UTF-8', xml_declaration=True)
+
+
+def prepare_save(workbook):
+    """
+    Call before workbook.save: returns the results to restore (or None)
+    and makes Excel recalculate the formulas when the file is opened.
+    """
+    results = _results.get(workbook)
+    if not results:
+        return None
+    # Cells of deleted rows and formulas replaced by values are skipped
+    saved = [(cell, value, data_type) for cell, value, data_type in results.values()
+             if cell.data_type == 'f' and cell.parent in workbook.worksheets
+             and cell.parent._cells.get((cell.row, cell.column)) is cell]
+    by_part = {}
+    for cell, value, data_type in _fresh_results(workbook, saved):
+        worksheet = cell.parent
+        by_part.setdefault(worksheet, {})[cell.coordinate] = _value_element(value, data_type, workbook.epoch)
+    workbook.calculation.fullCalcOnLoad = True
+    return by_part
+
+
+def restore_results(xlsx_path, by_part):
+    """Write the results returned by prepare_save into a workbook saved at xlsx_path"""
+    if not by_part:
+        return
+    parts = {worksheet.path.lstrip('/'): values for worksheet, values in by_part.items()}
+    fd, rewritten = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(xlsx_path)))
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(xlsx_path) as source, \
+                zipfile.ZipFile(rewritten, 'w', zipfile.ZIP_DEFLATED) as target:
+            for item in source.infolist():
+                data = source.read(item.filename)
+                if item.filename in parts:
+                    data = _sheet_with_results(data, parts[item.filename])
+                target.writestr(item, data)
+        os.replace(rewritten, xlsx_path)
+    except BaseException:
+        if os.path.exists(rewritten):
+            os.remove(rewritten)
+        raise
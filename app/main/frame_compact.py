@@ -0,0 +1,96 @@
+"""
+Memory-compact representation of parsed sheets
+
+Frames are compacted before they enter the sheet cache: integer columns
+are downcast to the smallest integer type that holds their values,
+string columns with few distinct values become categoricals and, if
+enabled, the remaining string columns use Arrow-backed strings. All of
+these are lossless. Floats keep float64, since aggregates computed in
+float32 would lose precision.
+
+Code that modifies a frame or relies on object semantics expands the
+columns it needs back to the default dtypes with expand_frame, and
+logical_dtype reports the dtype a column had before compaction.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_integer_dtype, is_string_dtype
+
+try:
+    import pyarrow  # noqa: F401
+    ARROW_STRINGS_AVAILABLE = True
+except ImportError:  # pragma: no cover - Arrow strings are optional
+    ARROW_STRINGS_AVAILABLE = False
+
+CATEGORY_MAX_RATIO = 0.5  # distinct values per non-null value
+CATEGORY_MIN_ROWS = 16
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def _is_string_column(series):
+    return series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == 'string'
+
+
+def _compact_series(series, category_max_ratio, arrow_strings):
+    if is_integer_dtype(series.dtype) and not is_bool_dtype(series.dtype):
+        return pd.to_numeric(series, downcast='integer')
+    if _is_string_column(series):
+        count = series.count()
+        if count >= CATEGORY_MIN_ROWS and series.nunique() <= count * category_max_ratio:
+            return series.astype('category')
+        if arrow_strings and ARROW_STRINGS_AVAILABLE:
+            return series.astype('string[pyarrow]')
+    return series
+
+
+def compact_frame(df, category_max_ratio=CATEGORY_MAX_RATIO, arrow_strings=False):
+    """Return (compacted frame, bytes saved); the input frame is not modified"""
+    before = frame_bytes(df)
+    compacted = df.copy(deep=False)
+    for position in range(len(df.columns)):
+        series = df.iloc[:, position]
+        converted = _compact_series(series, category_max_ratio, arrow_strings)
+        if converted is not series:
+            compacted.isetitem(position, converted)
+    return compacted, before - frame_bytes(compacted)
+
+
+def expand_series(series):
+    """A column with the dtype pandas would have parsed it as"""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return series.astype(dtype.categories.dtype)
+    if is_integer_dtype(dtype) and not is_bool_dtype(dtype) and dtype != 'int64':
+        return series.astype('int64')
+    if is_string_dtype(dtype) and dtype != object:
+        return series.astype(object).where(series.notna(), np.nan)
+    return series
+
+
+def expand_frame(df, columns=None):
+    """
+    Return a copy of a frame with compacted columns converted back to the
+    default dtypes (all columns, or only the given ones).
+    """
+    expanded = df.copy()
+    for position, column in enumerate(df.columns):
+        if columns is None or column in columns:
+            series = df.iloc[:, position]
+            converted = expand_series(series)
+            if converted is not series:
+                expanded.isetitem(position, converted)
+    return expanded
+
+
+def logical_dtype(dtype):
+    """Name of the dtype a column had before compaction"""
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if is_integer_dtype(dtype) and not is_bool_dtype(dtype):
+        return 'int64'
+    if is_string_dtype(dtype):
+        return 'object'
+    return str(dtype)
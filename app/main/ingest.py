@@ -0,0 +1,198 @@
+"""
+Background ingestion of uploaded workbooks
+
+The upload request only stores the file and its record. Scanning sheet
+metadata, building columnar sidecars and computing column profiles run in
+a worker pool; progress is recorded on the ExcelFile record and served by
+/api/files/<id>/ingest-status. A file whose content is already stored and
+ingested for another record copies that record's metadata and profiles and
+shares its sidecars instead.
+
+Queued work lives in the memory of a process, so a restart loses it: a
+record left PENDING or PROCESSING without progress for INGEST_STALE_SECONDS
+is queued again when it is accessed. FAILED files are ingested again on
+request (retry_ingestion).
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from app.models import ExcelFile, ExcelSheet, IngestStatus
+from app.main.column_profile import profile_frame
+from app.main.excel_cache import get_sheet_frame
+from app.main.excel_scanner import scan_workbook
+from app.main.excel_sidecar import build_sidecars
+from app.main.storage import find_ingested_duplicate
+from app.main.utils import store_sheet_metadata
+
+DEFAULT_STALE_SECONDS = 900
+
+_executor = None
+_executor_lock = threading.Lock()
+# Ids of the files queued or being ingested by this process
+_active = set()
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config.get('INGEST_WORKERS', 2),
+                                           thread_name_prefix='ingest')
+        return _executor
+
+
+def submit_ingestion(excel_file):
+    """
+    Queue ingestion of a committed ExcelFile record.
+
+    Runs inline when INGEST_ASYNC is off (e.g. in tests).
+    """
+    excel_file.ingest_status = IngestStatus.PENDING
+    excel_file.ingest_progress = 0
+    excel_file.ingest_error = None
+    db.session.commit()
+
+    _active.add(excel_file.id)
+    app = current_app._get_current_object()
+    if not app.config.get('INGEST_ASYNC', True):
+        run_ingestion(excel_file.id)
+        return None
+    return _get_executor(app).submit(_run_in_app_context, app, excel_file.id)
+
+
+def _run_in_app_context(app, file_id):
+    with app.app_context():
+        run_ingestion(file_id)
+
+
+def is_stale(excel_file):
+    """Ingestion of the file was started but no process is working on it any more"""
+    if excel_file.ingest_status not in (IngestStatus.PENDING, IngestStatus.PROCESSING):
+        return False
+    if excel_file.id in _active:
+        return False
+    stale_after = current_app.config.get('INGEST_STALE_SECONDS', DEFAULT_STALE_SECONDS)
+    # Every progress update touches last_modified
+    updated = excel_file.last_modified or excel_file.upload_date
+    return datetime.utcnow() - updated > timedelta(seconds=stale_after)
+
+
+def resume_ingestion(excel_file):
+    """
+    Queue the ingestion of a stale file again.
+
+    The record is claimed with a conditional update first, so when several
+    processes see the same stale file only one of them queues it. Returns
+    True if this call queued the ingestion.
+    """
+    if not is_stale(excel_file):
+        return False
+    claimed = ExcelFile.query.filter_by(
+        id=excel_file.id,
+        ingest_status=excel_file.ingest_status,
+        last_modified=excel_file.last_modified
+    ).update({'ingest_status': IngestStatus.PENDING, 'last_modified': datetime.utcnow()},
+             synchronize_session=False)
+    db.session.commit()
+    db.session.refresh(excel_file)
+    if not claimed:
+        return False
+    current_app.logger.warning(f"Ingestion of {excel_file.filename} was interrupted, queued again")
+    submit_ingestion(excel_file)
+    return True
+
+
+def retry_ingestion(excel_file):
+    """Ingest a file whose ingestion failed again; returns False for other states"""
+    if excel_file.ingest_status != IngestStatus.FAILED:
+        return False
+    submit_ingestion(excel_file)
+    return True
+
+
+def _set_progress(excel_file, progress, status=IngestStatus.PROCESSING):
+    excel_file.ingest_status = status
+    excel_file.ingest_progress = progress
+    db.session.commit()
+
+
+def _copy_ingested_metadata(excel_file, source):
+    """Reuse the metadata of a record stored at the same object"""
+    source_sheets = source.sheets.all()
+    if not source_sheets:
+        return False
+
+    excel_file.sheet_names = source.sheet_names
+    excel_file.row_count = source.row_count
+    excel_file.column_count = source.column_count
+    for stored_sheet in excel_file.sheets.all():
+        excel_file.sheets.remove(stored_sheet)
+    for sheet in source_sheets:
+        excel_file.sheets.append(ExcelSheet(
+            name=sheet.name,
+            position=sheet.position,
+            row_count=sheet.row_count,
+            column_count=sheet.column_count,
+            columns=sheet.columns,
+            dtypes=sheet.dtypes,
+            sample_data=sheet.sample_data,
+            profile=sheet.profile
+        ))
+    return True
+
+
+def run_ingestion(file_id):
+    """Scan, convert and profile an uploaded file, recording progress on its record"""
+    excel_file = db.session.get(ExcelFile, file_id)
+    if excel_file is None:
+        _active.discard(file_id)
+        return
+    file_path = excel_file.file_path
+
+    try:
+        _set_progress(excel_file, 5)
+
+        # Duplicate upload: sidecars and parse caches are keyed by the shared path already
+        source = find_ingested_duplicate(excel_file)
+        if source is not None and _copy_ingested_metadata(excel_file, source):
+            _set_progress(excel_file, 100, IngestStatus.READY)
+            return
+
+        sheets = scan_workbook(file_path)
+        first_sheet = sheets[0] if sheets else {'row_count': 0, 'column_count': 0}
+        excel_file.sheet_names = json.dumps([sheet['name'] for sheet in sheets])
+        excel_file.row_count = first_sheet['row_count']
+        excel_file.column_count = first_sheet['column_count']
+        store_sheet_metadata(excel_file, sheets)
+        _set_progress(excel_file, 40)
+
+        # Convert sheets to columnar sidecars used by all later reads
+        try:
+            build_sidecars(file_path, [sheet['name'] for sheet in sheets])
+        except Exception as e:
+            current_app.logger.warning(f"Sidecar build failed for {excel_file.filename}: {str(e)}")
+        _set_progress(excel_file, 70)
+
+        # Column statistics, computed from the frames already parsed for the sidecars
+        stored_sheets = excel_file.sheets.all()
+        for index, sheet in enumerate(stored_sheets, start=1):
+            try:
+                sheet.set_profile(profile_frame(get_sheet_frame(file_path, sheet.name)))
+            except Exception as e:
+                current_app.logger.warning(f"Column profile failed for {excel_file.filename}/{sheet.name}: {str(e)}")
+            _set_progress(excel_file, 70 + 30 * index // (len(stored_sheets) + 1))
+
+        _set_progress(excel_file, 100, IngestStatus.READY)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Ingestion of {excel_file.filename} failed: {str(e)}")
+        excel_file.ingest_status = IngestStatus.FAILED
+        excel_file.ingest_error = str(e)
+        db.session.commit()
+    finally:
+        _active.discard(file_id)
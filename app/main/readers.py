@@ -0,0 +1,191 @@
+"""
+Spreadsheet reader backends
+
+Sheets are parsed into DataFrames by one of several engines: openpyxl for
+.xlsx and xlrd for .xls, the defaults, and the Rust-based calamine
+(python-calamine) for both, which is several times faster for read-only
+work and is enabled through the EXCEL_READERS setting. The engine is
+chosen per file format and operation from that setting, a list of
+engines in order of preference; engines that are not installed are
+skipped. `flask benchmark-readers` measures the engines on sample files
+to decide the order.
+
+Edits keep using openpyxl directly (app.main.excel_service), since only it
+preserves formulas and formatting when saving.
+"""
+import importlib.util
+import os
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from flask import current_app, has_app_context
+
+DEFAULT_ENGINES = {
+    'xlsx': {'read': ['openpyxl'], 'sheet_names': ['openpyxl']},
+    'xls': {'read': ['xlrd'], 'sheet_names': ['xlrd']},
+}
+
+
+class ReaderBackend:
+    """An engine that parses sheets of the given formats into DataFrames"""
+
+    def __init__(self, name, formats, module, read_frame, sheet_names):
+        self.name = name
+        self.formats = set(formats)
+        self.module = module
+        self.read_frame = read_frame
+        self.sheet_names = sheet_names
+
+    def available(self):
+        return importlib.util.find_spec(self.module) is not None
+
+    def __repr__(self):
+        return f'<ReaderBackend {self.name}>'
+
+
+_backends = {}
+
+
+def register_backend(backend):
+    _backends[backend.name] = backend
+    return backend
+
+
+def get_backends(file_format=None):
+    """Installed engines, optionally only those supporting a format"""
+    return [backend for backend in _backends.values()
+            if backend.available() and (file_format is None or file_format in backend.formats)]
+
+
+def file_format(file_path):
+    return os.path.splitext(file_path)[1].lower().lstrip('.')
+
+
+def get_backend(file_path, operation='read'):
+    """The preferred installed engine for an operation on a file"""
+    fmt = file_format(file_path)
+    engines = DEFAULT_ENGINES.get(fmt, {}).get(operation, [])
+    if has_app_context():
+        engines = current_app.config.get('EXCEL_READERS', {}).get(fmt, {}).get(operation, engines)
+
+    for name in engines:
+        backend = _backends.get(name)
+        if backend is not None and fmt in backend.formats and backend.available():
+            return backend
+    # Nothing configured is installed: any engine that can read the format
+    for backend in get_backends(fmt):
+        return backend
+    raise ValueError(f"No reader available for .{fmt} files")
+
+
+def read_frame(file_path, sheet_name, engine=None):
+    """Parse a sheet into a DataFrame, like pd.read_excel with the default header"""
+    backend = _backends[engine] if engine else get_backend(file_path, 'read')
+    return backend.read_frame(file_path, sheet_name)
+
+
+def read_sheet_names(file_path, engine=None):
+    backend = _backends[engine] if engine else get_backend(file_path, 'sheet_names')
+    return backend.sheet_names(file_path)
+
+
+def benchmark(file_path, repeat=3):
+    """
+    Time every installed engine on a file.
+
+    Returns {engine: seconds}, the best of `repeat` runs of listing the
+    sheets and parsing all of them.
+    """
+    timings = {}
+    for backend in get_backends(file_format(file_path)):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for sheet_name in backend.sheet_names(file_path):
+                backend.read_frame(file_path, sheet_name)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[backend.name] = best
+    return timings
+
+
+# openpyxl and xlrd: through pandas
+
+def _pandas_reader(engine):
+    def read(file_path, sheet_name):
+        return pd.read_excel(file_path, sheet_name=sheet_name, engine=engine)
+    return read
+
+
+def _openpyxl_sheet_names(file_path):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def _xlrd_sheet_names(file_path):
+    import xlrd
+
+    workbook = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        return list(workbook.sheet_names())
+    finally:
+        workbook.release_resources()
+
+
+# calamine: cell values are converted the way pandas' own readers convert them
+
+def _calamine_value(value):
+    if value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        # openpyxl returns every date cell as a datetime, which makes the column datetime64[ns]
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def _calamine_read(file_path, sheet_name):
+    from python_calamine import CalamineWorkbook
+    from app.main.excel_scanner import normalize_headers
+
+    workbook = CalamineWorkbook.from_path(file_path)
+    if sheet_name not in workbook.sheet_names:
+        raise ValueError(f"Worksheet named '{sheet_name}' not found")
+    rows = workbook.get_sheet_by_name(sheet_name).to_python(skip_empty_area=False)
+    rows = [[_calamine_value(value) for value in row] for row in rows]
+    while rows and all(value is None for value in rows[-1]):
+        rows.pop()
+    if not rows:
+        return pd.DataFrame()
+
+    # Trailing columns without any value are not part of the table
+    width = max(len(row) for row in rows)
+    while width and all(len(row) < width or row[width - 1] is None for row in rows):
+        width -= 1
+    rows = [(row + [None] * width)[:width] for row in rows]
+    df = pd.DataFrame(rows[1:], columns=normalize_headers(rows[0])).infer_objects()
+    # pandas' readers leave NaN in empty cells of object columns
+    text_columns = df.columns[df.dtypes == object]
+    df[text_columns] = df[text_columns].where(df[text_columns].notna(), np.nan)
+    return df
+
+
+def _calamine_sheet_names(file_path):
+    from python_calamine import CalamineWorkbook
+
+    return list(CalamineWorkbook.from_path(file_path).sheet_names)
+
+
+register_backend(ReaderBackend('openpyxl', ['xlsx', 'xlsm'], 'openpyxl',
+                               _pandas_reader('openpyxl'), _openpyxl_sheet_names))
+register_backend(ReaderBackend('xlrd', ['xls'], 'xlrd', _pandas_reader('xlrd'), _xlrd_sheet_names))
+register_backend(ReaderBackend('calamine', ['xlsx', 'xlsm', 'xls', 'xlsb', 'ods'], 'python_calamine',
+                               _calamine_read, _calamine_sheet_names))
@@ -7,7 +7,9 @@ from datetime import datetime
 
 from app.main import bp
 from app.main.forms import FileUploadForm, ChatForm, NewChatSessionForm, EditFilePermissionForm
-from app.main.utils import save_uploaded_file, load_excel_data, save_excel_data, get_excel_summary, delete_file
+from app.main.utils import save_uploaded_file, get_sheet_layout, save_excel_data, get_excel_summary, release_file
+from app.main.ingest import submit_ingestion
+from app.main.edit_buffer import flush_file
 from app.models import User, ExcelFile, ChatSession, ChatMessage, PermissionMode, MessageType
 from app import db
 
@@ -108,26 +110,14 @@ def upload_file():
     form = FileUploadForm()
     
     if form.validate_on_submit():
-        file_info, error = save_uploaded_file(form.file.data, current_user.id)
+        excel_file, error = save_uploaded_file(form.file.data, current_user.id,
+                                               PermissionMode(form.permission_mode.data))
         
         if error:
             flash(_(error), 'error')
         else:
-            # Save file record to database
-            excel_file = ExcelFile(
-                user_id=current_user.id,
-                filename=file_info['filename'],
-                original_filename=file_info['original_filename'],
-                file_path=file_info['file_path'],
-                file_size=file_info['file_size'],
-                permission_mode=PermissionMode(form.permission_mode.data),
-                sheet_names=file_info['sheet_names'],
-                row_count=file_info['row_count'],
-                column_count=file_info['column_count']
-            )
-            
-            db.session.add(excel_file)
-            db.session.commit()
+            # Metadata, sidecars and profiles are built in the background
+            submit_ingestion(excel_file)
             
             flash(_('File uploaded successfully!'), 'success')
             return redirect(url_for('main.files'))
@@ -156,12 +146,13 @@ def view_file(file_id):
         flash(_('You do not have permission to view this file.'), 'error')
         return redirect(url_for('main.files'))
     
-    # Load Excel data
+    # Only the header is rendered, the grid fetches the rows it shows from /api/files/<id>/rows
     sheet_name = request.args.get('sheet')
-    data, error = load_excel_data(excel_file.file_path, sheet_name)
-    
-    if error:
-        flash(_(error), 'error')
+    try:
+        data = get_sheet_layout(excel_file, sheet_name)
+    except Exception as e:
+        current_app.logger.error(f"Excel loading error: {str(e)}")
+        flash(_('Failed to load Excel data'), 'error')
         data = None
     
     # Get sheet names
@@ -205,6 +196,10 @@ def download_file(file_id):
         return redirect(url_for('main.files'))
     
     try:
+        # Buffered edits must be in the file before it is sent
+        success, error = flush_file(excel_file.file_path)
+        if not success:
+            raise RuntimeError(error)
         return send_file(excel_file.file_path, 
                         as_attachment=True, 
                         download_name=excel_file.original_filename)
@@ -224,13 +219,10 @@ def delete_file_route(file_id):
         return redirect(url_for('main.files'))
     
     try:
-        # Delete file from filesystem
-        success, error = delete_file(excel_file.file_path)
+        # Delete file from filesystem (kept while other files share its content) and mark as inactive
+        success, error = release_file(excel_file)
         
         if success:
-            # Mark as inactive in database
-            excel_file.is_active = False
-            db.session.commit()
             flash(_('File deleted successfully.'), 'success')
         else:
             flash(_(error), 'error')
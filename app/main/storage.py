@@ -0,0 +1,147 @@
+"""
+Content-addressed storage of uploaded workbooks
+
+Uploads are stored once per content under
+UPLOAD_FOLDER/objects/<sha[:2]>/<sha256><ext>, and every ExcelFile record
+with the same content points to the same object. Objects are immutable:
+the number of active records pointing to an object is its reference count,
+and before a record's data is modified it gets a private copy of the file
+(or takes the object over if it is the last reference).
+
+Reference counts are only read and changed under the write lock of the
+object: records pointing to an object are committed, and the object is
+deleted or taken over, while holding it.
+"""
+import hashlib
+import os
+import shutil
+from contextlib import contextmanager
+
+from flask import current_app
+
+from app import db
+from app.models import ExcelFile
+from app.main.excel_cache import invalidate_file
+from app.main.excel_sidecar import get_sidecar_dir
+from app.main.file_locks import write_lock, remove_lock_file
+
+OBJECTS_DIR = 'objects'
+BLOCK_SIZE = 1024 * 1024
+
+
+def get_objects_dir():
+    return os.path.join(os.path.abspath(current_app.config['UPLOAD_FOLDER']), OBJECTS_DIR)
+
+
+def get_object_path(sha256, ext):
+    # The extension stays on the object, readers choose their engine by it
+    return os.path.join(get_objects_dir(), sha256[:2], f"{sha256}{ext.lower()}")
+
+
+def is_object_path(file_path):
+    return os.path.abspath(file_path).startswith(get_objects_dir() + os.sep)
+
+
+def save_stream(stream, file_path):
+    """Write a stream to disk and return the SHA-256 of its content"""
+    hasher = hashlib.sha256()
+    with open(file_path, 'wb') as f:
+        for block in iter(lambda: stream.read(BLOCK_SIZE), b''):
+            hasher.update(block)
+            f.write(block)
+    return hasher.hexdigest()
+
+
+@contextmanager
+def stored_object(tmp_path, sha256, ext):
+    """
+    Move a completely written file into the object store.
+
+    Yields (object path, True if the content was already stored); in that
+    case the temporary file is removed. The write lock of the object is held
+    for the block: the caller creates and commits the record pointing to the
+    object inside it, so a concurrent release never finds the object
+    without references.
+    """
+    object_path = get_object_path(sha256, ext)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    with write_lock(object_path):
+        existed = os.path.exists(object_path)
+        if existed:
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, object_path)
+        try:
+            yield object_path, existed
+        except BaseException:
+            # No record can point to an object created under this lock
+            if not existed and os.path.exists(object_path):
+                os.remove(object_path)
+            raise
+
+
+def count_references(file_path, exclude_id=None):
+    """Number of active file records stored at a path"""
+    query = ExcelFile.query.filter_by(file_path=file_path, is_active=True)
+    if exclude_id is not None:
+        query = query.filter(ExcelFile.id != exclude_id)
+    return query.count()
+
+
+def find_ingested_duplicate(excel_file):
+    """Another active, fully ingested record of the same stored object, if any"""
+    from app.models import IngestStatus
+
+    if not is_object_path(excel_file.file_path):
+        return None
+    return ExcelFile.query.filter(
+        ExcelFile.id != excel_file.id,
+        ExcelFile.file_path == excel_file.file_path,
+        ExcelFile.is_active.is_(True),
+        ExcelFile.ingest_status == IngestStatus.READY
+    ).first()
+
+
+def _private_path(excel_file):
+    user_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], f"user_{excel_file.user_id}")
+    os.makedirs(user_folder, exist_ok=True)
+    return os.path.join(user_folder, f"{excel_file.id}_{excel_file.filename}")
+
+
+def ensure_private_file(excel_file):
+    """
+    Make sure a record owns its file before the file is modified.
+
+    Shared objects are copied, with their sidecars, so the copy keeps
+    using the already built parse caches; an object with no other
+    references is moved. Returns the path to write to.
+    """
+    object_path = excel_file.file_path
+    if not is_object_path(object_path):
+        return object_path
+
+    private_path = _private_path(excel_file)
+    with write_lock(object_path):
+        # A concurrent first edit of the same record may have made it private meanwhile
+        db.session.refresh(excel_file)
+        if excel_file.file_path != object_path:
+            return excel_file.file_path
+        shared = count_references(object_path, exclude_id=excel_file.id) > 0
+        sidecar_dir = get_sidecar_dir(object_path)
+        if shared:
+            # copy2 keeps the modification time, so the copied sidecars stay valid
+            shutil.copy2(object_path, private_path)
+            if os.path.isdir(sidecar_dir):
+                shutil.copytree(sidecar_dir, get_sidecar_dir(private_path), dirs_exist_ok=True)
+        else:
+            os.replace(object_path, private_path)
+            if os.path.isdir(sidecar_dir):
+                os.replace(sidecar_dir, get_sidecar_dir(private_path))
+        # Committed under the lock, so a concurrent call sees the new path
+        excel_file.file_path = private_path
+        excel_file.content_hash = None
+        db.session.commit()
+    if not shared:
+        remove_lock_file(object_path)
+        invalidate_file(object_path)
+    return private_path
@@ -0,0 +1,193 @@
+"""
+Resumable chunked uploads
+
+A client creates an upload session with the file name and size, sends the
+bytes with PUT requests that carry their offset, and finalizes the
+session once everything arrived. Chunks are streamed to a partial file in
+fixed-size blocks; an interrupted chunk keeps the bytes that reached disk,
+so the client resumes from the offset reported by the server instead of
+starting over.
+
+The SHA-256 of the file is updated as the bytes arrive. The running hash
+lives in the memory of the worker that received the chunks; if a chunk
+lands on another worker (or the process restarted), the file is hashed
+from disk once at finalization instead.
+"""
+import hashlib
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from app.models import ExcelFile, UploadSession
+from app.main.file_locks import write_lock, remove_lock_file
+from app.main.storage import stored_object
+from app.main.utils import allowed_file, build_upload_path, get_user_upload_path
+
+PARTIAL_DIR = '.partial'
+BLOCK_SIZE = 1024 * 1024
+
+
+class UploadConflict(Exception):
+    """The request does not match the state of the upload session (HTTP 409)"""
+
+
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+def get_part_path(upload):
+    return os.path.join(get_user_upload_path(upload.user_id), PARTIAL_DIR, f"{upload.id}.part")
+
+
+def _remove_part(upload):
+    part_path = get_part_path(upload)
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    remove_lock_file(part_path)
+    with _hashers_lock:
+        _hashers.pop(upload.id, None)
+
+
+def expire_upload_sessions(user_id):
+    """Drop unfinished sessions of a user that were not touched for UPLOAD_SESSION_TTL hours"""
+    ttl = timedelta(hours=current_app.config.get('UPLOAD_SESSION_TTL_HOURS', 24))
+    expired = UploadSession.query.filter(
+        UploadSession.user_id == user_id,
+        UploadSession.completed_at.is_(None),
+        UploadSession.updated_at < datetime.utcnow() - ttl
+    ).all()
+    for upload in expired:
+        _remove_part(upload)
+        db.session.delete(upload)
+    if expired:
+        db.session.commit()
+
+
+def create_upload(user_id, filename, size, permission_mode):
+    """Start an upload session; raises ValueError for unacceptable files"""
+    if not filename or not allowed_file(filename):
+        raise ValueError("Invalid file type")
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise ValueError("File size must be an integer")
+    if size <= 0:
+        raise ValueError("File is empty")
+    if size > current_app.config['MAX_UPLOAD_SIZE']:
+        raise ValueError(f"File is larger than {current_app.config['MAX_UPLOAD_SIZE'] // (1024 * 1024)}MB")
+
+    expire_upload_sessions(user_id)
+
+    upload = UploadSession(id=uuid.uuid4().hex, user_id=user_id, original_filename=filename,
+                           total_size=size, received_size=0, permission_mode=permission_mode)
+    part_path = get_part_path(upload)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    open(part_path, 'wb').close()
+
+    db.session.add(upload)
+    db.session.commit()
+    with _hashers_lock:
+        _hashers[upload.id] = (hashlib.sha256(), 0)
+    return upload
+
+
+def write_chunk(upload, offset, stream, content_length=None):
+    """
+    Append the bytes of a request stream at the given offset.
+
+    The offset must equal the number of bytes already received. Returns
+    the new offset; if the stream breaks off, the bytes written so far are
+    kept and the error is re-raised.
+    """
+    if upload.completed_at is not None:
+        raise UploadConflict("Upload is already finalized")
+    if offset != upload.received_size:
+        raise UploadConflict(f"Expected offset {upload.received_size}")
+    if content_length is not None and offset + content_length > upload.total_size:
+        raise ValueError("Chunk exceeds the declared file size")
+
+    part_path = get_part_path(upload)
+    with write_lock(part_path):
+        with _hashers_lock:
+            hasher, hashed = _hashers.pop(upload.id, (None, None))
+        if hashed != offset:
+            # Earlier chunks went to another process, the file is hashed at finalization
+            hasher = None
+
+        written = 0
+        try:
+            with open(part_path, 'r+b') as part_file:
+                # Bytes beyond the acknowledged offset belong to an interrupted request
+                part_file.seek(offset)
+                part_file.truncate()
+                while True:
+                    block = stream.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    if offset + written + len(block) > upload.total_size:
+                        raise ValueError("Chunk exceeds the declared file size")
+                    part_file.write(block)
+                    if hasher is not None:
+                        hasher.update(block)
+                    written += len(block)
+        finally:
+            upload.received_size = offset + written
+            db.session.commit()
+            if hasher is not None:
+                with _hashers_lock:
+                    _hashers[upload.id] = (hasher, upload.received_size)
+
+    return upload.received_size
+
+
+def _file_sha256(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def finalize_upload(upload):
+    """Move the completed file into the object store and create its ExcelFile record"""
+    if upload.completed_at is not None:
+        raise UploadConflict("Upload is already finalized")
+    if not upload.is_complete():
+        raise UploadConflict(f"Upload is incomplete: {upload.received_size} of {upload.total_size} bytes received")
+
+    part_path = get_part_path(upload)
+    with write_lock(part_path):
+        with _hashers_lock:
+            hasher, hashed = _hashers.pop(upload.id, (None, None))
+        sha256 = hasher.hexdigest() if hashed == upload.total_size else _file_sha256(part_path)
+
+        filename, _user_path = build_upload_path(upload.original_filename, upload.user_id)
+        with stored_object(part_path, sha256, os.path.splitext(filename)[1]) as (file_path, _existed):
+            excel_file = ExcelFile(
+                user_id=upload.user_id,
+                filename=filename,
+                original_filename=upload.original_filename,
+                file_path=file_path,
+                file_size=upload.total_size,
+                content_hash=sha256,
+                permission_mode=upload.permission_mode
+            )
+            db.session.add(excel_file)
+            db.session.flush()
+
+            upload.sha256 = sha256
+            upload.excel_file_id = excel_file.id
+            upload.completed_at = datetime.utcnow()
+            db.session.commit()
+    remove_lock_file(part_path)
+    return excel_file
+
+
+def cancel_upload(upload):
+    _remove_part(upload)
+    db.session.delete(upload)
+    db.session.commit()
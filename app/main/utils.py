@@ -1,9 +1,22 @@
 import os
+import shutil
 import pandas as pd
 import json
 from werkzeug.utils import secure_filename
 from datetime import datetime
 from flask import current_app
+from app.main.excel_cache import (get_sheet_frame, get_sheet_window, get_loaded_frame, resolve_sheet_name,
+                                  invalidate_file)
+from app.main.excel_scanner import scan_workbook, read_preview
+from app.main.excel_sidecar import open_sidecar, remove_sidecars
+from app.main.column_profile import profile_frame
+from app.main.frame_compact import logical_dtype
+from app.main.wire_format import arrow_stream, frame_records, frame_to_columnar
+from app.main.edit_buffer import discard_file, flush_file
+from app.main.file_locks import write_lock, atomic_replace, remove_lock_file
+from app.main.storage import save_stream, stored_object, count_references, is_object_path
+from app.models import ExcelFile, ExcelSheet, IngestStatus
+from app import db
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
@@ -18,83 +31,70 @@ def get_user_upload_path(user_id):
     
     return user_folder
 
-def save_uploaded_file(file, user_id):
-    """Save uploaded file and return file info"""
+def build_upload_path(original_filename, user_id):
+    """Generate a secure, timestamped filename and its path in the user's folder"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    secure_name = secure_filename(original_filename)
+    name, ext = os.path.splitext(secure_name)
+    filename = f"{name}_{timestamp}{ext}"
+    return filename, os.path.join(get_user_upload_path(user_id), filename)
+
+def save_uploaded_file(file, user_id, permission_mode):
+    """Save uploaded file and create its record (see app.main.ingest for the analysis)"""
     if not file or not allowed_file(file.filename):
         return None, "Invalid file type"
     
     try:
-        # Generate secure filename
+        # Save file, hashing it on the way
         original_filename = file.filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        secure_name = secure_filename(original_filename)
-        name, ext = os.path.splitext(secure_name)
-        filename = f"{name}_{timestamp}{ext}"
-        
-        # Save file
-        user_folder = get_user_upload_path(user_id)
-        file_path = os.path.join(user_folder, filename)
-        file.save(file_path)
+        filename, tmp_path = build_upload_path(original_filename, user_id)
+        content_hash = save_stream(file.stream, tmp_path)
         
         # Get file size
-        file_size = os.path.getsize(file_path)
+        file_size = os.path.getsize(tmp_path)
         
-        # Analyze Excel file
-        file_info = analyze_excel_file(file_path)
+        # Identical content is stored once; the record is committed while the object is locked
+        with stored_object(tmp_path, content_hash, os.path.splitext(filename)[1]) as (file_path, _existed):
+            excel_file = ExcelFile(
+                user_id=user_id,
+                filename=filename,
+                original_filename=original_filename,
+                file_path=file_path,
+                file_size=file_size,
+                content_hash=content_hash,
+                permission_mode=permission_mode
+            )
+            db.session.add(excel_file)
+            db.session.commit()
         
-        return {
-            'filename': filename,
-            'original_filename': original_filename,
-            'file_path': file_path,
-            'file_size': file_size,
-            'sheet_names': json.dumps(file_info['sheet_names']),
-            'row_count': file_info['row_count'],
-            'column_count': file_info['column_count']
-        }, None
+        # Metadata, sidecars and column profiles are built by the ingestion workers
+        return excel_file, None
         
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"File upload error: {str(e)}")
         return None, f"File upload failed: {str(e)}"
 
-def analyze_excel_file(file_path):
-    """Analyze Excel file and return metadata"""
-    try:
-        # Read Excel file to get sheet names
-        excel_file = pd.ExcelFile(file_path)
-        sheet_names = excel_file.sheet_names
-        
-        # Get info from first sheet
-        df = pd.read_excel(file_path, sheet_name=sheet_names[0])
-        row_count = len(df)
-        column_count = len(df.columns)
-        
-        return {
-            'sheet_names': sheet_names,
-            'row_count': row_count,
-            'column_count': column_count
-        }
-    except Exception as e:
-        current_app.logger.error(f"Excel analysis error: {str(e)}")
-        return {
-            'sheet_names': [],
-            'row_count': 0,
-            'column_count': 0
-        }
-
-def load_excel_data(file_path, sheet_name=None, max_rows=1000):
+def load_excel_data(file_path, sheet_name=None, max_rows=1000, fmt='records'):
     """Load Excel data for display and analysis"""
+    return load_excel_window(file_path, sheet_name, 0, max_rows, fmt)
+
+def load_excel_window(file_path, sheet_name=None, offset=0, limit=100, fmt='records'):
+    """
+    Load a window of rows; only the rows of the window are converted.
+    
+    fmt is 'records' or 'columnar' (see app.main.wire_format).
+    """
     try:
-        if sheet_name:
-            df = pd.read_excel(file_path, sheet_name=sheet_name, nrows=max_rows)
-        else:
-            df = pd.read_excel(file_path, nrows=max_rows)
+        df, total_rows = get_sheet_window(file_path, sheet_name, offset, limit)
         
         # Convert to JSON for frontend
         data = {
             'columns': df.columns.tolist(),
-            'data': df.fillna('').to_dict('records'),
-            'total_rows': len(df),
-            'dtypes': df.dtypes.astype(str).to_dict()
+            'data': frame_to_columnar(df) if fmt == 'columnar' else frame_records(df, na_value=''),
+            'total_rows': total_rows,
+            'offset': offset,
+            'dtypes': {col: logical_dtype(dtype) for col, dtype in df.dtypes.items()}
         }
         
         return data, None
@@ -102,20 +102,48 @@ def load_excel_data(file_path, sheet_name=None, max_rows=1000):
         current_app.logger.error(f"Excel loading error: {str(e)}")
         return None, f"Failed to load Excel data: {str(e)}"
 
+def load_excel_arrow_window(file_path, sheet_name=None, offset=0, limit=100):
+    """
+    Load a window of rows as an Arrow IPC stream.
+    
+    Returns ({'body', 'total_rows'}, error); a slice of the columnar sidecar
+    is written without going through pandas.
+    """
+    try:
+        sheet_name = resolve_sheet_name(file_path, sheet_name)
+        offset, limit = max(int(offset), 0), max(int(limit), 0)
+        table = open_sidecar(file_path, sheet_name) if get_loaded_frame(file_path, sheet_name) is None else None
+        if table is not None:
+            total_rows = table.num_rows
+            body = arrow_stream(table=table.slice(offset, limit), metadata={'total_rows': total_rows, 'offset': offset})
+        else:
+            df, total_rows = get_sheet_window(file_path, sheet_name, offset, limit)
+            body = arrow_stream(df, metadata={'total_rows': total_rows, 'offset': offset})
+        return {'body': body, 'total_rows': total_rows}, None
+    except Exception as e:
+        current_app.logger.error(f"Excel loading error: {str(e)}")
+        return None, f"Failed to load Excel data: {str(e)}"
+
 def save_excel_data(file_path, data, sheet_name=None):
     """Save modified Excel data back to file"""
     try:
+        # Pending buffered edits go first so that they do not overwrite this save later
+        flush_file(file_path)
+        
         # Convert data back to DataFrame
         df = pd.DataFrame(data)
         
-        # Save to Excel
-        if sheet_name:
-            # Read existing file and update specific sheet
-            with pd.ExcelWriter(file_path, mode='a', if_sheet_exists='replace') as writer:
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-        else:
-            df.to_excel(file_path, index=False)
+        # Save to Excel: the new version is written aside and renamed over the file
+        with write_lock(file_path), atomic_replace(file_path) as tmp_path:
+            if sheet_name:
+                # Copy existing file and update specific sheet
+                shutil.copyfile(file_path, tmp_path)
+                with pd.ExcelWriter(tmp_path, mode='a', if_sheet_exists='replace') as writer:
+                    df.to_excel(writer, sheet_name=sheet_name, index=False)
+            else:
+                df.to_excel(tmp_path, index=False)
         
+        invalidate_file(file_path)
         return True, None
     except Exception as e:
         current_app.logger.error(f"Excel saving error: {str(e)}")
@@ -124,36 +152,139 @@ def save_excel_data(file_path, data, sheet_name=None):
 def get_excel_summary(file_path):
     """Get a summary of Excel file for chat assistant"""
     try:
-        excel_file = pd.ExcelFile(file_path)
-        summary = {
-            'file_info': {
-                'sheet_count': len(excel_file.sheet_names),
-                'sheet_names': excel_file.sheet_names
-            },
-            'sheets': {}
+        sheets = scan_workbook(file_path)
+        return _build_summary(sheets), None
+    except Exception as e:
+        current_app.logger.error(f"Excel summary error: {str(e)}")
+        return None, f"Failed to analyze Excel file: {str(e)}"
+
+def _build_summary(sheets):
+    summary = {
+        'file_info': {
+            'sheet_count': len(sheets),
+            'sheet_names': [sheet['name'] for sheet in sheets]
+        },
+        'sheets': {}
+    }
+    
+    for sheet in sheets:
+        summary['sheets'][sheet['name']] = {
+            'columns': sheet['columns'],
+            'row_count': sheet['row_count'],
+            'column_count': sheet['column_count'],
+            'sample_data': sheet['sample_data'],
+            'dtypes': sheet['dtypes']
         }
+    
+    return summary
+
+def store_sheet_metadata(excel_file, sheets):
+    """Replace the stored per-sheet metadata of a file (the caller commits)"""
+    for stored_sheet in excel_file.sheets.all():
+        excel_file.sheets.remove(stored_sheet)
+    for sheet in sheets:
+        excel_file.sheets.append(ExcelSheet(
+            name=sheet['name'],
+            position=sheet['position'],
+            row_count=sheet['row_count'],
+            column_count=sheet['column_count'],
+            columns=json.dumps(sheet['columns'], default=str),
+            dtypes=json.dumps(sheet['dtypes']),
+            sample_data=json.dumps(sheet['sample_data'], default=str),
+            profile=json.dumps(sheet['profile'], default=str) if sheet.get('profile') else None
+        ))
+
+def get_file_summary(excel_file):
+    """
+    Get the summary of an uploaded file from stored metadata.
+    
+    Files uploaded before metadata was stored, and files whose ingestion
+    failed before storing it, are scanned once and backfilled.
+    """
+    from app.main.ingest import resume_ingestion
+    
+    try:
+        if not excel_file.is_ingested():
+            resume_ingestion(excel_file)
         
-        for sheet_name in excel_file.sheet_names:
-            df = pd.read_excel(file_path, sheet_name=sheet_name, nrows=5)  # Sample first 5 rows
-            
-            summary['sheets'][sheet_name] = {
-                'columns': df.columns.tolist(),
-                'row_count': len(pd.read_excel(file_path, sheet_name=sheet_name)),
-                'column_count': len(df.columns),
-                'sample_data': df.fillna('').to_dict('records'),
-                'dtypes': df.dtypes.astype(str).to_dict()
-            }
+        # Ingestion stores the sheet metadata before building sidecars and profiles
+        stored_sheets = excel_file.sheets.all()
+        if not stored_sheets:
+            sheets = scan_workbook(excel_file.file_path)
+            if excel_file.ingest_status in (IngestStatus.PENDING, IngestStatus.PROCESSING):
+                # Ingestion is still running and will store the metadata itself
+                return _build_summary(sheets), None
+            store_sheet_metadata(excel_file, sheets)
+            db.session.commit()
+            stored_sheets = excel_file.sheets.all()
         
-        return summary, None
+        sheets = [dict(name=sheet.name, **sheet.to_summary()) for sheet in stored_sheets]
+        return _build_summary(sheets), None
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Excel summary error: {str(e)}")
         return None, f"Failed to analyze Excel file: {str(e)}"
 
-def delete_file(file_path):
+def get_sheet_profile(excel_file, sheet_name=None):
+    """
+    Get the column profile of a sheet from stored metadata.
+    
+    A missing or stale profile is recomputed from the sheet and stored.
+    """
+    sheet = excel_file.get_sheet(sheet_name)
+    if sheet is None:
+        return None
+    
+    profile = sheet.get_profile()
+    if profile is None or profile.get('stale'):
+        profile = profile_frame(get_sheet_frame(excel_file.file_path, sheet.name))
+        sheet.set_profile(profile)
+        db.session.commit()
+    return profile
+
+def release_file(excel_file):
+    """
+    Deactivate a record and delete its file unless other records still
+    share its stored object.
+    
+    Counting the references, deleting and committing happen under the
+    write lock of the file, like the creation of records in stored_object.
+    """
+    file_path = excel_file.file_path
+    with write_lock(file_path):
+        if is_object_path(file_path) and count_references(file_path, exclude_id=excel_file.id):
+            success, error = True, None
+        else:
+            success, error = delete_file(file_path, keep_lock_file=True)
+        if success:
+            excel_file.is_active = False
+            db.session.commit()
+    if not os.path.exists(file_path):
+        remove_lock_file(file_path)
+    return success, error
+
+def get_sheet_layout(excel_file, sheet_name=None):
+    """
+    Columns and row count of a sheet for the grid header, from stored metadata.
+    
+    Until the file is ingested only the header row is read; the grid learns
+    the row count with its first window of rows.
+    """
+    sheet = excel_file.get_sheet(sheet_name) if excel_file.is_ingested() else None
+    if sheet is not None:
+        return {'columns': sheet.get_columns(), 'total_rows': sheet.row_count}
+    return {'columns': read_preview(excel_file.file_path, sheet_name, rows=0)['columns'], 'total_rows': 0}
+
+def delete_file(file_path, keep_lock_file=False):
     """Delete file from filesystem"""
     try:
+        discard_file(file_path)
         if os.path.exists(file_path):
             os.remove(file_path)
+        remove_sidecars(file_path)
+        if not keep_lock_file:
+            remove_lock_file(file_path)
+        invalidate_file(file_path)
         return True, None
     except Exception as e:
         current_app.logger.error(f"File deletion error: {str(e)}")
@@ -0,0 +1,145 @@
+"""
+Wire formats for sheet data responses
+
+- records: a list of {column: value} objects with '' for empty cells (the
+  original format)
+- columnar: the column names once and one array of values per column,
+  with an Arrow-style validity bitmap (base64, least significant bit
+  first, 1 = value present) for columns that contain empty cells; empty
+  slots hold 0 in numeric columns and null otherwise
+- arrow: an Arrow IPC stream of the rows, written straight from the
+  columnar sidecar when the sheet has one
+
+Clients choose with the format= parameter or the Accept header.
+"""
+import base64
+import json
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+
+from app.main.cells import json_value
+from app.main.frame_compact import expand_series, logical_dtype
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - the Arrow format is optional
+    pa = None
+
+COLUMNAR_MIMETYPE = 'application/vnd.sheet.columnar+json'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+WIRE_FORMATS = {'records': 'application/json', 'columnar': COLUMNAR_MIMETYPE, 'arrow': ARROW_MIMETYPE}
+
+
+def available_formats():
+    return [fmt for fmt in WIRE_FORMATS if fmt != 'arrow' or pa is not None]
+
+
+def requested_format(request):
+    """
+    The wire format asked for by a request: format= wins over Accept,
+    records is the default. Raises ValueError for an unknown format.
+    """
+    fmt = request.args.get('format')
+    if fmt:
+        if fmt not in available_formats():
+            raise ValueError(f"Unsupported format: {fmt}")
+        return fmt
+
+    # Only explicitly named types count, */* gets the default
+    mimetypes = {WIRE_FORMATS[fmt]: fmt for fmt in available_formats()}
+    for mimetype, quality in request.accept_mimetypes:
+        if quality > 0 and mimetype in mimetypes:
+            return mimetypes[mimetype]
+    return 'records'
+
+
+def _validity_bitmap(mask):
+    return base64.b64encode(np.packbits(mask.to_numpy(), bitorder='little').tobytes()).decode('ascii')
+
+
+def frame_records(df, na_value=None):
+    """
+    The rows of a frame as a list of {column: value} records, with
+    na_value for empty cells.
+
+    The values are taken column by column with tolist, which converts
+    numpy values to Python ones in C, instead of boxing every cell the way
+    astype(object) and to_dict do.
+    """
+    columns = df.columns.tolist()
+    values = []
+    for position in range(len(columns)):
+        series = df.iloc[:, position]
+        column_values = series.tolist()
+        missing = series.isna()
+        if missing.any():
+            column_values = [na_value if empty else value for value, empty in zip(column_values, missing.tolist())]
+        values.append(column_values)
+    return [dict(zip(columns, row)) for row in zip(*values)] if columns else [{} for _ in range(len(df))]
+
+
+def _column_values(series):
+    present = series.notna()
+    if is_bool_dtype(series.dtype):
+        values = series.fillna(False).astype(bool).tolist()
+    elif is_numeric_dtype(series.dtype):
+        # A numpy array: encoded natively by the JSON provider (app.json_provider)
+        values = series.fillna(0).to_numpy()
+    elif is_datetime64_any_dtype(series.dtype):
+        values = series.dt.strftime('%Y-%m-%dT%H:%M:%S').where(present, None).tolist()
+    else:
+        values = [json_value(value) for value in series.tolist()]
+    return values, present
+
+
+def frame_to_columnar(df):
+    """Encode a frame as {'rows', 'columns', 'dtypes', 'values', 'valid'}"""
+    values, valid = [], []
+    for position in range(len(df.columns)):
+        column_values, present = _column_values(expand_series(df.iloc[:, position]))
+        values.append(column_values)
+        valid.append(None if present.all() else _validity_bitmap(present))
+    return {
+        'rows': len(df),
+        'columns': df.columns.tolist(),
+        'dtypes': [logical_dtype(dtype) for dtype in df.dtypes],
+        'values': values,
+        'valid': valid
+    }
+
+
+def _arrow_table(df):
+    columns = {}
+    for position, column in enumerate(df.columns):
+        series = expand_series(df.iloc[:, position])
+        try:
+            columns[str(column)] = pa.array(series, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # Mixed value types: sent as text
+            columns[str(column)] = pa.array(series.map(lambda value: None if pd.isna(value) else str(value)),
+                                            type=pa.string())
+    return pa.table(columns)
+
+
+def arrow_stream(df=None, table=None, metadata=None):
+    """
+    Serialize rows as an Arrow IPC stream, from a frame or an Arrow table
+    (e.g. a slice of a sidecar). metadata is added to the schema.
+    """
+    if table is None:
+        table = _arrow_table(df)
+        columns = df.columns.tolist()
+    else:
+        sidecar_columns = (table.schema.metadata or {}).get(b'columns')
+        columns = json.loads(sidecar_columns) if sidecar_columns else table.column_names
+    schema_metadata = {b'columns': json.dumps(columns, default=str).encode('utf-8')}
+    for key, value in (metadata or {}).items():
+        schema_metadata[str(key).encode('utf-8')] = str(value).encode('utf-8')
+    table = table.replace_schema_metadata(schema_metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
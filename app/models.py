@@ -4,6 +4,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 from app import db, login_manager
 import enum
+import json
 
 class UserRole(enum.Enum):
     USER = 'user'
@@ -24,6 +25,12 @@ class PermissionMode(enum.Enum):
     READ_WRITE = 'read_write'
     READ_WRITE_DELETE = 'read_write_delete'
 
+class IngestStatus(enum.Enum):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+
 class MessageType(enum.Enum):
     TEXT = 'text'
     VOICE = 'voice'
@@ -48,6 +55,7 @@ class User(UserMixin, db.Model):
     subscription = db.relationship('Subscription', backref='user', uselist=False, cascade='all, delete-orphan')
     excel_files = db.relationship('ExcelFile', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     chat_sessions = db.relationship('ChatSession', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    upload_sessions = db.relationship('UploadSession', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -136,10 +144,17 @@ class ExcelFile(db.Model):
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 while the file is a shared object, see app.main.storage
     permission_mode = db.Column(db.Enum(PermissionMode), default=PermissionMode.READ, nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)  # Increases with every data change
+    
+    # Background ingestion (metadata, sidecars, column profiles)
+    ingest_status = db.Column(db.Enum(IngestStatus), default=IngestStatus.READY, server_default='READY', nullable=False)
+    ingest_progress = db.Column(db.Integer, default=100, server_default='100', nullable=False)  # Percent
+    ingest_error = db.Column(db.Text)
     
     # File metadata
     sheet_names = db.Column(db.Text)  # JSON string of sheet names
@@ -148,6 +163,20 @@ class ExcelFile(db.Model):
     
     # Relationships
     chat_sessions = db.relationship('ChatSession', backref='excel_file', lazy='dynamic', cascade='all, delete-orphan')
+    sheets = db.relationship('ExcelSheet', backref='excel_file', lazy='dynamic', cascade='all, delete-orphan', order_by='ExcelSheet.position')
+    
+    def get_sheet(self, sheet_name=None):
+        """Stored metadata of a sheet (the first sheet if no name is given)"""
+        if sheet_name:
+            return self.sheets.filter_by(name=sheet_name).first()
+        return self.sheets.first()
+    
+    def is_ingested(self):
+        return self.ingest_status == IngestStatus.READY
+    
+    def bump_version(self):
+        """Increase the data version; computed in SQL so concurrent workers never reuse a number"""
+        self.version = ExcelFile.version + 1
     
     def can_read(self):
         """Проверяет, есть ли у пользователя права на чтение файла"""
@@ -186,6 +215,81 @@ class ExcelFile(db.Model):
     def __repr__(self):
         return f'<ExcelFile {self.filename}>'
 
+class ExcelSheet(db.Model):
+    __tablename__ = 'excel_sheets'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    excel_file_id = db.Column(db.Integer, db.ForeignKey('excel_files.id'), nullable=False, index=True)
+    name = db.Column(db.String(255), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    column_count = db.Column(db.Integer, nullable=False, default=0)
+    columns = db.Column(db.Text)  # JSON list of column names
+    dtypes = db.Column(db.Text)  # JSON mapping column -> inferred dtype
+    sample_data = db.Column(db.Text)  # JSON list of the first rows
+    profile = db.Column(db.Text)  # JSON column statistics, see app.main.column_profile
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def get_columns(self):
+        return json.loads(self.columns) if self.columns else []
+    
+    def get_dtypes(self):
+        return json.loads(self.dtypes) if self.dtypes else {}
+    
+    def get_sample_data(self):
+        return json.loads(self.sample_data) if self.sample_data else []
+    
+    def get_profile(self):
+        return json.loads(self.profile) if self.profile else None
+    
+    def set_profile(self, profile):
+        self.profile = json.dumps(profile, default=str) if profile is not None else None
+    
+    def to_summary(self):
+        """Sheet summary in the format of get_excel_summary"""
+        return {
+            'columns': self.get_columns(),
+            'row_count': self.row_count,
+            'column_count': self.column_count,
+            'sample_data': self.get_sample_data(),
+            'dtypes': self.get_dtypes()
+        }
+    
+    def __repr__(self):
+        return f'<ExcelSheet {self.excel_file_id}:{self.name}>'
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+    
+    id = db.Column(db.String(32), primary_key=True)  # Random token used in the upload URLs
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    original_filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received_size = db.Column(db.BigInteger, default=0, nullable=False)
+    permission_mode = db.Column(db.Enum(PermissionMode), default=PermissionMode.READ, nullable=False)
+    sha256 = db.Column(db.String(64))
+    excel_file_id = db.Column(db.Integer, db.ForeignKey('excel_files.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+    def is_complete(self):
+        return self.received_size >= self.total_size
+    
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'filename': self.original_filename,
+            'size': self.total_size,
+            'offset': self.received_size,
+            'complete': self.is_complete(),
+            'finalized': self.completed_at is not None,
+            'file_id': self.excel_file_id
+        }
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id}:{self.received_size}/{self.total_size}>'
+
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
     
@@ -233,5 +337,12 @@ class ChatMessage(db.Model):
     def is_from_assistant(self):
         return not self.is_user_message
     
+    def get_extra_data(self):
+        return json.loads(self.extra_data) if self.extra_data else {}
+    
+    def set_extra_data(self, **values):
+        """Merge values into the stored additional data"""
+        self.extra_data = json.dumps(dict(self.get_extra_data(), **values), default=str)
+    
     def __repr__(self):
         return f'<ChatMessage {self.id}:{self.message_type.value}>'
@@ -151,40 +151,98 @@ class ChatManager {
         try {
             console.log("Sending message:", message, "Session ID:", this.sessionId);
             
-            const requestBody = {
-                session_id: this.sessionId,
-                message: message
-            };
-            console.log("Request body:", JSON.stringify(requestBody));
-            
-            const response = await fetch('/api/chat/send', {
+            // The answer is streamed as Server-Sent Events and rendered as it arrives
+            const response = await fetch('/api/chat/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
                     'X-CSRFToken': document.querySelector('[name=csrf_token]').value
                 },
-                body: JSON.stringify(requestBody)
+                body: JSON.stringify({
+                    session_id: this.sessionId,
+                    message: message
+                })
             });
             
             console.log("Response status:", response.status);
-            const data = await response.json();
-            console.log("Response data:", data);
-            
-            if (response.ok && data.assistant_message) {
-                // Add assistant response
-                this.addMessageToUI(data.assistant_message.content, false);
-                this.scrollToBottom();
+            if (response.ok) {
+                await this.readAnswerStream(response);
             } else {
+                const data = await response.json().catch(() => ({}));
                 this.showError(data.error || 'Failed to send message. Please try again.');
                 console.error("Error in chat response:", data);
             }
-            
-            // Reset button state
-            sendButton.disabled = false;
-            sendButton.innerHTML = originalText;
         } catch (error) {
             console.error("Chat error:", error);
             this.showError('Network error. Please try again.');
+        } finally {
+            // Reset button state
+            sendButton.disabled = false;
+            sendButton.innerHTML = originalText;
+        }
+    }
+    
+    async readAnswerStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        let answerElement = null;
+        let renderPending = false;
+        
+        // Tokens arrive faster than the screen refreshes: render once per frame
+        const render = () => {
+            renderPending = false;
+            this.setMessageText(answerElement, answer);
+            this.scrollToBottom();
+        };
+        
+        const handleEvent = (type, data) => {
+            if (type === 'token') {
+                if (!answerElement) {
+                    answerElement = this.addMessageToUI('', false);
+                }
+                answer += data.token;
+                if (!renderPending) {
+                    renderPending = true;
+                    requestAnimationFrame(render);
+                }
+            } else if (type === 'done') {
+                answer = data.content;
+                if (!answerElement) {
+                    answerElement = this.addMessageToUI('', false);
+                }
+                render();
+            } else if (type === 'error') {
+                this.showError(data.error || 'Failed to send message. Please try again.');
+            }
+        };
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let type = 'message';
+                const dataLines = [];
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        type = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        dataLines.push(line.slice(5).trim());
+                    }
+                });
+                if (dataLines.length) {
+                    handleEvent(type, JSON.parse(dataLines.join('\n')));
+                }
+            }
         }
     }
     
@@ -290,13 +348,13 @@ class ChatManager {
         if (type === 'voice' && isUser) {
             messageContent.innerHTML = `
                 <small><i class="fas fa-microphone me-1"></i>Voice Message</small><br>
-                ${content}
             `;
-        } else {
-            // Use innerHTML instead of textContent to preserve line breaks
-            messageContent.innerHTML = content.replace(/\n/g, '<br>');
         }
         
+        const textEl = document.createElement('span');
+        this.setMessageText(textEl, content);
+        messageContent.appendChild(textEl);
+        
         const timeEl = document.createElement('small');
         timeEl.className = 'opacity-75 d-block mt-1';
         timeEl.innerHTML = new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
@@ -305,6 +363,14 @@ class ChatManager {
         
         messageDiv.appendChild(messageContent);
         this.chatContainer.appendChild(messageDiv);
+        
+        // Returned so that a streamed answer can be updated in place
+        return textEl;
+    }
+    
+    setMessageText(element, content) {
+        // Use innerHTML instead of textContent to preserve line breaks
+        element.innerHTML = content.replace(/\n/g, '<br>');
     }
     
     scrollToBottom() {
@@ -325,6 +391,7 @@ class ExcelViewer {
         this.currentSheet = null;
         this.currentPage = 1;
         this.perPage = 100;
+        this.query = null;
         
         this.initializeViewer();
     }
@@ -351,14 +418,22 @@ class ExcelViewer {
     }
     
     async loadFileData(sheet = null) {
+        if (sheet) {
+            this.currentSheet = sheet;
+        }
+        
+        // Filtered and sorted views are computed on the server
+        if (this.query) {
+            return this.loadQueryData();
+        }
+        
         const params = new URLSearchParams({
             page: this.currentPage,
             per_page: this.perPage
         });
         
-        if (sheet) {
-            params.append('sheet', sheet);
-            this.currentSheet = sheet;
+        if (this.currentSheet) {
+            params.append('sheet', this.currentSheet);
         }
         
         try {
@@ -376,6 +451,49 @@ class ExcelViewer {
         }
     }
     
+    async loadQueryData() {
+        const body = Object.assign({}, this.query, {
+            sheet: this.currentSheet,
+            limit: this.perPage,
+            offset: (this.currentPage - 1) * this.perPage
+        });
+        
+        try {
+            const response = await fetch(`/api/excel/${this.fileId}/query`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': document.querySelector('[name=csrf_token]')?.value || ''
+                },
+                body: JSON.stringify(body)
+            });
+            const result = await response.json();
+            
+            if (response.ok && result.success) {
+                this.renderTable(result.data);
+                this.renderPagination(result.data);
+            } else {
+                this.showError(result.error || 'Failed to query file data');
+            }
+        } catch (error) {
+            this.showError('Network error querying file data.');
+        }
+    }
+    
+    /**
+     * Show only matching rows, e.g.
+     * applyQuery({filters: [{column: 'Price', op: 'range', min: 10}], sort: [{column: 'Price', direction: 'desc'}]})
+     */
+    applyQuery(query) {
+        this.query = query;
+        this.currentPage = 1;
+        return this.loadFileData();
+    }
+    
+    clearQuery() {
+        return this.applyQuery(null);
+    }
+    
     renderTable(data) {
         const tableContainer = document.getElementById('excel-table');
         if (!tableContainer) return;
@@ -435,6 +553,7 @@ class ExcelViewer {
     
     switchSheet(sheetName) {
         this.currentPage = 1;
+        this.query = null;
         this.loadFileData(sheetName);
         
         // Update active tab
@@ -449,10 +568,305 @@ class ExcelViewer {
     }
 }
 
+// Virtual-scrolling grid: only the rows in view are in the DOM. Rows are
+// fetched in fixed windows from /api/files/<id>/rows, the windows next to
+// the visible ones are prefetched and windows far off-screen are dropped,
+// so page weight does not grow with the size of the sheet.
+class VirtualGrid {
+    constructor(table, options = {}) {
+        this.table = table;
+        this.viewport = table.closest('.virtual-grid') || table.parentElement;
+        this.tbody = table.tBodies[0] || table.appendChild(document.createElement('tbody'));
+        this.url = table.dataset.rowsUrl;
+        this.sheet = table.dataset.sheet || '';
+        this.columns = JSON.parse(table.dataset.columns || '[]');
+        this.totalRows = parseInt(table.dataset.totalRows || '0', 10);
+        this.canWrite = table.dataset.canWrite === 'true';
+        this.canDelete = table.dataset.canDelete === 'true';
+        
+        this.windowRows = options.windowRows || 200;
+        this.overscan = options.overscan || 10;
+        this.keepWindows = options.keepWindows || 2;  // windows kept on each side of the visible ones
+        this.rowHeight = options.rowHeight || 37;
+        this.rowHeightMeasured = false;
+        
+        this.windows = new Map();   // window index -> rows
+        this.pending = new Set();   // window indexes being fetched
+        this.renderedRange = null;
+        this.frame = null;
+        
+        this.viewport.addEventListener('scroll', () => this.scheduleRender(), { passive: true });
+        window.addEventListener('resize', () => this.scheduleRender());
+        this.render();
+    }
+    
+    scheduleRender() {
+        if (this.frame) return;
+        this.frame = requestAnimationFrame(() => {
+            this.frame = null;
+            this.render();
+        });
+    }
+    
+    visibleRange() {
+        const headerHeight = this.table.tHead ? this.table.tHead.offsetHeight : 0;
+        const top = Math.max(this.viewport.scrollTop - headerHeight, 0);
+        const first = Math.max(Math.floor(top / this.rowHeight) - this.overscan, 0);
+        const count = Math.ceil(this.viewport.clientHeight / this.rowHeight) + 2 * this.overscan;
+        return [Math.min(first, this.totalRows), Math.min(first + count, this.totalRows)];
+    }
+    
+    render() {
+        const [first, last] = this.visibleRange();
+        const firstWindow = Math.floor(first / this.windowRows);
+        const lastWindow = Math.floor(Math.max(last - 1, first) / this.windowRows);
+        
+        // Visible windows first, then their neighbours
+        for (let index = firstWindow; index <= lastWindow; index++) {
+            this.fetchWindow(index);
+        }
+        this.fetchWindow(lastWindow + 1);
+        this.fetchWindow(firstWindow - 1);
+        
+        for (const index of this.windows.keys()) {
+            if (index < firstWindow - this.keepWindows || index > lastWindow + this.keepWindows) {
+                this.windows.delete(index);
+            }
+        }
+        
+        // Keep the rows in place while a cell is being edited
+        const active = document.activeElement;
+        if (active && active.classList.contains('cell-editor') && this.tbody.contains(active)) {
+            return;
+        }
+        this.renderRows(first, last);
+    }
+    
+    async fetchWindow(index) {
+        const start = index * this.windowRows;
+        // The first window is always fetched, it reports the row count
+        if (index < 0 || (index > 0 && start >= this.totalRows)) return;
+        if (this.windows.has(index) || this.pending.has(index)) return;
+        
+        const params = new URLSearchParams({ start: start, count: this.windowRows });
+        if (this.sheet) {
+            params.append('sheet', this.sheet);
+        }
+        
+        this.pending.add(index);
+        try {
+            const response = await fetch(`${this.url}?${params}`);
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Failed to load rows');
+            }
+            
+            this.windows.set(index, data.data);
+            this.totalRows = data.total_rows;
+            if (!this.columns.length) {
+                this.columns = data.columns;
+            }
+            this.renderedRange = null;
+            this.scheduleRender();
+        } catch (error) {
+            showToast(error.message || 'Network error loading rows.', 'danger');
+        } finally {
+            this.pending.delete(index);
+        }
+    }
+    
+    getRow(rowIndex) {
+        const rows = this.windows.get(Math.floor(rowIndex / this.windowRows));
+        return rows ? rows[rowIndex % this.windowRows] : undefined;
+    }
+    
+    updateCell(rowIndex, column, value) {
+        const row = this.getRow(rowIndex);
+        if (row) {
+            row[column] = value;
+        }
+    }
+    
+    /** Drop all fetched windows, e.g. after rows were added or deleted */
+    refresh() {
+        this.windows.clear();
+        this.renderedRange = null;
+        this.render();
+    }
+    
+    spacerRow(height) {
+        const tr = document.createElement('tr');
+        tr.className = 'grid-spacer';
+        const td = document.createElement('td');
+        td.colSpan = this.columns.length + (this.canDelete ? 1 : 0);
+        td.style.height = `${height}px`;
+        tr.appendChild(td);
+        return tr;
+    }
+    
+    dataRow(rowIndex, row) {
+        const tr = document.createElement('tr');
+        tr.dataset.rowIndex = rowIndex;
+        if (!row) {
+            tr.className = 'grid-loading';
+        }
+        
+        if (this.canDelete) {
+            const td = document.createElement('td');
+            if (row) {
+                const button = document.createElement('button');
+                button.className = 'btn btn-danger btn-sm delete-row-btn';
+                button.dataset.rowIndex = rowIndex;
+                button.innerHTML = '<i class="fas fa-trash"></i>';
+                td.appendChild(button);
+            }
+            tr.appendChild(td);
+        }
+        
+        this.columns.forEach(column => {
+            const td = document.createElement('td');
+            td.dataset.column = column;
+            if (row) {
+                const value = row[column];
+                td.textContent = value === null || value === undefined ? '' : value;
+                if (this.canWrite) {
+                    td.className = 'editable-cell';
+                }
+            } else {
+                td.textContent = '…';
+            }
+            tr.appendChild(td);
+        });
+        return tr;
+    }
+    
+    renderRows(first, last) {
+        const loaded = [];
+        for (let rowIndex = first; rowIndex < last; rowIndex++) {
+            loaded.push(this.getRow(rowIndex) !== undefined);
+        }
+        const range = `${first}:${last}:${loaded.join()}`;
+        if (range === this.renderedRange) return;
+        this.renderedRange = range;
+        
+        const fragment = document.createDocumentFragment();
+        fragment.appendChild(this.spacerRow(first * this.rowHeight));
+        for (let rowIndex = first; rowIndex < last; rowIndex++) {
+            fragment.appendChild(this.dataRow(rowIndex, this.getRow(rowIndex)));
+        }
+        fragment.appendChild(this.spacerRow((this.totalRows - last) * this.rowHeight));
+        this.tbody.replaceChildren(fragment);
+        
+        // Spacer heights assume the height of the rendered rows
+        if (!this.rowHeightMeasured && last > first) {
+            const height = this.tbody.children[1].getBoundingClientRect().height;
+            if (height > 0) {
+                this.rowHeightMeasured = true;
+                if (Math.abs(height - this.rowHeight) > 0.5) {
+                    this.rowHeight = height;
+                    this.renderedRange = null;
+                    this.scheduleRender();
+                }
+            }
+        }
+    }
+}
+
+// Resumable upload for files that do not fit into a single request
+class ChunkedUploader {
+    constructor(file, permissionMode) {
+        this.file = file;
+        this.permissionMode = permissionMode;
+        this.maxRetries = 5;
+    }
+    
+    async request(url, options = {}) {
+        options.headers = Object.assign({
+            'X-CSRFToken': document.querySelector('[name=csrf_token]')?.value || ''
+        }, options.headers || {});
+        const response = await fetch(url, options);
+        return { response, data: await response.json() };
+    }
+    
+    async upload(onProgress) {
+        let { response, data } = await this.request('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                filename: this.file.name,
+                size: this.file.size,
+                permission_mode: this.permissionMode
+            })
+        });
+        if (!response.ok) throw new Error(data.error || 'Upload failed');
+        
+        const url = `/api/uploads/${data.upload_id}`;
+        const chunkSize = data.chunk_size;
+        let offset = 0;
+        let retries = 0;
+        
+        while (offset < this.file.size) {
+            try {
+                ({ response, data } = await this.request(`${url}?offset=${offset}`, {
+                    method: 'PUT',
+                    body: this.file.slice(offset, offset + chunkSize)
+                }));
+                // 409 carries the offset the server expects, continue from there
+                if (!response.ok && response.status !== 409) throw new Error(data.error || 'Upload failed');
+                offset = data.offset;
+                retries = 0;
+                if (onProgress) onProgress(offset / this.file.size);
+            } catch (error) {
+                if (++retries > this.maxRetries) throw error;
+                await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                try {
+                    // Resume from what actually reached the server
+                    ({ data } = await this.request(url));
+                    offset = data.offset;
+                } catch (statusError) {
+                    // Retry the same chunk
+                }
+            }
+        }
+        
+        ({ response, data } = await this.request(`${url}/finalize`, { method: 'POST' }));
+        if (!response.ok) throw new Error(data.error || 'Upload failed');
+        return data;
+    }
+}
+
+function initializeChunkedUpload() {
+    const form = document.querySelector('form[data-chunked-upload]');
+    if (!form) return;
+    
+    form.addEventListener('submit', async (e) => {
+        const file = form.querySelector('input[type="file"]')?.files[0];
+        if (!file || file.size <= parseInt(form.dataset.chunkThreshold)) return;
+        
+        e.preventDefault();
+        const button = form.querySelector('button[type="submit"]');
+        const label = button.textContent;
+        button.disabled = true;
+        
+        try {
+            const uploader = new ChunkedUploader(file, form.querySelector('[name="permission_mode"]').value);
+            await uploader.upload(progress => {
+                button.textContent = `${Math.floor(progress * 100)}%`;
+            });
+            window.location.href = form.dataset.chunkedUpload;
+        } catch (error) {
+            showToast(error.message, 'danger');
+            button.disabled = false;
+            button.textContent = label;
+        }
+    });
+}
+
 // Initialize components when DOM is loaded
 document.addEventListener('DOMContentLoaded', function() {
     // Initialize file upload drag and drop
     initializeFileUpload();
+    initializeChunkedUpload();
     
     // Initialize chat if on chat page
     const chatContainer = document.getElementById('chat-messages');
@@ -463,12 +877,18 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    // Initialize the virtual-scrolling grid of the file view page
+    const gridTable = document.querySelector('[data-virtual-grid]');
+    if (gridTable) {
+        window.virtualGrid = new VirtualGrid(gridTable);
+    }
+    
     // Initialize Excel viewer if on file view page
     const excelTable = document.getElementById('excel-table');
     if (excelTable) {
         const fileId = document.querySelector('[data-file-id]')?.dataset.fileId;
         if (fileId) {
-            new ExcelViewer(fileId);
+            window.excelViewer = new ExcelViewer(fileId);
         }
     }
     
@@ -12,9 +12,66 @@ class Config:
     
     # File upload settings
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max request size (single-request uploads and chunks)
     ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
     
+    # Resumable chunked uploads (/api/uploads)
+    MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE') or 500 * 1024 * 1024)
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE') or 8 * 1024 * 1024)
+    UPLOAD_SESSION_TTL_HOURS = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS') or 24)
+    
+    # Compression of large JSON API responses (brotli if installed, else gzip)
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE') or 1024)
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL') or 6)
+    
+    # Spreadsheet reader engines in order of preference, per file format and operation;
+    # engines that are not installed are skipped (see app.main.readers, flask benchmark-readers).
+    # calamine is opt-in, e.g. EXCEL_READERS_XLSX=calamine,openpyxl
+    EXCEL_READERS = {
+        'xlsx': {
+            'read': (os.environ.get('EXCEL_READERS_XLSX') or 'openpyxl').split(','),
+            'sheet_names': ['openpyxl']
+        },
+        'xls': {
+            'read': (os.environ.get('EXCEL_READERS_XLS') or 'xlrd').split(','),
+            'sheet_names': ['xlrd']
+        }
+    }
+    
+    # Parsed sheet cache (memory budget in bytes, shared by all read paths)
+    EXCEL_CACHE_MAX_BYTES = int(os.environ.get('EXCEL_CACHE_MAX_BYTES') or 256 * 1024 * 1024)
+    
+    # Compact cached frames: downcast integers, categoricals for repeated strings,
+    # optionally Arrow-backed strings (see app.main.frame_compact)
+    EXCEL_COMPACT_FRAMES = os.environ.get('EXCEL_COMPACT_FRAMES', 'true').lower() in ['true', 'on', '1']
+    EXCEL_CATEGORY_MAX_RATIO = float(os.environ.get('EXCEL_CATEGORY_MAX_RATIO') or 0.5)
+    EXCEL_ARROW_STRINGS = os.environ.get('EXCEL_ARROW_STRINGS', 'false').lower() in ['true', 'on', '1']
+    
+    # Cached group-by/pivot results (memory budget in bytes)
+    PIVOT_CACHE_MAX_BYTES = int(os.environ.get('PIVOT_CACHE_MAX_BYTES') or 32 * 1024 * 1024)
+    
+    # Cached chat system prompts and file contexts (memory budget in bytes)
+    PROMPT_CACHE_MAX_BYTES = int(os.environ.get('PROMPT_CACHE_MAX_BYTES') or 16 * 1024 * 1024)
+    
+    # Chat history sent with each question (tokens); older turns are replaced
+    # by a rolling summary of at most CHAT_SUMMARY_MAX_TOKENS
+    CHAT_HISTORY_MAX_TOKENS = int(os.environ.get('CHAT_HISTORY_MAX_TOKENS') or 3000)
+    CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get('CHAT_SUMMARY_MAX_TOKENS') or 400)
+    
+    # Columnar Arrow sidecars written next to uploaded workbooks (requires pyarrow)
+    EXCEL_SIDECARS_ENABLED = os.environ.get('EXCEL_SIDECARS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    
+    # Background ingestion of uploads (scan, sidecars, column profiles)
+    INGEST_ASYNC = os.environ.get('INGEST_ASYNC', 'true').lower() in ['true', 'on', '1']
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS') or 2)
+    INGEST_STALE_SECONDS = int(os.environ.get('INGEST_STALE_SECONDS') or 900)
+    
+    # Write-behind edit buffer (per process: only for single-process deployments)
+    EXCEL_WRITE_BEHIND = os.environ.get('EXCEL_WRITE_BEHIND', 'false').lower() in ['true', 'on', '1']
+    EXCEL_WRITE_BEHIND_DELAY = float(os.environ.get('EXCEL_WRITE_BEHIND_DELAY') or 2.0)
+    EXCEL_WRITE_BEHIND_MAX_DELAY = float(os.environ.get('EXCEL_WRITE_BEHIND_MAX_DELAY') or 30.0)
+    EXCEL_WRITE_BEHIND_MAX_RETRIES = int(os.environ.get('EXCEL_WRITE_BEHIND_MAX_RETRIES') or 3)
+    
     # Internationalization
     LANGUAGES = {
         'en': 'English',
@@ -67,6 +124,7 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    INGEST_ASYNC = False
 
 config = {
     'development': DevelopmentConfig,
@@ -3,6 +3,7 @@ import os
 import tempfile
 from app import create_app, db
 from app.models import User, UserRole
+import pandas as pd
 
 @pytest.fixture
 def app():
@@ -50,6 +51,77 @@ def auth(client):
     
     return AuthActions(client)
 
+@pytest.fixture
+def excel_path(tmp_path):
+    """Create a small two-sheet workbook."""
+    path = tmp_path / 'sample.xlsx'
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({
+            'Name': ['Apple', 'Banana', 'Cherry'],
+            'Price': [1.5, 0.5, 3.0],
+            'Qty': [10, 20, 30]
+        }).to_excel(writer, sheet_name='Products', index=False)
+        pd.DataFrame({'City': ['Berlin', 'Moscow']}).to_excel(writer, sheet_name='Cities', index=False)
+    return str(path)
+
+def _add_cached_results(path, part, values):
+    """Store cached formula results the way Excel does; openpyxl cannot write them."""
+    import re
+    import zipfile
+    
+    with zipfile.ZipFile(path) as source:
+        parts = {item.filename: source.read(item.filename) for item in source.infolist()}
+    sheet = parts[f'xl/worksheets/{part}'].decode()
+    for coordinate, value in values.items():
+        sheet = re.sub(rf'(<c r="{coordinate}"[^>]*><f>[^<]*</f>)(<v\s*/>|<v>[^<]*</v>)?',
+                       rf'\g<1><v>{value}</v>', sheet)
+    parts[f'xl/worksheets/{part}'] = sheet.encode()
+    with zipfile.ZipFile(path, 'w') as target:
+        for name, data in parts.items():
+            target.writestr(name, data)
+
+@pytest.fixture
+def formula_path(excel_path):
+    """The sample workbook with a Total = Price * Qty formula column and its cached results."""
+    import openpyxl
+    
+    workbook = openpyxl.load_workbook(excel_path)
+    worksheet = workbook['Products']
+    worksheet['D1'] = 'Total'
+    for row in range(2, worksheet.max_row + 1):
+        worksheet[f'D{row}'] = f'=B{row}*C{row}'
+    workbook.save(excel_path)
+    _add_cached_results(excel_path, 'sheet1.xml', {'D2': 15.0, 'D3': 10.0, 'D4': 90.0})
+    return excel_path
+
+@pytest.fixture
+def excel_file(app, excel_path):
+    """Register the sample workbook as an uploaded file of an approved admin."""
+    from app.models import ExcelFile, PermissionMode
+    from app.main.excel_scanner import scan_workbook
+    from app.main.utils import store_sheet_metadata
+    
+    user = User(email='owner@example.com', first_name='Owner', last_name='User',
+                role=UserRole.ADMIN, is_approved=True)
+    user.set_password('testpass')
+    db.session.add(user)
+    
+    sheets = scan_workbook(excel_path)
+    excel_file = ExcelFile(
+        user=user,
+        filename='sample.xlsx',
+        original_filename='sample.xlsx',
+        file_path=excel_path,
+        file_size=os.path.getsize(excel_path),
+        permission_mode=PermissionMode.READ_WRITE_DELETE,
+        row_count=sheets[0]['row_count'],
+        column_count=sheets[0]['column_count']
+    )
+    db.session.add(excel_file)
+    store_sheet_metadata(excel_file, sheets)
+    db.session.commit()
+    return excel_file
+
 def test_app_creation(app):
     """Test app creation."""
     assert app is not None
@@ -94,5 +166,1155 @@ def test_api_auth_required(client):
     })
     assert response.status_code == 302  # Redirect to login
 
+def test_sheet_cache_reuses_parsed_frames(app, excel_path):
+    """Test repeated reads hit the sheet cache and writes invalidate it."""
+    from app.main import excel_cache
+    from app.main.utils import load_excel_data
+    from app.main.excel_service import modify_excel_data
+    
+    excel_cache._sheet_cache.clear()
+    data, error = load_excel_data(excel_path)
+    assert error is None
+    assert data['columns'] == ['Name', 'Price', 'Qty']
+    
+    hits = excel_cache.cache_stats()['hits']
+    data, error = load_excel_data(excel_path, 'Products', max_rows=2)
+    assert len(data['data']) == 2
+    assert excel_cache.cache_stats()['hits'] > hits
+    
+    success, error = modify_excel_data(excel_path, None, 1, 'Price', 0.75)
+    assert success, error
+    data, error = load_excel_data(excel_path, 'Products')
+    assert data['data'][1]['Price'] == 0.75
+
+def test_sheet_metadata_is_scanned_once(app, excel_file):
+    """Test upload metadata is stored per sheet and kept current on edits."""
+    from app.main.utils import get_file_summary
+    from app.main.excel_service import add_excel_row, update_sheet_metadata
+    
+    products = excel_file.get_sheet('Products')
+    assert products.row_count == 3
+    assert products.get_columns() == ['Name', 'Price', 'Qty']
+    assert products.get_dtypes() == {'Name': 'object', 'Price': 'float64', 'Qty': 'int64'}
+    assert products.get_sample_data()[0] == {'Name': 'Apple', 'Price': 1.5, 'Qty': 10}
+    
+    summary, error = get_file_summary(excel_file)
+    assert error is None
+    assert summary['file_info']['sheet_names'] == ['Products', 'Cities']
+    assert summary['sheets']['Cities']['row_count'] == 2
+    
+    success, error = add_excel_row(excel_file.file_path, 'Products', {'Name': 'Date', 'Price': 2.0})
+    assert success, error
+    update_sheet_metadata(excel_file, 'Products', 'add_row')
+    assert products.row_count == 4
+    assert excel_file.row_count == 4
+    assert products.get_sample_data()[3]['Name'] == 'Date'
+
+def test_reads_use_columnar_sidecar(app, excel_path, monkeypatch):
+    """Test parsed sheets are served from the Arrow sidecar until the workbook changes."""
+    from app.main import excel_cache
+    from app.main.excel_sidecar import build_sidecars, open_sidecar
+    from app.main.excel_service import modify_excel_data
+    
+    assert build_sidecars(excel_path) == 2
+    excel_cache._sheet_cache.clear()
+    
+    def fail_read_excel(*args, **kwargs):
+        raise AssertionError('workbook should not be parsed')
+    
+    with monkeypatch.context() as patch:
+        patch.setattr(excel_cache, 'read_frame', fail_read_excel)
+        df = excel_cache.get_sheet_frame(excel_path, 'Products')
+    assert df['Name'].tolist() == ['Apple', 'Banana', 'Cherry']
+    assert df.columns.tolist() == ['Name', 'Price', 'Qty']
+    
+    success, error = modify_excel_data(excel_path, 'Cities', 0, 'City', 'Bonn')
+    assert success, error
+    assert open_sidecar(excel_path, 'Products') is None
+    assert excel_cache.get_sheet_frame(excel_path, 'Cities')['City'].tolist() == ['Bonn', 'Moscow']
+
+def test_concurrent_sidecar_writes_do_not_collide(app, excel_path):
+    """Test threads writing the same sidecar at once each use their own temporary file."""
+    import threading
+    from app.main.excel_sidecar import get_sidecar_dir, read_sidecar, write_sidecar
+    
+    df = pd.read_excel(excel_path, sheet_name='Products')
+    results = []
+    def write():
+        with app.app_context():
+            results.append(write_sidecar(excel_path, 'Products', df))
+    threads = [threading.Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert results == [True] * 8
+    assert [name for name in os.listdir(get_sidecar_dir(excel_path)) if name.endswith('.tmp')] == []
+    assert read_sidecar(excel_path, 'Products')['Qty'].tolist() == [10, 20, 30]
+
+def test_file_data_pages_report_exact_total(app, client, auth, excel_file):
+    """Test deep pages return only their rows with the stored row count."""
+    auth.login('owner@example.com', 'testpass')
+    
+    response = client.get(f'/api/files/{excel_file.id}/data?sheet=Products&page=2&per_page=2')
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert [row['Name'] for row in payload['data']] == ['Cherry']
+    assert payload['total_rows'] == 3
+    assert payload['has_more'] is False
+
+def test_cell_update_keeps_formulas_and_formatting(app, client, auth, excel_file):
+    """Test single-cell edits go through openpyxl and leave the rest of the sheet intact."""
+    import openpyxl
+    from openpyxl.styles import Font
+    
+    workbook = openpyxl.load_workbook(excel_file.file_path)
+    worksheet = workbook['Products']
+    worksheet['A1'].font = Font(bold=True)
+    worksheet['D1'] = 'Total'
+    worksheet['D2'] = '=B2*C2'
+    workbook.save(excel_file.file_path)
+    
+    auth.login('owner@example.com', 'testpass')
+    response = client.put(f'/api/excel/{excel_file.id}/cell', json={
+        'sheet': 'Products', 'row': 0, 'column': 'Price', 'value': 2.5
+    })
+    assert response.get_json()['success'] is True
+    
+    response = client.put(f'/api/excel/{excel_file.id}/cell', json={
+        'sheet': 'Products', 'row': 7, 'column': 'Price', 'value': 1
+    })
+    assert response.status_code == 400
+    
+    worksheet = openpyxl.load_workbook(excel_file.file_path)['Products']
+    assert worksheet['B2'].value == 2.5
+    assert worksheet['D2'].value == '=B2*C2'
+    assert worksheet['A1'].font.bold
+
+def test_formula_results_survive_edits(app, formula_path):
+    """Test cached formula results are written back when an edited workbook is saved."""
+    import openpyxl
+    from app.main.excel_service import modify_excel_data, delete_excel_row
+    
+    expected = list(pd.read_excel(formula_path, sheet_name='Products')['Total'])
+    assert expected == [15.0, 10.0, 90.0]
+    
+    with app.app_context():
+        assert modify_excel_data(formula_path, 'Products', 0, 'Name', 'Renamed') == (True, None)
+        assert list(pd.read_excel(formula_path, sheet_name='Products')['Total']) == expected
+        
+        assert delete_excel_row(formula_path, 'Products', 2) == (True, None)
+        df = pd.read_excel(formula_path, sheet_name='Products')
+        assert list(df['Total']) == expected[:2]
+    
+    worksheet = openpyxl.load_workbook(formula_path)['Products']
+    assert worksheet['D2'].value == '=B2*C2'
+    assert openpyxl.load_workbook(formula_path).calculation.fullCalcOnLoad
+
+def test_formula_results_of_edited_inputs_are_dropped(app, formula_path):
+    """Test formulas reading edited or shifted cells are saved without their stale results."""
+    import openpyxl
+    from app.main.excel_service import modify_excel_data, delete_excel_row
+    
+    workbook = openpyxl.load_workbook(formula_path)
+    workbook['Products']['E1'] = 'Doubled'
+    workbook['Products']['E3'] = '=D3*2'
+    workbook['Cities']['B1'] = 'Sum'
+    workbook['Cities']['B2'] = '=SUM(Products!C:C)'
+    workbook.save(formula_path)
+    _add_cached_results(formula_path, 'sheet1.xml', {'D2': 15.0, 'D3': 10.0, 'D4': 90.0, 'E3': 20.0})
+    _add_cached_results(formula_path, 'sheet2.xml', {'B2': 60})
+    
+    with app.app_context():
+        assert modify_excel_data(formula_path, 'Products', 0, 'Price', 10) == (True, None)
+        df = pd.read_excel(formula_path, sheet_name='Products')
+        assert pd.isna(df['Total'][0])
+        assert list(df['Total'][1:]) == [10.0, 90.0]
+        assert df['Doubled'][1] == 20
+        assert pd.read_excel(formula_path, sheet_name='Cities')['Sum'][0] == 60
+        
+        # The total and its dependent of the edited quantity, and the sum of all quantities
+        assert modify_excel_data(formula_path, 'Products', 1, 'Qty', 5) == (True, None)
+        df = pd.read_excel(formula_path, sheet_name='Products')
+        assert df['Total'].isna().tolist() == [True, True, False]
+        assert df['Doubled'].isna().all()
+        assert pd.isna(pd.read_excel(formula_path, sheet_name='Cities')['Sum'][0])
+    
+    # Formulas moved up by a deleted row still read the old rows
+    _add_cached_results(formula_path, 'sheet1.xml', {'D2': 15, 'D3': 10})
+    with app.app_context():
+        assert delete_excel_row(formula_path, 'Products', 0) == (True, None)
+        assert pd.read_excel(formula_path, sheet_name='Products')['Total'].isna().all()
+    
+    worksheet = openpyxl.load_workbook(formula_path)['Products']
+    assert worksheet['D2'].value == '=B3*C3'
+
+def test_add_row_appends_after_last_used_row(app, client, auth, excel_file):
+    """Test rows are appended in place and validated against the stored header."""
+    import openpyxl
+    
+    auth.login('owner@example.com', 'testpass')
+    response = client.post(f'/api/excel/{excel_file.id}/row', json={
+        'sheet': 'Products', 'data': {'Colour': 'red'}
+    })
+    assert response.status_code == 400
+    
+    response = client.post(f'/api/excel/{excel_file.id}/row', json={
+        'sheet': 'Products', 'data': {'Name': 'Date', 'Price': 4.0, 'Qty': ''}
+    })
+    assert response.get_json()['success'] is True
+    
+    worksheet = openpyxl.load_workbook(excel_file.file_path)['Products']
+    assert [cell.value for cell in worksheet[5]] == ['Date', 4.0, None]
+    assert excel_file.get_sheet('Products').row_count == 4
+
+def test_batch_operations_are_all_or_nothing(app, client, auth, excel_file):
+    """Test batched edits are applied in order in one save, or not at all."""
+    from app.main.utils import load_excel_data
+    
+    auth.login('owner@example.com', 'testpass')
+    url = f'/api/excel/{excel_file.id}/batch'
+    
+    response = client.post(url, json={'sheet': 'Products', 'operations': [
+        {'action': 'update_cell', 'row': 0, 'column': 'Qty', 'value': 11},
+        {'action': 'update_cell', 'row': 0, 'column': 'Missing', 'value': 1}
+    ]})
+    assert response.status_code == 400
+    payload = response.get_json()
+    assert [result['success'] for result in payload['results']] == [True, False]
+    data, _ = load_excel_data(excel_file.file_path, 'Products')
+    assert data['data'][0]['Qty'] == 10
+    
+    response = client.post(url, json={'sheet': 'Products', 'operations': [
+        {'action': 'delete_row', 'row': 0},
+        {'action': 'update_cell', 'row': 0, 'column': 'Qty', 'value': 21},
+        {'action': 'add_row', 'data': {'Name': 'Date', 'Qty': 5}},
+        {'action': 'add_row', 'sheet': 'Cities', 'data': {'City': 'Paris'}}
+    ]})
+    assert response.get_json()['success'] is True
+    data, _ = load_excel_data(excel_file.file_path, 'Products')
+    assert [row['Name'] for row in data['data']] == ['Banana', 'Cherry', 'Date']
+    assert data['data'][0]['Qty'] == 21
+    assert excel_file.get_sheet('Products').row_count == 3
+    assert excel_file.get_sheet('Cities').row_count == 3
+
+def test_write_behind_buffer_serves_reads_and_flushes_on_download(app, client, auth, excel_file):
+    """Test buffered edits are visible to reads at once and reach the file on download."""
+    import openpyxl
+    from app.main.edit_buffer import has_pending_edits
+    from app.main.utils import load_excel_data
+    
+    app.config.update(EXCEL_WRITE_BEHIND=True, EXCEL_WRITE_BEHIND_DELAY=60)
+    auth.login('owner@example.com', 'testpass')
+    
+    response = client.put(f'/api/excel/{excel_file.id}/cell', json={
+        'sheet': 'Products', 'row': 0, 'column': 'Price', 'value': 'n/a'
+    })
+    assert response.get_json()['success'] is True
+    response = client.post(f'/api/excel/{excel_file.id}/row', json={
+        'sheet': 'Products', 'data': {'Name': 'Date', 'Qty': 5}
+    })
+    assert response.get_json()['success'] is True
+    response = client.delete(f'/api/excel/{excel_file.id}/row/1?sheet=Products')
+    assert response.get_json()['success'] is True
+    
+    data, _ = load_excel_data(excel_file.file_path, 'Products')
+    assert [row['Name'] for row in data['data']] == ['Apple', 'Cherry', 'Date']
+    assert data['data'][0]['Price'] == 'n/a'
+    assert has_pending_edits(excel_file.file_path)
+    assert openpyxl.load_workbook(excel_file.file_path)['Products'].max_row == 4
+    
+    response = client.get(f'/file/{excel_file.id}/download')
+    assert response.status_code == 200
+    assert not has_pending_edits(excel_file.file_path)
+    rows = list(openpyxl.load_workbook(excel_file.file_path)['Products'].iter_rows(values_only=True))
+    assert rows[1:] == [('Apple', 'n/a', 10), ('Cherry', 3, 30), ('Date', None, 5)]
+
+def test_write_behind_flush_failures_are_retried_or_resynced(app, client, auth, excel_file, monkeypatch):
+    """Test a failed save keeps the buffered edits and unappliable edits resync the metadata."""
+    import openpyxl
+    from app import db
+    import app.main.excel_service as excel_service
+    from app.main.edit_buffer import has_pending_edits, flush_file
+    from app.main.utils import load_excel_data
+    
+    app.config.update(EXCEL_WRITE_BEHIND=True, EXCEL_WRITE_BEHIND_DELAY=60)
+    auth.login('owner@example.com', 'testpass')
+    
+    save_workbook = excel_service._save_workbook
+    def failing_save(workbook, file_path):
+        raise OSError('disk full')
+    monkeypatch.setattr(excel_service, '_save_workbook', failing_save)
+    
+    response = client.put(f'/api/excel/{excel_file.id}/cell', json={
+        'sheet': 'Products', 'row': 0, 'column': 'Qty', 'value': 99
+    })
+    assert response.get_json()['success'] is True
+    with app.app_context():
+        success, error = flush_file(excel_file.file_path)
+        assert not success and 'disk full' in error
+        assert has_pending_edits(excel_file.file_path)
+        
+        monkeypatch.setattr(excel_service, '_save_workbook', save_workbook)
+        assert flush_file(excel_file.file_path) == (True, None)
+        assert openpyxl.load_workbook(excel_file.file_path)['Products']['C2'].value == 99
+    
+    # The row is deleted behind the buffer's back, the queued edit no longer applies
+    response = client.put(f'/api/excel/{excel_file.id}/cell', json={
+        'sheet': 'Products', 'row': 2, 'column': 'Qty', 'value': 1
+    })
+    assert response.get_json()['success'] is True
+    workbook = openpyxl.load_workbook(excel_file.file_path)
+    workbook['Products'].delete_rows(4)
+    workbook.save(excel_file.file_path)
+    
+    with app.app_context():
+        excel_file = db.session.merge(excel_file)
+        version = excel_file.version
+        success, error = flush_file(excel_file.file_path)
+        assert not success
+        assert not has_pending_edits(excel_file.file_path)
+        db.session.refresh(excel_file)
+        assert excel_file.version > version
+        assert excel_file.get_sheet('Products').row_count == 2
+        data, _ = load_excel_data(excel_file.file_path, 'Products')
+        assert [row['Name'] for row in data['data']] == ['Apple', 'Banana']
+
+def test_write_behind_submit_racing_a_flush_keeps_the_edit(app, excel_file):
+    """Test an edit submitted while a flush removes the file's buffer is queued on a new buffer."""
+    import threading
+    import openpyxl
+    import app.main.edit_buffer as edit_buffer
+    
+    class ObservedLock:
+        def __init__(self):
+            self.lock = threading.RLock()
+            self.waiting = threading.Event()
+        def acquire(self):
+            self.waiting.set()
+            return self.lock.acquire()
+        def release(self):
+            self.lock.release()
+        def __enter__(self):
+            return self.acquire()
+        def __exit__(self, *exc):
+            self.release()
+    
+    app.config.update(EXCEL_WRITE_BEHIND=True, EXCEL_WRITE_BEHIND_DELAY=60)
+    file_path = excel_file.file_path
+    def update(row, value):
+        operation = {'action': 'update_cell', 'row': row, 'column': 'Qty', 'value': value}
+        with app.app_context():
+            assert edit_buffer.submit_operations(file_path, 'Products', [operation]) == (
+                [{'index': 0, 'action': 'update_cell', 'sheet': 'Products', 'row': row, 'success': True}], None)
+    
+    update(0, 11)
+    buffer = edit_buffer._buffers[edit_buffer._buffer_key(file_path)]
+    buffer.lock = ObservedLock()
+    # The submit has found the buffer and waits for its lock while the flush removes it
+    buffer.lock.lock.acquire()
+    submit = threading.Thread(target=update, args=(1, 22))
+    submit.start()
+    assert buffer.lock.waiting.wait(5)
+    with app.app_context():
+        assert edit_buffer.flush_file(file_path) == (True, None)
+    buffer.lock.lock.release()
+    submit.join()
+    
+    assert edit_buffer.has_pending_edits(file_path)
+    with app.app_context():
+        assert edit_buffer.flush_file(file_path) == (True, None)
+    worksheet = openpyxl.load_workbook(file_path)['Products']
+    assert (worksheet['C2'].value, worksheet['C3'].value) == (11, 22)
+
+def test_concurrent_edits_are_serialized_and_versioned(app, client, auth, excel_file):
+    """Test parallel writers do not lose updates and every change bumps the version."""
+    import threading
+    import openpyxl
+    from app.main.excel_service import modify_excel_data
+    from app.main.file_locks import _thread_locks
+    
+    def write(row, column, value):
+        with app.app_context():
+            assert modify_excel_data(excel_file.file_path, 'Products', row, column, value) == (True, None)
+    
+    threads = [threading.Thread(target=write, args=(row, column, row * 100 + offset))
+               for row in range(3) for offset, column in enumerate(['Price', 'Qty'])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    rows = list(openpyxl.load_workbook(excel_file.file_path)['Products'].iter_rows(min_row=2, values_only=True))
+    assert [row[1:] for row in rows] == [(0, 1), (100, 101), (200, 201)]
+    assert not [name for name in os.listdir(os.path.dirname(excel_file.file_path)) if name.startswith('.')]
+    # The per-file thread locks are dropped with their last user
+    assert not _thread_locks
+    
+    assert excel_file.version == 1
+    auth.login('owner@example.com', 'testpass')
+    client.put(f'/api/excel/{excel_file.id}/cell', json={'sheet': 'Products', 'row': 0, 'column': 'Qty', 'value': 7})
+    client.post(f'/api/excel/{excel_file.id}/batch', json={'operations': [
+        {'action': 'add_row', 'data': {'Name': 'Date'}}
+    ]})
+    db.session.refresh(excel_file)
+    assert excel_file.version == 3
+
+def test_export_streams_csv_and_ndjson(app, client, auth, excel_file):
+    """Test the export endpoint streams every row of a sheet."""
+    import json
+    
+    auth.login('owner@example.com', 'testpass')
+    response = client.get(f'/api/excel/{excel_file.id}/export?format=csv&sheet=Products')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert response.get_data(as_text=True).splitlines() == [
+        'Name,Price,Qty', 'Apple,1.5,10', 'Banana,0.5,20', 'Cherry,3,30'
+    ]
+    
+    response = client.get(f'/api/excel/{excel_file.id}/export?format=ndjson&sheet=Cities')
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert records == [{'City': 'Berlin'}, {'City': 'Moscow'}]
+    
+    assert client.get(f'/api/excel/{excel_file.id}/export?format=xml').status_code == 400
+    assert client.get(f'/api/excel/{excel_file.id}/export?sheet=Missing').status_code == 400
+
+def test_export_of_uncached_sheet_keeps_cells_past_the_header(app, tmp_path):
+    """Test the streamed export is as wide as the stored sheet metadata, like the sheet read by pandas."""
+    import openpyxl
+    from app.main.excel_export import iter_sheet_rows
+    from app.main.excel_scanner import scan_workbook
+    
+    path = str(tmp_path / 'wide.xlsx')
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'Data'
+    worksheet.append(['A', 'B'])
+    worksheet.append([1, 2, 'extra'])
+    worksheet.append([3, None])
+    workbook.save(path)
+    
+    with app.app_context():
+        rows = list(iter_sheet_rows(path, 'Data', scan_workbook(path)[0]['column_count']))
+        # Without stored metadata the header sets the width
+        assert list(iter_sheet_rows(path, 'Data')) == [['A', 'B'], (1, 2), (3, None)]
+    df = pd.read_excel(path, sheet_name='Data')
+    assert rows[0] == list(df.columns) == ['A', 'B', 'Unnamed: 2']
+    assert rows[1:] == [(1, 2, 'extra'), (3, None, None)]
+
+def test_query_filters_sorts_and_projects(app, client, auth, excel_file):
+    """Test the query endpoint evaluates typed predicates, sort and paging on the server."""
+    auth.login('owner@example.com', 'testpass')
+    url = f'/api/excel/{excel_file.id}/query'
+    
+    response = client.post(url, json={
+        'sheet': 'Products',
+        'columns': ['Name', 'Qty'],
+        'filters': [{'column': 'Price', 'op': 'range', 'min': 1}],
+        'sort': [{'column': 'Qty', 'direction': 'desc'}]
+    })
+    data = response.get_json()['data']
+    assert data['columns'] == ['Name', 'Qty']
+    assert data['data'] == [{'Name': 'Cherry', 'Qty': 30}, {'Name': 'Apple', 'Qty': 10}]
+    assert data['row_indexes'] == [2, 0]
+    assert data['total_rows'] == 2
+    
+    response = client.post(url, json={
+        'sheet': 'Products',
+        'filters': [{'column': 'Name', 'op': 'contains', 'value': 'AN'}, {'column': 'Qty', 'op': 'in', 'values': [20, 30]}],
+        'limit': 1
+    })
+    data = response.get_json()['data']
+    assert [row['Name'] for row in data['data']] == ['Banana']
+    assert data['total_rows'] == 1
+    
+    response = client.post(url, json={'sheet': 'Products', 'filters': [{'column': 'Price', 'op': 'eq', 'value': 'cheap'}]})
+    assert response.status_code == 400
+    response = client.post(url, json={'sheet': 'Products', 'sort': ['Missing']})
+    assert response.status_code == 400
+
+def test_column_profile_is_maintained_on_edit(app, client, auth, excel_file):
+    """Test column statistics are stored, folded in on append and recomputed after updates."""
+    from app.api.chat_service import format_excel_data_for_prompt
+    
+    auth.login('owner@example.com', 'testpass')
+    url = f'/api/excel/{excel_file.id}/profile?sheet=Products'
+    price = client.get(url).get_json()['profile']['columns']['Price']
+    assert (price['count'], price['min'], price['max'], price['distinct']) == (3, 0.5, 3.0, 3)
+    assert 'hll' not in price
+    
+    client.post(f'/api/excel/{excel_file.id}/row', json={'sheet': 'Products', 'data': {'Name': 'Apple', 'Price': 10}})
+    profile = excel_file.get_sheet('Products').get_profile()
+    assert not profile['stale']
+    assert profile['rows'] == 4
+    assert profile['columns']['Price']['max'] == 10
+    assert profile['columns']['Qty']['null_count'] == 1
+    assert profile['columns']['Name']['top'][0] == ['Apple', 2]
+    
+    client.put(f'/api/excel/{excel_file.id}/cell', json={'sheet': 'Products', 'row': 3, 'column': 'Price', 'value': 0.1})
+    assert excel_file.get_sheet('Products').get_profile()['stale']
+    price = client.get(url).get_json()['profile']['columns']['Price']
+    assert price['min'] == 0.1
+    assert not excel_file.get_sheet('Products').get_profile()['stale']
+    
+    assert 'Price (float64): 4 values' in format_excel_data_for_prompt(excel_file)
+
+def test_appended_rows_update_datetime_min_max():
+    """Test datetime columns keep exact min/max when rows are folded into a profile."""
+    from datetime import datetime
+    from app.main.column_profile import profile_frame, add_rows_to_profile
+    
+    profile = profile_frame(pd.DataFrame({'Date': pd.to_datetime(['2024-01-05', '2024-02-01'])}))
+    add_rows_to_profile(profile, [{'Date': datetime(2023, 12, 31)}, {'Date': datetime(2024, 3, 1)}])
+    date_column = profile['columns']['Date']
+    assert not profile['stale']
+    assert (date_column['min'], date_column['max']) == ('2023-12-31T00:00:00', '2024-03-01T00:00:00')
+    
+    add_rows_to_profile(profile, [{'Date': 'soon'}])
+    assert profile['stale']
+
+def test_appended_values_enter_the_top_values():
+    """Test appended values join the top list or mark the profile stale when their count is unknown."""
+    from app.main.column_profile import TOP_K, profile_frame, add_rows_to_profile
+    
+    profile = profile_frame(pd.DataFrame({'Fruit': ['Apple', 'Apple', 'Pear']}))
+    add_rows_to_profile(profile, [{'Fruit': 'Plum'}, {'Fruit': 'Plum'}, {'Fruit': 'Plum'}])
+    assert not profile['stale']
+    assert profile['columns']['Fruit']['top'] == [['Plum', 3], ['Apple', 2], ['Pear', 1]]
+    
+    # A full list no longer holds every value, so a new one may have overtaken its last entry
+    profile = profile_frame(pd.DataFrame({'Fruit': [f'Fruit {i}' for i in range(TOP_K + 1)]}))
+    add_rows_to_profile(profile, [{'Fruit': f'Fruit {TOP_K}'}])
+    assert profile['stale']
+
+def test_pivot_aggregates_and_caches_by_version(app, client, auth, excel_file, monkeypatch):
+    """Test group-by aggregation results are cached until the file changes."""
+    import app.main.excel_pivot as excel_pivot
+    
+    auth.login('owner@example.com', 'testpass')
+    url = f'/api/excel/{excel_file.id}/pivot'
+    spec = {'sheet': 'Products', 'group_by': [], 'values': ['Qty', 'Price'], 'aggregates': ['sum', 'max']}
+    
+    data = client.post(url, json=spec).get_json()['data']
+    assert data['columns'] == ['Qty_sum', 'Qty_max', 'Price_sum', 'Price_max']
+    assert data['data'] == [{'Qty_sum': 60, 'Qty_max': 30, 'Price_sum': 5.0, 'Price_max': 3.0}]
+    assert data['cached'] is False
+    get_sheet_frame = excel_pivot.get_sheet_frame
+    def no_frame_load(*args):
+        raise AssertionError('cache hit loaded the sheet')
+    monkeypatch.setattr(excel_pivot, 'get_sheet_frame', no_frame_load)
+    assert client.post(url, json=dict(spec, aggregates=['max', 'sum'])).get_json()['data']['cached'] is True
+    monkeypatch.setattr(excel_pivot, 'get_sheet_frame', get_sheet_frame)
+    
+    client.post(f'/api/excel/{excel_file.id}/row', json={'sheet': 'Products', 'data': {'Name': 'Apple', 'Qty': 5}})
+    data = client.post(url, json={'sheet': 'Products', 'group_by': 'Name', 'values': 'Qty',
+                                  'aggregates': ['sum', 'count'], 'sort_by': 'Qty_sum', 'direction': 'desc'}).get_json()['data']
+    assert data['cached'] is False
+    assert data['data'][0] == {'Name': 'Cherry', 'Qty_sum': 30.0, 'Qty_count': 1}
+    assert data['data'][-1] == {'Name': 'Apple', 'Qty_sum': 15.0, 'Qty_count': 2}
+    
+    assert client.post(url, json={'sheet': 'Products', 'values': ['Qty'], 'aggregates': ['median']}).status_code == 400
+    assert client.post(url, json={'sheet': 'Products', 'values': ['Name'], 'aggregates': ['mean']}).status_code == 400
+
+def test_upload_is_ingested_in_background(app, client, auth, excel_file, excel_path, tmp_path):
+    """Test uploads return before ingestion and report progress with an early preview."""
+    from app.models import ExcelFile, IngestStatus
+    from app.main.ingest import run_ingestion
+    
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    auth.login('owner@example.com', 'testpass')
+    
+    # Ingestion runs inline in testing, the request still goes through the queue
+    with open(excel_path, 'rb') as upload:
+        response = client.post('/upload', data={'file': (upload, 'big.xlsx'), 'permission_mode': 'read'},
+                               content_type='multipart/form-data')
+    assert response.status_code == 302
+    uploaded = ExcelFile.query.filter_by(original_filename='big.xlsx').one()
+    status = client.get(f'/api/files/{uploaded.id}/ingest-status').get_json()
+    assert (status['status'], status['progress']) == ('ready', 100)
+    assert 'preview' not in status
+    assert [sheet.name for sheet in uploaded.sheets] == ['Products', 'Cities']
+    assert uploaded.get_sheet('Products').get_profile()['columns']['Qty']['count'] == 3
+    assert uploaded.row_count == 3
+    
+    # While ingestion is pending the first rows are already available
+    uploaded.ingest_status = IngestStatus.PENDING
+    uploaded.ingest_progress = 0
+    db.session.commit()
+    status = client.get(f'/api/files/{uploaded.id}/ingest-status').get_json()
+    assert status['status'] == 'pending'
+    assert status['preview']['columns'] == ['Name', 'Price', 'Qty']
+    assert status['preview']['data'][0] == {'Name': 'Apple', 'Price': 1.5, 'Qty': 10}
+    
+    os.remove(uploaded.file_path)
+    run_ingestion(uploaded.id)
+    status = client.get(f'/api/files/{uploaded.id}/ingest-status').get_json()
+    assert status['status'] == 'failed'
+    assert status['error']
+
+def test_interrupted_and_failed_ingestion_is_run_again(app, client, auth, excel_file):
+    """Test stale pending ingestion is queued again on access and failed ingestion can be retried."""
+    from datetime import datetime, timedelta
+    from app.models import IngestStatus
+    
+    auth.login('owner@example.com', 'testpass')
+    url = f'/api/files/{excel_file.id}/ingest-status'
+    
+    # A worker that was lost with its process left the record processing
+    excel_file.ingest_status = IngestStatus.PROCESSING
+    excel_file.ingest_progress = 40
+    excel_file.last_modified = datetime.utcnow()
+    db.session.commit()
+    assert client.get(url).get_json()['status'] == 'processing'
+    
+    excel_file.last_modified = datetime.utcnow() - timedelta(hours=1)
+    db.session.commit()
+    assert client.get(url).get_json()['status'] == 'ready'
+    
+    retry_url = f'/api/files/{excel_file.id}/ingest-retry'
+    assert client.post(retry_url).status_code == 400
+    excel_file.ingest_status = IngestStatus.FAILED
+    excel_file.ingest_error = 'interrupted'
+    db.session.commit()
+    response = client.post(retry_url)
+    assert response.status_code == 202
+    assert response.get_json()['status'] == 'ready'
+    assert client.get(url).get_json()['error'] is None
+
+def test_chunked_upload_resumes_and_finalizes(app, client, auth, excel_file, excel_path, tmp_path):
+    """Test the resumable upload protocol: init, chunks with offsets, resume, finalize."""
+    import hashlib
+    from app.models import ExcelFile
+    from app.main import uploads
+    
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    auth.login('owner@example.com', 'testpass')
+    with open(excel_path, 'rb') as f:
+        content = f.read()
+    
+    response = client.post('/api/uploads', json={'filename': 'big.xlsx', 'size': len(content), 'permission_mode': 'read_write'})
+    assert response.status_code == 201
+    upload_id = response.get_json()['upload_id']
+    url = f'/api/uploads/{upload_id}'
+    
+    half = len(content) // 2
+    assert client.put(f'{url}?offset=0', data=content[:half]).get_json()['offset'] == half
+    # A retried or out-of-order chunk is rejected with the offset to resume from
+    response = client.put(f'{url}?offset=0', data=content[:half])
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == half
+    assert client.post(f'{url}/finalize').status_code == 409
+    
+    # The next chunk arrives at a worker without the running hash
+    uploads._hashers.clear()
+    offset = client.get(url).get_json()['offset']
+    response = client.put(url, data=content[offset:], headers={'Upload-Offset': str(offset)})
+    assert response.get_json()['complete'] is True
+    
+    response = client.post(f'{url}/finalize')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['sha256'] == hashlib.sha256(content).hexdigest()
+    uploaded = db.session.get(ExcelFile, result['file_id'])
+    assert open(uploaded.file_path, 'rb').read() == content
+    assert uploaded.is_ingested() and uploaded.get_sheet('Products').row_count == 3
+    
+    assert client.post('/api/uploads', json={'filename': 'notes.txt', 'size': 10}).status_code == 400
+    app.config['MAX_UPLOAD_SIZE'] = 100
+    assert client.post('/api/uploads', json={'filename': 'big.xlsx', 'size': 101}).status_code == 400
+
+def test_duplicate_uploads_share_stored_content(app, client, auth, excel_file, excel_path, tmp_path, monkeypatch):
+    """Test identical uploads are stored once, reuse ingestion and are copied before edits."""
+    from app.models import ExcelFile
+    from app.main import ingest
+    
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    auth.login('owner@example.com', 'testpass')
+    
+    def upload(name):
+        with open(excel_path, 'rb') as f:
+            client.post('/upload', data={'file': (f, name), 'permission_mode': 'read_write_delete'},
+                        content_type='multipart/form-data')
+        return ExcelFile.query.filter_by(original_filename=name).one()
+    
+    first = upload('first.xlsx')
+    # The second upload takes the metadata of the first instead of scanning the workbook
+    monkeypatch.setattr(ingest, 'scan_workbook', lambda path: pytest.fail('duplicate was scanned'))
+    second = upload('second.xlsx')
+    third = upload('third.xlsx')
+    assert first.file_path == second.file_path == third.file_path
+    assert first.content_hash and first.content_hash in first.file_path
+    assert second.is_ingested() and second.get_sheet('Products').get_profile()['columns']['Qty']['count'] == 3
+    
+    # Editing gives the file its own copy, the others keep the original content
+    response = client.put(f'/api/excel/{second.id}/cell',
+                          json={'sheet': 'Products', 'row': 0, 'column': 'Qty', 'value': 99})
+    assert response.get_json()['success']
+    assert second.file_path != first.file_path and second.content_hash is None
+    assert pd.read_excel(second.file_path, sheet_name='Products')['Qty'][0] == 99
+    assert pd.read_excel(first.file_path, sheet_name='Products')['Qty'][0] == 10
+    
+    # The stored object is removed with its last reference
+    object_path = first.file_path
+    client.post(f'/file/{first.id}/delete')
+    assert os.path.exists(object_path)
+    client.post(f'/file/{third.id}/delete')
+    assert not os.path.exists(object_path)
+    assert os.path.exists(second.file_path)
+
+def test_release_waits_for_records_committed_with_the_object(app, excel_file, excel_path, tmp_path):
+    """Test a release cannot delete an object while a new reference to it is being committed."""
+    import hashlib
+    import shutil
+    import threading
+    from app.models import ExcelFile
+    from app.main.storage import stored_object
+    from app.main.utils import release_file
+    
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    with open(excel_path, 'rb') as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    
+    def store(name):
+        shutil.copy(excel_path, str(tmp_path / name))
+        return stored_object(str(tmp_path / name), sha256, '.xlsx')
+    
+    with store('a.xlsx') as (object_path, existed):
+        excel_file.file_path = object_path
+        db.session.commit()
+    assert not existed
+    
+    file_id = excel_file.id
+    released = []
+    def release():
+        with app.app_context():
+            released.append(release_file(db.session.get(ExcelFile, file_id)))
+    
+    thread = threading.Thread(target=release)
+    with store('b.xlsx') as (object_path, existed):
+        thread.start()
+        thread.join(0.3)
+        assert existed and thread.is_alive()
+        db.session.add(ExcelFile(user_id=excel_file.user_id, filename='b.xlsx', original_filename='b.xlsx',
+                                 file_path=object_path, file_size=os.path.getsize(object_path)))
+        db.session.commit()
+    thread.join()
+    
+    assert released == [(True, None)]
+    assert os.path.exists(object_path)
+    db.session.refresh(excel_file)
+    assert not excel_file.is_active
+
+def test_concurrent_first_edits_of_a_record_share_its_private_file(app, excel_file, excel_path, tmp_path):
+    """Test a first edit that finds its record already made private uses that file."""
+    import hashlib
+    import shutil
+    import threading
+    from app.models import ExcelFile
+    from app.main.excel_service import modify_excel_data
+    from app.main.storage import stored_object, ensure_private_file
+    
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    with open(excel_path, 'rb') as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    shutil.copy(excel_path, str(tmp_path / 'a.xlsx'))
+    with stored_object(str(tmp_path / 'a.xlsx'), sha256, '.xlsx') as (object_path, existed):
+        excel_file.file_path = object_path
+        other = ExcelFile(user_id=excel_file.user_id, filename='b.xlsx', original_filename='b.xlsx',
+                          file_path=object_path, file_size=os.path.getsize(object_path))
+        db.session.add(other)
+        db.session.commit()
+    
+    def edit_first(file_id, qty):
+        with app.app_context():
+            path = ensure_private_file(db.session.get(ExcelFile, file_id))
+            assert modify_excel_data(path, 'Products', 0, 'Qty', qty) == (True, None)
+    
+    # Each record is loaded here before another request makes it private: first while
+    # the object is shared (copied), then as its last reference (moved)
+    for record, qty in ((excel_file, 99), (other, 77)):
+        assert record.file_path == object_path
+        thread = threading.Thread(target=edit_first, args=(record.id, qty))
+        thread.start()
+        thread.join()
+        private_path = ensure_private_file(record)
+        assert private_path != object_path and record.file_path == private_path
+        assert pd.read_excel(private_path, sheet_name='Products')['Qty'][0] == qty
+    assert not os.path.exists(object_path)
+
+def test_reader_engine_is_selected_from_config(app, excel_path):
+    """Test sheets are parsed by the first installed engine configured for the format."""
+    from app.main import readers
+    from app.main.excel_cache import get_sheet_frame, get_sheet_names
+    
+    # openpyxl is the default, calamine only reads when it is configured
+    assert readers.get_backend(excel_path).name == 'openpyxl'
+    assert readers.get_backend(excel_path, 'sheet_names').name == 'openpyxl'
+    
+    calls = []
+    openpyxl_reader = readers._backends['openpyxl']
+    readers.register_backend(readers.ReaderBackend(
+        'fake', ['xlsx'], 'openpyxl',
+        lambda path, sheet: calls.append(sheet) or openpyxl_reader.read_frame(path, sheet),
+        openpyxl_reader.sheet_names))
+    try:
+        app.config['EXCEL_READERS'] = {'xlsx': {'read': ['missing', 'fake', 'openpyxl'], 'sheet_names': []}}
+        assert readers.get_backend(excel_path).name == 'fake'
+        # No configured engine for the operation: any installed one is used
+        assert readers.get_backend(excel_path, 'sheet_names').formats >= {'xlsx'}
+        assert get_sheet_names(excel_path) == ['Products', 'Cities']
+        assert get_sheet_frame(excel_path, 'Products')['Qty'].tolist() == [10, 20, 30]
+        assert calls == ['Products']
+        
+        result = app.test_cli_runner().invoke(args=['benchmark-readers', excel_path, '--repeat', '1'])
+        assert result.exit_code == 0
+        assert 'fake' in result.output and 'EXCEL_READERS_XLSX=' in result.output
+    finally:
+        readers._backends.pop('fake')
+    
+    with pytest.raises(ValueError):
+        readers.get_backend('notes.txt')
+
+def test_calamine_frames_match_openpyxl(app, tmp_path):
+    """Test the calamine reader parses cells into the same frame as pandas with openpyxl."""
+    pytest.importorskip('python_calamine')
+    from datetime import date, datetime, time
+    from app.main import readers
+    
+    path = str(tmp_path / 'types.xlsx')
+    pd.DataFrame({
+        'Int': [1, 2, 3],
+        'Float': [1.5, None, 3.25],
+        'Text': ['a', None, 'c'],
+        'Date': [date(2024, 1, 5), date(2024, 2, 29), None],
+        'Timestamp': [datetime(2024, 1, 5, 12, 30), datetime(2024, 2, 1), datetime(2024, 3, 1, 8)],
+        'Time': [time(8, 30), time(12), None],
+        'Bool': [True, False, True],
+        'Mixed': [1, 'two', 3.5]
+    }).to_excel(path, sheet_name='Types', index=False)
+    
+    expected = readers.read_frame(path, 'Types', engine='openpyxl')
+    actual = readers.read_frame(path, 'Types', engine='calamine')
+    assert str(actual['Date'].dtype) == 'datetime64[ns]'
+    pd.testing.assert_frame_equal(actual, expected)
+
+def test_cached_frames_are_compacted(app, tmp_path):
+    """Test cached sheets use compact dtypes while readers see the original values and dtypes."""
+    from app.main.excel_cache import get_sheet_frame, cache_stats
+    from app.main.excel_query import run_query
+    from app.main.excel_pivot import compute_pivot, normalize_pivot_spec
+    from app.main.utils import load_excel_window
+    
+    path = str(tmp_path / 'regions.xlsx')
+    pd.DataFrame({
+        'Region': ['North', 'South', None, 'East'] * 10,
+        'Units': list(range(40)),
+        'Price': [1.1] * 40
+    }).to_excel(path, index=False)
+    
+    df = get_sheet_frame(path)
+    assert str(df['Region'].dtype) == 'category'
+    assert df['Units'].dtype == 'int8' and df['Price'].dtype == 'float64'
+    assert cache_stats()['compaction_bytes_saved'] > 0
+    
+    data, error = load_excel_window(path, None, 0, 4)
+    assert error is None
+    assert data['dtypes'] == {'Region': 'object', 'Units': 'int64', 'Price': 'float64'}
+    assert [row['Region'] for row in data['data']] == ['North', 'South', '', 'East']
+    
+    page, total = run_query(df, {'filters': [{'column': 'Region', 'op': 'gt', 'value': 'O'}]})
+    assert total == 10 and set(page['Region']) == {'South'}
+    spec = normalize_pivot_spec(df.columns, {'group_by': ['Region'], 'values': ['Units', 'Region'], 'aggregates': ['sum', 'max']})
+    result = compute_pivot(df, spec)
+    assert result.loc[result['Region'] == 'North', 'Units_sum'].item() == sum(range(0, 40, 4))
+    assert result.loc[result['Region'] == 'East', 'Region_max'].item() == 'East'
+
+def test_file_view_renders_header_and_serves_row_windows(app, client, auth, excel_file):
+    """Test the viewer page ships only the header; rows come from the range endpoint."""
+    auth.login('owner@example.com', 'testpass')
+    
+    page = client.get(f'/file/{excel_file.id}?sheet=Products').get_data(as_text=True)
+    assert 'data-virtual-grid' in page and 'data-total-rows="3"' in page
+    assert '<th>Price</th>' in page
+    assert 'Banana' not in page
+    
+    response = client.get(f'/api/files/{excel_file.id}/rows?sheet=Products&start=1&count=5')
+    assert response.status_code == 200
+    window = response.get_json()
+    assert (window['start'], window['total_rows']) == (1, 3)
+    assert [row['Name'] for row in window['data']] == ['Banana', 'Cherry']
+    assert window['columns'] == ['Name', 'Price', 'Qty']
+    
+    assert client.get(f'/api/files/{excel_file.id}/rows?start=10').get_json()['data'] == []
+    assert client.get('/api/files/999/rows').status_code == 404
+
+def test_data_endpoints_support_etags_and_compression(app, client, auth, excel_file, monkeypatch):
+    """Test unchanged data is revalidated with 304 without reading the file, large JSON is gzipped."""
+    import gzip
+    import json
+    from app.main import utils
+    
+    auth.login('owner@example.com', 'testpass')
+    url = f'/api/files/{excel_file.id}/data?sheet=Products'
+    
+    response = client.get(url)
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    
+    reads = []
+    with monkeypatch.context() as patch:
+        patch.setattr(utils, 'load_excel_window', lambda *args: reads.append(args) or (None, 'read'))
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304 and response.data == b''
+        assert reads == []
+        # Other parameters are another resource
+        client.get(url + '&page=2', headers={'If-None-Match': etag})
+        assert len(reads) == 1
+    
+    client.put(f'/api/excel/{excel_file.id}/cell', json={'sheet': 'Products', 'row': 0, 'column': 'Qty', 'value': 5})
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    
+    app.config['COMPRESS_MIN_SIZE'] = 10
+    response = client.get(f'/api/excel/{excel_file.id}/data?sheet=Products', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'].endswith('-gzip"')
+    payload = json.loads(gzip.decompress(response.data))
+    assert payload['data']['data'][0]['Qty'] == 5
+    revalidated = client.get(f'/api/excel/{excel_file.id}/data?sheet=Products',
+                             headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+
+def test_sheet_data_in_columnar_and_arrow_formats(app, client, auth, excel_file, excel_path):
+    """Test data endpoints answer in the columnar and Arrow formats selected by format= or Accept."""
+    import base64
+    import json
+    import numpy as np
+    import pyarrow as pa
+    from app.main.excel_sidecar import build_sidecars
+    
+    auth.login('owner@example.com', 'testpass')
+    client.put(f'/api/excel/{excel_file.id}/cell', json={'sheet': 'Products', 'row': 1, 'column': 'Price', 'value': ''})
+    url = f'/api/files/{excel_file.id}/rows?sheet=Products'
+    
+    response = client.get(url + '&format=columnar')
+    assert response.mimetype == 'application/vnd.sheet.columnar+json'
+    data = response.get_json()['data']
+    assert data['columns'] == ['Name', 'Price', 'Qty'] and data['rows'] == 3
+    assert data['values'][0] == ['Apple', 'Banana', 'Cherry']
+    assert data['values'][1] == [1.5, 0, 3.0]
+    valid = np.unpackbits(np.frombuffer(base64.b64decode(data['valid'][1]), dtype=np.uint8), bitorder='little')
+    assert valid[:3].tolist() == [1, 0, 1]
+    assert data['valid'][0] is None
+    
+    # Browsers send */*, which keeps the default format
+    assert 'data' in client.get(url, headers={'Accept': '*/*'}).get_json()
+    assert client.get(url + '&format=xml').status_code == 400
+    
+    assert build_sidecars(excel_path) == 2
+    for headers in ({'Accept': 'application/vnd.apache.arrow.stream'}, {}):
+        response = client.get(f'/api/files/{excel_file.id}/data?sheet=Products&per_page=2&format=arrow', headers=headers)
+        assert response.mimetype == 'application/vnd.apache.arrow.stream'
+        table = pa.ipc.open_stream(response.data).read_all()
+        assert table.column('Name').to_pylist() == ['Apple', 'Banana']
+        assert response.headers['X-Total-Rows'] == '3'
+        assert json.loads(table.schema.metadata[b'columns']) == ['Name', 'Price', 'Qty']
+    
+    response = client.get(f'/api/excel/{excel_file.id}/data?sheet=Cities', headers={'Accept': 'application/vnd.apache.arrow.stream'})
+    assert pa.ipc.open_stream(response.data).read_all().column('City').to_pylist() == ['Berlin', 'Moscow']
+
+def test_json_provider_serializes_numpy_and_pandas_values(app):
+    """Test the app JSON provider encodes frames, numpy scalars and missing values like the default one."""
+    import numpy as np
+    from app.json_provider import OrjsonProvider
+    from flask.json.provider import DefaultJSONProvider
+    
+    assert isinstance(app.json, OrjsonProvider)
+    df = pd.DataFrame({
+        'name': ['a', None],
+        'price': [1.5, np.nan],
+        'qty': np.array([1, 2], dtype='int8'),
+        'date': pd.to_datetime(['2024-01-02', None])
+    })
+    with app.app_context():
+        data = app.json.loads(app.json.response({
+            'frame': df,
+            'scalars': [np.int64(7), np.float64('nan'), np.bool_(True), pd.NaT, pd.NA],
+            'array': np.arange(3),
+            1: 'non-string key'
+        }).get_data())
+        
+        assert data['frame'] == [
+            {'name': 'a', 'price': 1.5, 'qty': 1, 'date': 'Tue, 02 Jan 2024 00:00:00 GMT'},
+            {'name': None, 'price': None, 'qty': 2, 'date': None}
+        ]
+        assert data['scalars'] == [7, None, True, None, None]
+        assert data['array'] == [0, 1, 2]
+        assert data['1'] == 'non-string key'
+        
+        # Same records as the former astype(object)/to_dict path
+        from app.main.wire_format import frame_records
+        expected = DefaultJSONProvider(app).dumps(df.astype(object).where(df.notna(), '').to_dict('records'))
+        assert app.json.loads(app.json.dumps(frame_records(df, na_value=''))) == app.json.loads(expected)
+
+def test_prompt_context_is_cached_per_file_version(app, client, auth, excel_file, monkeypatch):
+    """Test chat turns reuse the formatted file context until the file is edited."""
+    from app.api import chat_service
+    
+    calls = []
+    get_file_summary = chat_service.get_file_summary
+    monkeypatch.setattr(chat_service, 'get_file_summary', lambda f: calls.append(f.id) or get_file_summary(f))
+    stats = chat_service.prompt_cache_stats()
+    
+    context = chat_service.get_prompt_context(excel_file, 'en')
+    assert 'Products: 3 rows, 3 columns' in context[1]['content']
+    assert chat_service.get_prompt_context(excel_file, 'en') == context
+    assert chat_service.get_prompt_context(excel_file, 'de')[0]['content'].startswith('Sie sind')
+    assert len(calls) == 2
+    
+    auth.login('owner@example.com', 'testpass')
+    client.post(f'/api/excel/{excel_file.id}/row', json={'sheet': 'Products', 'data': {'Name': 'Fig', 'Qty': 1}})
+    db.session.refresh(excel_file)
+    assert 'Products: 4 rows' in chat_service.get_prompt_context(excel_file, 'en')[1]['content']
+    assert len(calls) == 3
+    
+    new_stats = chat_service.prompt_cache_stats()
+    assert new_stats['hits'] - stats['hits'] == 1
+    assert new_stats['misses'] - stats['misses'] == 3
+    
+    response = client.get('/admin/system')
+    assert response.status_code == 200
+    assert b'Chat prompt contexts' in response.data
+
+def test_token_count_falls_back_when_tokenizer_cannot_load(app, monkeypatch):
+    """Test a tokenizer that fails to load (e.g. offline) is given up once for the estimate."""
+    from types import SimpleNamespace
+    from app.api import chat_history
+    
+    attempts = []
+    def encoding_for_model(model):
+        attempts.append(model)
+        raise ConnectionError('cannot download the BPE file')
+    monkeypatch.setattr(chat_history, 'tiktoken', SimpleNamespace(encoding_for_model=encoding_for_model))
+    monkeypatch.setattr(chat_history, '_encodings', {})
+    
+    assert chat_history.count_tokens('abcdefghi') == 3
+    assert chat_history.truncate_tokens('abcdefghi', 1) == 'fghi'
+    assert attempts == [chat_history.DEFAULT_MODEL]
+
+def test_chat_history_is_token_budgeted_with_rolling_summary(app, client, auth, excel_file, monkeypatch):
+    """Test old turns are summarized once, recent ones sent verbatim and the question only once."""
+    import openai
+    from types import SimpleNamespace
+    from app.api import chat_history
+    from app.models import ChatSession, ChatMessage, MessageType
+    
+    chat_session = ChatSession(user_id=excel_file.user_id, excel_file_id=excel_file.id)
+    db.session.add(chat_session)
+    db.session.commit()
+    
+    def add_turns(start, count):
+        for i in range(start, start + count):
+            for is_user in (True, False):
+                db.session.add(ChatMessage(session_id=chat_session.id, message_type=MessageType.TEXT,
+                                           content=f"{'question' if is_user else 'answer'} {i} " + 'x' * 200,
+                                           language='en', is_user_message=is_user))
+        db.session.commit()
+    
+    folded = []
+    monkeypatch.setattr(chat_history, 'summarize_turns',
+                        lambda previous, messages, max_tokens, model: (folded.append(len(messages)) or
+                                                                       f"{previous or ''}+{len(messages)}"))
+    
+    add_turns(0, 10)
+    messages = chat_session.messages.all()
+    history = chat_history.build_history(messages, max_tokens=400, summary_tokens=50)
+    assert history[0] == {'role': 'system', 'content': 'Summary of the earlier conversation:\n+14'}
+    assert [m['content'][:10] for m in history[1:]] == ['question 7', 'answer 7 x', 'question 8',
+                                                         'answer 8 x', 'question 9', 'answer 9 x']
+    assert sum(chat_history.count_tokens(m['content']) for m in history) <= 400
+    db.session.commit()
+    
+    # Only the turns that fell out of the window since are summarized
+    add_turns(10, 2)
+    history = chat_history.build_history(chat_session.messages.all(), max_tokens=400, summary_tokens=50)
+    assert folded == [14, 4]
+    assert history[0]['content'].endswith('+14+4')
+    assert history[1]['content'].startswith('question 9')
+    
+    # The question is sent once, after the stored history
+    sent = []
+    def create(**kwargs):
+        sent.append(kwargs['messages'])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='reply'))])
+    monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+    app.config.update(OPENAI_API_KEY='test-key', CHAT_HISTORY_MAX_TOKENS=100000)
+    auth.login('owner@example.com', 'testpass')
+    response = client.post('/api/chat/send', json={'session_id': chat_session.id, 'message': 'new question'})
+    assert response.get_json()['assistant_message']['content'] == 'reply'
+    contents = [m['content'] for m in sent[0]]
+    assert contents.count('new question') == 1 and contents[-1] == 'new question'
+
+def test_chat_answer_is_streamed_as_server_sent_events(app, client, auth, excel_file, monkeypatch):
+    """Test the streaming chat endpoint forwards tokens, saves the answer and stops upstream on disconnect."""
+    import json
+    import openai
+    from types import SimpleNamespace
+    from app.models import ChatSession
+    
+    chat_session = ChatSession(user_id=excel_file.user_id, excel_file_id=excel_file.id)
+    db.session.add(chat_session)
+    db.session.commit()
+    auth.login('owner@example.com', 'testpass')
+    app.config.update(OPENAI_API_KEY='test-key')
+    
+    upstream = {'sent': 0, 'closed': False}
+    def create(**kwargs):
+        assert kwargs['stream'] is True
+        def chunks():
+            try:
+                for token in ['The ', 'total ', 'is ', '60.']:
+                    upstream['sent'] += 1
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta={'content': token})])
+            finally:
+                upstream['closed'] = True
+        return chunks()
+    monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+    
+    def events(body):
+        parsed = []
+        for block in body.strip().split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.split('\n'))
+            parsed.append((lines['event'], json.loads(lines['data'])))
+        return parsed
+    
+    response = client.post('/api/chat/stream', json={'session_id': chat_session.id, 'message': 'Total qty?'})
+    assert response.mimetype == 'text/event-stream'
+    received = events(response.get_data(as_text=True))
+    assert [event for event, _ in received] == ['start', 'token', 'token', 'token', 'token', 'done']
+    assert ''.join(data['token'] for event, data in received if event == 'token') == 'The total is 60.'
+    assert received[-1][1]['content'] == 'The total is 60.'
+    assert [(m.is_user_message, m.content) for m in chat_session.messages.all()] == [
+        (True, 'Total qty?'), (False, 'The total is 60.')]
+    
+    # The client goes away after the first token: the upstream stream is closed, no answer is saved
+    upstream.update(sent=0, closed=False)
+    response = client.post('/api/chat/stream', json={'session_id': chat_session.id, 'message': 'Again?'},
+                           buffered=False)
+    stream = iter(response.response)
+    next(stream), next(stream)
+    response.close()
+    assert upstream == {'sent': 1, 'closed': True}
+    assert chat_session.messages.count() == 3
+    
+    monkeypatch.setattr(openai.ChatCompletion, 'create',
+                        lambda **kwargs: (_ for _ in ()).throw(openai.error.RateLimitError('slow down')))
+    received = events(client.post('/api/chat/stream', json={'session_id': chat_session.id, 'message': 'Hi'})
+                      .get_data(as_text=True))
+    assert received[-1] == ('error', {'error': 'OpenAI API rate limit exceeded. Please try again later.'})
+
 if __name__ == '__main__':
     pytest.main([__file__])